@@ -6,7 +6,9 @@ setup(
     author='Patrick Chodowski',
     author_email='chodowski.patrick@gmail.com',
     packages=['stats'],
-    install_requires=['matplotlib', 'google-cloud-bigquery', 'pandas', 'numpy'],
+    install_requires=['matplotlib', 'google-cloud-bigquery', 'pandas', 'numpy', 'pyarrow'],
+    extras_require={'yaml': ['pyyaml']},
+    entry_points={'console_scripts': ['stats=stats.report:main']},
     # *strongly* suggested for sharing
     version='0.6.9',
     license='GPLv3',
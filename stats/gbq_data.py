@@ -1,21 +1,80 @@
-from .utils import GBQ, get_logger, PLOT_TYPES
-from .query_builder import _QueryBuilder
+from .utils import GBQ, QueryCache, TableMetadataCache, RollupRegistry, get_logger, PLOT_TYPES, AGGR_MAP, \
+    ROLLUP_AGGRS, ROLLUP_MAP
+from .query_builder import _QueryBuilder, WrongBindException
 from .plots import _Plots
+from .local_engine import _LocalEngine, merge_partials
+import asyncio
+import datetime
+import functools
 import re
 import os
-from typing import Dict, List, Tuple
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, NamedTuple, Tuple, Union
 import pandas as pd
 
+ROLLUP_TARGETS = ['gbq', 'parquet']
+
+
+class QueryResult(NamedTuple):
+    index: int
+    spec: Dict
+    df: Union[pd.DataFrame, None]
+    error: Union[Exception, None]
+    # validated spec in canonical form (defaults filled in, histogram/scatter_bins/box_summary normalized)
+    canonical_spec: Dict = None
+
 
 class GBQData:
     def __init__(self,
                  gbq_path: str,
                  sa_path: str,
-                 log_level: str = "info"):
+                 log_level: str = "info",
+                 cache_dir: str = None,
+                 cache_max_bytes: int = 1024 ** 3,
+                 cache_ttl: int = 3600,
+                 metadata_dir: str = None,
+                 lazy: bool = False,
+                 max_bytes_billed: int = None,
+                 rollup_dir: str = None):
+        """
+        :param gbq_path: project.dataset.table path of the source table
+        :param sa_path: path to service account json
+        :param log_level: logging level
+        :param cache_dir: Directory for local query result cache. If None, results are not cached
+        :param cache_max_bytes: Max size of the result cache in bytes
+        :param cache_ttl: Time to live of cached result in seconds
+        :param metadata_dir: Directory for table metadata cache. If None, metadata is cached only in process memory
+        :param lazy: If True, connection, table check and metadata load are deferred to first use (or warmup())
+        :param max_bytes_billed: Byte budget of a single query. Queries estimated over it are rejected before running
+        :param rollup_dir: Directory for rollup registry and parquet rollups. If None, rollups are registered in memory
+        """
 
         self.logger = get_logger('stats', log_level=log_level)
         self.PLOT_TYPES = PLOT_TYPES
 
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = QueryCache(cache_dir=cache_dir,
+                                    logger=self.logger,
+                                    max_bytes=cache_max_bytes,
+                                    ttl=cache_ttl)
+        self.metadata_cache = TableMetadataCache(logger=self.logger, metadata_dir=metadata_dir)
+
+        self.max_bytes_billed = max_bytes_billed
+        self.rollup_registry = RollupRegistry(logger=self.logger, rollup_dir=rollup_dir)
+        # partial aggregates of incremental get(), by state spec key
+        self._incremental_state = dict()
+
+        # connection state, set up by _connect() either right away or on first use if lazy
+        self.lazy = lazy
+        self._connect_lock = threading.Lock()
+        self._connected = False
+        self.gbq = None
+        self.table_meta = None
+        self.cols = None
+
         # needed to check credentials first, gbq_path will check if table exist and needs connection ready
         self.sa_path = sa_path
         self.gbq_path = gbq_path
@@ -23,11 +82,15 @@ class GBQData:
         # Query attributes
         self.query_builder = None
         self.query = None
+        self.spec = None
 
         # used to move data from .set() to .get() method
         self.dimensions = None
         self.metrics = None
         self.aggregations = None
+        self.histogram = None
+        self.scatter_bins = None
+        self.box_summary = None
 
         # to access plots 'machine' ;d
         self.plots = None
@@ -64,6 +127,7 @@ class GBQData:
     def gbq_path(self, gbq_path):
         """
         Validating if path is project.dataset.table format and if table exists
+        (table check is deferred to first use in lazy mode)
         """
         if gbq_path is None:
             raise GBQWrongPathPatternException("GBQ path is empty")
@@ -76,15 +140,37 @@ class GBQData:
         self.dataset_id = gbq_path_list[1]
         self.table_id = gbq_path_list[2]
 
-        # setting up connection
-        self._setup_gbq()
-        if not self.gbq.check_if_table_exists(dataset_id=self.dataset_id, table_id=self.table_id):
-            raise GBQTableNotExistException(f'GBQ table {gbq_path} doesnt exist')
+        self._gbq_path = gbq_path
+        self._connected = False
+        if not self.lazy:
+            self._connect()
 
-        # returning dictionary of table column names and types
-        self.cols = self._get_table_cols_dict()
+    def warmup(self, background: bool = False) -> Union[threading.Thread, None]:
+        """
+        Sets up connection, checks if table exists and loads its metadata ahead of first use
+        :param background: Run it in a daemon thread, so it can overlap with other initialisation
+        :return: Started thread if background is True, otherwise None
+        """
+        if background:
+            thread = threading.Thread(target=self._connect, name='stats-warmup', daemon=True)
+            thread.start()
+            return thread
+        self._connect()
 
-        self._gbq_path = gbq_path
+    def _connect(self) -> None:
+        """
+        Sets up GBQ client, checks if table exists and loads table metadata. Runs only once per gbq_path,
+        safe to call from multiple threads
+        """
+        with self._connect_lock:
+            if self._connected:
+                return
+            self._setup_gbq()
+
+            # table metadata, with dictionary of table column names and types
+            self.table_meta = self._get_table_meta(self.gbq_path)
+            self.cols = self.table_meta['cols']
+            self._connected = True
 
     def _setup_gbq(self) -> None:
         """
@@ -92,7 +178,26 @@ class GBQData:
         """
         self.gbq = GBQ(project_id=self.project_id,
                        sa_credentials=self.sa_path,
-                       logger=self.logger)
+                       logger=self.logger,
+                       max_bytes_billed=self.max_bytes_billed)
+
+    def _get_table_meta(self, gbq_path: str) -> Dict:
+        """
+        Gets table metadata from cache, if its still valid for table last modified time.
+        Otherwise loads the columns from INFORMATION_SCHEMA and caches them
+        :param gbq_path: project.dataset.table
+        :return: Dictionary of cols, modified, partitioning, clustering
+        """
+        table_info = self.gbq.get_table_info(dataset_id=self.dataset_id, table_id=self.table_id)
+        if table_info is None:
+            raise GBQTableNotExistException(f'GBQ table {gbq_path} doesnt exist')
+
+        table_meta = self.metadata_cache.get(gbq_path, modified=table_info['modified'])
+        if table_meta is None:
+            table_meta = table_info
+            table_meta['cols'] = self._get_table_cols_dict()
+            self.metadata_cache.put(gbq_path, table_meta)
+        return table_meta
 
     def _get_table_cols_dict(self) -> Dict[str, str]:
         """
@@ -109,7 +214,16 @@ class GBQData:
             aggregations: List[str] = None,
             sort: Tuple[str, str] = None,
             filters: List[Tuple] = None,
-            limit: int = None
+            limit: int = None,
+            approximate: bool = False,
+            date_range: Tuple[str, str] = None,
+            partition_filter: str = 'warn',
+            sample: Union[float, Dict] = None,
+            histogram: Union[int, Dict] = None,
+            scatter_bins: Union[int, Dict] = None,
+            box_summary: Union[bool, Dict] = None,
+            use_rollups: bool = True,
+            parameterized: bool = False
             ) -> None:
         """
         Builds _QueryBuilder, by sending all parameters needed for a query
@@ -120,51 +234,563 @@ class GBQData:
         :param sort: Tuple of column name and ordering direction ('a', asc)
         :param filters: List of tuples of (column, operation, value(s))
         :param limit: Limit of how many rows to return from query
+        :param approximate: Use approximate aggregations (APPROX_COUNT_DISTINCT, APPROX_QUANTILES) in plain GROUP BY
+        :param date_range: Tuple of (start, end) dates, filters partition column of time partitioned table
+        :param partition_filter: What to do with query not filtering partitioned table: 'warn', 'require', 'ignore'
+        :param sample: Sample rate or dictionary of rate, method ('system'/'hash'), key, stratify, min_rows.
+            Result frame keeps the rate in df.attrs['sample_rate'] (stratified sample adds sample_rate column)
+        :param histogram: Number of bins or dictionary of method ('count'/'width'/'quantile'), bins, width.
+            Bins first metric in GBQ, returns bin_start, bin_end and count per group instead of raw rows
+        :param scatter_bins: Number of bins per axis or dictionary of bins, sparse. Bins first two metrics on 2D grid
+            in GBQ, rows from cells with at most 'sparse' rows are returned as points
+        :param box_summary: True or dictionary of whis, fliers. Calculates boxplot statistics of metrics per group
+            in GBQ (quartiles, whiskers, number of fliers and up to 'fliers' of them), requires aggregations=['none'].
+            Quartiles come from APPROX_QUANTILES, so they are approximate. Table is scanned twice
+            (quartiles, then whiskers and fliers)
+        :param use_rollups: Route query to the smallest compatible up to date rollup (see create_rollup)
+        :param parameterized: Send filter values as BigQuery query parameters instead of writing them into the query,
+            so .bind() can change them later without building the query again
         :return: Query string to send
         """
-
-        self.query_builder = _QueryBuilder(project_id=self.project_id,
-                                           dataset_id=self.dataset_id,
-                                           table_id=self.table_id,
-                                           logger=self.logger,
-                                           cols=self.cols,
-                                           dimensions=dimensions,
-                                           metrics=metrics,
-                                           aggregations=aggregations,
-                                           sort=sort,
-                                           filters=filters,
-                                           limit=limit)
-
+        self.query_builder = self._make_query_builder(dimensions=dimensions,
+                                                      metrics=metrics,
+                                                      aggregations=aggregations,
+                                                      sort=sort,
+                                                      filters=filters,
+                                                      limit=limit,
+                                                      approximate=approximate,
+                                                      date_range=date_range,
+                                                      partition_filter=partition_filter,
+                                                      sample=sample,
+                                                      histogram=histogram,
+                                                      scatter_bins=scatter_bins,
+                                                      box_summary=box_summary,
+                                                      use_rollups=use_rollups,
+                                                      parameterized=parameterized)
         self.query = self.query_builder.glue_query()
+        self.spec = self.query_builder.get_spec()
         self.dimensions = dimensions
         self.metrics = metrics
         self.aggregations = aggregations
+        self.histogram = self.query_builder.histogram
+        self.scatter_bins = self.query_builder.scatter_bins
+        self.box_summary = self.query_builder.box_summary
+
+    def bind(self, **values) -> None:
+        """
+        Changes filter values of query set with parameterized=True. Query text stays the same,
+        so it is not built and validated again and GBQ can reuse its cached result for the same values
+        :param values: Parameter name and new value(s), like pts_gt=10 or team_abbreviation_in=['DEN', 'LAL'].
+            Names are column_operand (see query_builder.get_query_params())
+        """
+        if self.query_builder is None:
+            raise WrongBindException("Nothing to bind, call .set() first")
+        self.query_builder.bind(**values)
+        self.spec = self.query_builder.get_spec()
 
-    def get(self) -> pd.DataFrame:
+    def _make_query_builder(self, use_rollups: bool = True, **params) -> _QueryBuilder:
+        """
+        Validates query parameters (same as .set() takes) by building _QueryBuilder for this table
+        :param use_rollups: Pass up to date rollups of the table, so query can be routed to one of them
+        :return: Validated _QueryBuilder
         """
-        Placeholder method for now.
-        Sends self.query to gbq and retrieves pandas DF
+        self._connect()
+        return _QueryBuilder(project_id=self.project_id,
+                             dataset_id=self.dataset_id,
+                             table_id=self.table_id,
+                             logger=self.logger,
+                             cols=self.cols,
+                             partitioning=self.table_meta['partitioning'],
+                             clustering=self.table_meta['clustering'],
+                             rollups=self._usable_rollups() if use_rollups else None,
+                             **params)
+
+    def get(self, use_arrow: bool = True, use_cache: bool = True, incremental: str = None) -> pd.DataFrame:
+        """
+        Sends self.query to gbq and retrieves pandas DF.
+        If cache_dir was provided, identical specs are read from local cache instead
+        :param use_arrow: Columnar (arrow) fetch, set to False to use row by row dict fetch
+        :param use_cache: Set to False to skip reading from the cache (fresh result is still cached)
+        :param incremental: Watermark column of append-only table (like ingestion timestamp). Partial aggregates
+            are stored with the highest watermark and next get() queries only newer rows and merges them.
+            Works for sum, count, min, max and avg, other specs fall back to full query.
+            Result has df.attrs['incremental'] set to True if it was refreshed incrementally
         :return: DataFrame with raw data as it can be useful too
         """
-        df = self.gbq.get_data(query=self.query)
+        if incremental is not None:
+            df = self._get_incremental(watermark=incremental, use_arrow=use_arrow)
+        else:
+            df = self._fetch(spec=self.spec, query=self.query, use_arrow=use_arrow, use_cache=use_cache,
+                             query_builder=self.query_builder)
+        self.df = df
+        return df
+
+    def _get_incremental(self, watermark: str, use_arrow: bool = True) -> pd.DataFrame:
+        """
+        Refreshes partial aggregates (sum, count, min, max per dimensions and highest watermark) of current spec
+        with rows newer than stored watermark and computes the result from them locally.
+        Rows are expected to only be appended with growing watermark (rows with watermark equal
+        to the stored one, added after the last refresh, are not picked up)
+        :param watermark: Watermark column
+        :param use_arrow: Columnar (arrow) fetch, set to False to use row by row dict fetch
+        :return: Query result
+        """
+        qb = self.query_builder
+        if not self._is_incremental_spec(qb):
+            self.logger.warning(f"Spec with {qb.aggregations} cant be merged incrementally, running full query")
+            df = self._fetch(spec=self.spec, query=self.query, use_arrow=use_arrow, use_cache=False,
+                             query_builder=qb)
+            df.attrs['incremental'] = False
+            return df
+
+        state_params = dict(dimensions=qb.dimensions, metrics=qb.metrics, aggregations=ROLLUP_AGGRS,
+                            date_range=qb.date_range, partition_filter=qb.partition_filter, watermark=watermark,
+                            use_rollups=False)
+        state_qb = self._make_query_builder(filters=qb.filters, **state_params)
+        state_spec = state_qb.get_spec()
+        state_key = QueryCache.make_key(state_spec)
+
+        state = self._incremental_state.get(state_key)
+        if (state is None) and (self.cache is not None):
+            state = self.cache.get(state_spec)
+
+        self._connect()
+        if (state is None) or state['__watermark'].isna().all():
+            self.logger.info(f"No stored aggregates for watermark {watermark}, running full query")
+            state_query = state_qb.glue_query()
+            self._check_budget(state_query)
+            state = self.gbq.get_data(query=state_query, use_arrow=use_arrow)
+            is_incremental = False
+        else:
+            high_watermark = self._watermark_value(state['__watermark'].max())
+            self.logger.info(f"Querying rows with {watermark} > {high_watermark}")
+            delta_filters = (qb.filters or list()) + [(watermark, 'gt', high_watermark)]
+            delta_qb = self._make_query_builder(filters=delta_filters, **state_params)
+            delta_query = delta_qb.glue_query()
+            self._check_budget(delta_query)
+            delta = self.gbq.get_data(query=delta_query, use_arrow=use_arrow)
+            if delta.shape[0] > 0:
+                state = merge_partials([state, delta], dimensions=qb.dimensions, metrics=qb.metrics)
+            is_incremental = True
+
+        self._incremental_state[state_key] = state
+        if self.cache is not None:
+            self.cache.put(state_spec, state)
+
+        # result from partial aggregates, filters are already applied in gbq
+        result_qb = self._make_query_builder(dimensions=qb.dimensions, metrics=qb.metrics,
+                                             aggregations=qb.aggregations, sort=qb.sort, limit=qb.limit,
+                                             partition_filter='ignore', use_rollups=False)
+        df = _LocalEngine(query_builder=result_qb, df=state, logger=self.logger,
+                          rollup={'dimensions': qb.dimensions, 'metrics': qb.metrics}).run()
+        df.attrs['incremental'] = is_incremental
+        return df
+
+    @staticmethod
+    def _is_incremental_spec(query_builder: _QueryBuilder) -> bool:
+        """
+        Checks if result can be computed from partial aggregates (sum, count, min, max)
+        :param query_builder: _QueryBuilder of the spec
+        :return: True if spec can be refreshed incrementally
+        """
+        return set(query_builder.aggregations).issubset(set(ROLLUP_MAP.keys())) and \
+            (query_builder.sample is None) and (query_builder.histogram is None) and \
+            (query_builder.scatter_bins is None) and (query_builder.box_summary is None)
+
+    @staticmethod
+    def _watermark_value(value) -> Union[int, float, str]:
+        """
+        Turns highest watermark from result into filter value
+        :param value: Timestamp, date or number
+        :return: Number or string literal that GBQ compares with the watermark column
+        """
+        if isinstance(value, (pd.Timestamp, datetime.datetime, datetime.date)):
+            return value.isoformat()
+        if hasattr(value, 'item'):
+            return value.item()
+        return value
+
+    def estimate(self) -> Dict:
+        """
+        Dry runs self.query: validates it on the server side and estimates its cost without running it
+        :return: Dictionary of total_bytes_processed and referenced_tables
+        """
+        self._connect()
+        return self.gbq.dry_run(query=self.query, params=self.query_builder.get_query_params())
+
+    def _check_budget(self, query: str, params: Dict = None) -> None:
+        """
+        If max_bytes_billed is set, dry runs the query and rejects it if estimate is over budget
+        :param query: Query string
+        :param params: Named query parameters
+        """
+        if self.max_bytes_billed is None:
+            return
+        estimate = self.gbq.dry_run(query=query, params=params)
+        if estimate['total_bytes_processed'] > self.max_bytes_billed:
+            raise QueryOverBudgetException(f"Query would process {estimate['total_bytes_processed']} bytes, "
+                                           f"over max_bytes_billed ({self.max_bytes_billed})")
+
+    def get_local(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Evaluates current .set() spec on local DataFrame (table or its extract) instead of sending query to gbq.
+        Result has the same columns as .get() would return
+        :param df: Local DataFrame with table columns
+        :return: DataFrame with query result
+        """
+        result = _LocalEngine(query_builder=self.query_builder, df=df, logger=self.logger).run()
+        self.df = result
+        return result
+
+    def _fetch(self,
+               spec: Dict,
+               query: str,
+               use_arrow: bool = True,
+               use_cache: bool = True,
+               query_builder: _QueryBuilder = None) -> pd.DataFrame:
+        """
+        Reads query result from cache, from local parquet rollup or sends query to gbq (and caches the result)
+        :param spec: Canonical query spec from _QueryBuilder.get_spec
+        :param query: Query string
+        :param use_arrow: Columnar (arrow) fetch, set to False to use row by row dict fetch
+        :param use_cache: Set to False to skip reading from the cache
+        :param query_builder: _QueryBuilder of the query, needed to answer it from parquet rollup
+        :return: Query result
+        """
+        df = None
+        if (self.cache is not None) and use_cache:
+            df = self.cache.get(spec)
+
+        if (df is None) and (query_builder is not None) and (query_builder.rollup is not None) and \
+                (query_builder.rollup['target'] == 'parquet'):
+            df = self._fetch_parquet_rollup(query_builder)
+
+        if df is None:
+            params = query_builder.get_query_params() if query_builder is not None else None
+            self._connect()
+            self._check_budget(query, params=params)
+            df = self.gbq.get_data(query=query, use_arrow=use_arrow, params=params)
+            if self.cache is not None:
+                self.cache.put(spec, df)
+        self._mark_sample_rate(df, spec)
+        return df
+
+    @staticmethod
+    def _mark_sample_rate(df: pd.DataFrame, spec: Dict) -> None:
+        """
+        Records sampling rate of the query in df.attrs, so sums and counts can be scaled back up
+        :param df: Query result
+        :param spec: Canonical query spec from _QueryBuilder.get_spec
+        """
+        sample = spec.get('sample')
+        if (sample is not None) and (not sample['stratify']):
+            df.attrs['sample_rate'] = sample['rate']
+
+    def get_many(self,
+                 specs: List[Dict],
+                 max_workers: int = 8,
+                 use_arrow: bool = True,
+                 use_cache: bool = True) -> List[QueryResult]:
+        """
+        Runs multiple query specs concurrently and returns results in the same order as specs.
+        Doesnt change .set() state or self.df
+        :param specs: List of dictionaries with .set() parameters
+        :param max_workers: Max number of queries running at the same time
+        :param use_arrow: Columnar (arrow) fetch, set to False to use row by row dict fetch
+        :param use_cache: Set to False to skip reading from the cache
+        :return: List of QueryResult, failed query has df None and the exception in error
+        """
+        results = sorted(self.iter_many(specs, max_workers=max_workers, use_arrow=use_arrow, use_cache=use_cache),
+                         key=lambda r: r.index)
+        return results
+
+    def iter_many(self,
+                  specs: List[Dict],
+                  max_workers: int = 8,
+                  use_arrow: bool = True,
+                  use_cache: bool = True) -> Iterator[QueryResult]:
+        """
+        Runs multiple query specs concurrently and yields results as they complete.
+        All specs are validated before any query is sent, so invalid spec raises right away (not on first next()).
+        Errors of a single query dont stop the others, they are returned in QueryResult.error.
+        QueryResult.canonical_spec holds the validated spec, e.g. normalized binning settings for plotting
+        :param specs: List of dictionaries with .set() parameters
+        :param max_workers: Max number of queries running at the same time
+        :param use_arrow: Columnar (arrow) fetch, set to False to use row by row dict fetch
+        :param use_cache: Set to False to skip reading from the cache
+        :return: Generator of QueryResult
+        """
+        query_builders = list()
+        for index, spec in enumerate(specs):
+            try:
+                query_builders.append(self._make_query_builder(**spec))
+            except Exception as e:
+                raise InvalidSpecException(f"Spec index [{index}] is invalid: {e}") from e
+        return self._iter_fetch(query_builders, specs, max_workers=max_workers, use_arrow=use_arrow,
+                                use_cache=use_cache)
+
+    def _iter_fetch(self,
+                    query_builders: List[_QueryBuilder],
+                    specs: List[Dict],
+                    max_workers: int = 8,
+                    use_arrow: bool = True,
+                    use_cache: bool = True) -> Iterator[QueryResult]:
+        """
+        Fetches results of already validated query builders concurrently, yields them as they complete
+        :param query_builders: Validated _QueryBuilder of every spec
+        :param specs: List of dictionaries with .set() parameters, returned in QueryResult.spec
+        :param max_workers: Max number of queries running at the same time
+        :param use_arrow: Columnar (arrow) fetch, set to False to use row by row dict fetch
+        :param use_cache: Set to False to skip reading from the cache
+        :return: Generator of QueryResult
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict()
+            for index, query_builder in enumerate(query_builders):
+                future = executor.submit(self._fetch,
+                                         spec=query_builder.get_spec(),
+                                         query=query_builder.glue_query(),
+                                         use_arrow=use_arrow,
+                                         use_cache=use_cache,
+                                         query_builder=query_builder)
+                futures[future] = index
+
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    yield QueryResult(index=index, spec=specs[index], df=future.result(), error=None,
+                                      canonical_spec=query_builders[index].get_spec())
+                except Exception as e:
+                    self.logger.error(f"Spec index [{index}] failed: {e}")
+                    yield QueryResult(index=index, spec=specs[index], df=None, error=e,
+                                      canonical_spec=query_builders[index].get_spec())
+
+    async def aget(self, use_arrow: bool = True, use_cache: bool = True, poll_interval: float = 0.5) -> pd.DataFrame:
+        """
+        Async version of get(). Query job is polled and pages are fetched without blocking the event loop,
+        cancelling the awaiting task cancels the query job
+        :param use_arrow: Columnar (arrow) fetch, set to False to use row by row dict fetch
+        :param use_cache: Set to False to skip reading from the cache (fresh result is still cached)
+        :param poll_interval: Seconds between job state checks
+        :return: DataFrame with raw data
+        """
+        loop = asyncio.get_running_loop()
+        df = None
+        if (self.cache is not None) and use_cache:
+            df = await loop.run_in_executor(None, self.cache.get, self.spec)
+
+        if df is None:
+            await loop.run_in_executor(None, self._connect)
+            params = self.query_builder.get_query_params()
+            await loop.run_in_executor(None, functools.partial(self._check_budget, self.query, params=params))
+            df = await self.gbq.aget_data(query=self.query, use_arrow=use_arrow, poll_interval=poll_interval,
+                                          params=params)
+            if self.cache is not None:
+                await loop.run_in_executor(None, self.cache.put, self.spec, df)
+
+        self._mark_sample_rate(df, self.spec)
         self.df = df
         return df
 
-    def plot(self, plot_type: str) -> None:
+    def _fetch_parquet_rollup(self, query_builder: _QueryBuilder) -> Union[pd.DataFrame, None]:
+        """
+        Answers query by re-aggregating local parquet rollup
+        :param query_builder: _QueryBuilder routed to parquet rollup
+        :return: Query result or None if rollup file is missing (query goes to gbq then)
+        """
+        rollup = query_builder.rollup
+        if not os.path.isfile(rollup['location']):
+            self.logger.warning(f"Rollup file {rollup['location']} is missing, querying the source table")
+            return None
+        rollup_df = pd.read_parquet(rollup['location'])
+        return _LocalEngine(query_builder=query_builder, df=rollup_df, logger=self.logger, rollup=rollup).run()
+
+    def create_rollup(self,
+                      name: str,
+                      dimensions: List[str],
+                      metrics: List[str],
+                      target: str = 'gbq') -> Dict:
+        """
+        Materializes rollup of the table: sum, count, min and max of metrics grouped by dimensions.
+        Later .set() calls with sum/count/min/max/avg of these metrics, grouped and filtered by these dimensions,
+        are answered from the smallest such rollup. Rollup is used only while source table is not modified
+        :param name: Rollup name (letters, digits, _)
+        :param dimensions: Rollup dimensions
+        :param metrics: Rollup metrics
+        :param target: 'gbq' for table {table_id}__rollup_{name} in the same dataset,
+            'parquet' for file in rollup_dir (answered locally without query)
+        :return: Rollup dictionary
+        """
+        if not re.fullmatch(r"[A-Za-z0-9_]+", name):
+            raise WrongRollupException(f"Rollup name {name} can have only letters, digits and _")
+        if target not in ROLLUP_TARGETS:
+            raise WrongRollupException(f"Rollup target has to be one of {ROLLUP_TARGETS}")
+        if (target == 'parquet') and (self.rollup_registry.rollup_dir is None):
+            raise WrongRollupException("Parquet rollup requires rollup_dir")
+
+        # validates columns the same way as query
+        self._make_query_builder(dimensions=dimensions, metrics=metrics, aggregations=ROLLUP_AGGRS,
+                                 partition_filter='ignore', use_rollups=False)
+        # up to date modified time, rollup is built from current data
+        self.table_meta = self._get_table_meta(self.gbq_path)
+
+        metrics_str = ', '.join([f"{AGGR_MAP[aggr].replace('__metric__', m)} AS {aggr}_{m}"
+                                 for aggr in ROLLUP_AGGRS for m in metrics])
+        select_str = f"""
+        SELECT {', '.join(dimensions)}, {metrics_str}
+        FROM `{self.gbq_path}`
+        GROUP BY {', '.join(dimensions)}"""
+
+        if target == 'gbq':
+            location = f"{self.project_id}.{self.dataset_id}.{self.table_id}__rollup_{name}"
+            self.gbq.send_query(f"CREATE OR REPLACE TABLE `{location}` AS {select_str}")
+            num_rows = self.gbq.get_table_info(dataset_id=self.dataset_id,
+                                               table_id=f"{self.table_id}__rollup_{name}")['num_rows']
+        else:
+            location = os.path.join(self.rollup_registry.rollup_dir, f"{self.gbq_path}__rollup_{name}.parquet")
+            rollup_df = self.gbq.get_data(query=select_str)
+            tmp_path = f"{location}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+            rollup_df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, location)
+            num_rows = rollup_df.shape[0]
+
+        rollup = {'name': name,
+                  'dimensions': list(dimensions),
+                  'metrics': list(metrics),
+                  'target': target,
+                  'location': location,
+                  'num_rows': num_rows,
+                  'source_modified': self.table_meta['modified']}
+        self.rollup_registry.put(self.gbq_path, rollup)
+        return rollup
+
+    def refresh_rollups(self) -> None:
+        """
+        Rebuilds all rollups of the table from current data
+        """
+        for rollup in self.rollup_registry.get(self.gbq_path):
+            self.create_rollup(name=rollup['name'], dimensions=rollup['dimensions'], metrics=rollup['metrics'],
+                               target=rollup['target'])
+
+    def drop_rollup(self, name: str) -> None:
+        """
+        Removes rollup table or file and its registry entry
+        :param name: Rollup name
+        """
+        for rollup in self.rollup_registry.get(self.gbq_path):
+            if rollup['name'] != name:
+                continue
+            if rollup['target'] == 'gbq':
+                self._connect()
+                self.gbq.send_query(f"DROP TABLE IF EXISTS `{rollup['location']}`")
+            elif os.path.isfile(rollup['location']):
+                os.remove(rollup['location'])
+            self.rollup_registry.remove(self.gbq_path, name)
+
+    def _usable_rollups(self) -> List[Dict]:
+        """
+        Rollups of the table built from its current version (same last modified time).
+        Modified time is read again on every call (single tables.get request), as table_meta of long-lived
+        instance gets outdated. If it cant be read, no rollup is used
+        :return: List of rollup dictionaries
+        """
+        rollups = self.rollup_registry.get(self.gbq_path)
+        if rollups.__len__() == 0:
+            return list()
+        try:
+            table_info = self.gbq.get_table_info(dataset_id=self.dataset_id, table_id=self.table_id)
+        except Exception as e:
+            self.logger.warning(f"Cant check last modified time of {self.gbq_path} ({e}), not using rollups")
+            return list()
+        if table_info is None:
+            return list()
+
+        usable = list()
+        for rollup in rollups:
+            if rollup['source_modified'] == table_info['modified']:
+                usable.append(rollup)
+            else:
+                self.logger.info(f"Rollup {rollup['name']} is outdated, run refresh_rollups() to use it again")
+        return usable
+
+    def invalidate_cache(self) -> None:
+        """
+        Removes all cached results of this table, including stored partial aggregates of incremental get()
+        """
+        self._incremental_state.clear()
+        if self.cache is not None:
+            self.cache.invalidate(table=self.gbq_path)
+
+    def iter_batches(self, page_size: int = 10000, use_arrow: bool = True, as_arrow: bool = False) -> Iterator:
+        """
+        Sends self.query to gbq and yields the result in chunks of at most page_size rows.
+        Nothing is kept in self.df, so memory stays bounded by a single page.
+        Stopping the iteration early stops fetching next pages. Query over max_bytes_billed is refused before sending.
+        :param page_size: Max number of rows in a single chunk
+        :param use_arrow: Columnar (arrow) fetch, set to False to use row by row dict fetch
+        :param as_arrow: Yield pyarrow.RecordBatch instead of pd.DataFrame
+        :return: Generator of DataFrames (or RecordBatches)
+        """
+        self._connect()
+        params = self.query_builder.get_query_params()
+        self._check_budget(self.query, params=params)
+        return self.gbq.iter_data(query=self.query, page_size=page_size, use_arrow=use_arrow, as_arrow=as_arrow,
+                                  params=params)
+
+    def plot(self, plot_type: str, **kwargs):
         """
         Create plot with owned data
         :param plot_type: One of self.PLOT_TYPES
-        :return: None, opens window with the plot
+        :param kwargs: Plot specific settings, passed to the plot method (e.g. max_labels, label_rank for scatter)
+        :return: Figure (shown by pyplot), also kept in self.plots_created
         """
         if plot_type in self.PLOT_TYPES:
-            self.plots = _Plots(df=self.df,
-                                dimensions=self.dimensions,
-                                metrics=self.metrics,
-                                aggregations=self.aggregations,
-                                logger=self.logger)
-            p = getattr(self.plots, plot_type)()
+            self.plots = self._make_plots(self.df)
+            p = getattr(self.plots, plot_type)(**kwargs)
             self.plots_created.append(p)
-
+            return p
+
+    def render(self,
+               plot_type: str,
+               format: str = 'png',
+               dpi: int = 100,
+               path: str = None,
+               **kwargs) -> Union[bytes, None]:
+        """
+        Renders plot with owned data headless (Agg canvas, no pyplot window), safe to call from worker threads
+        and processes. Figure is closed after saving
+        :param plot_type: One of self.PLOT_TYPES
+        :param format: Image format, one of RENDER_FORMATS ('png', 'svg')
+        :param dpi: Resolution of the image
+        :param path: If provided, image is written to this file
+        :param kwargs: Plot specific settings, passed to the plot method
+        :return: Image bytes, or None if written to path
+        """
+        # shallow copy, plots add helper columns (group, iqr) and df can be shared between threads
+        plots = self._make_plots(self.df.copy(deep=False))
+        image = plots.render(plot_type, format=format, dpi=dpi, **kwargs)
+        if path is None:
+            return image
+
+        tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(image)
+        os.replace(tmp_path, path)
+        self.logger.info(f"Saved {plot_type} to {path}")
+
+    def _make_plots(self, df: pd.DataFrame) -> _Plots:
+        return _Plots(df=df,
+                      dimensions=self.dimensions,
+                      metrics=self.metrics,
+                      aggregations=self.aggregations,
+                      logger=self.logger,
+                      histogram=self.histogram,
+                      scatter_bins=self.scatter_bins,
+                      box_summary=self.box_summary)
+
+
+class WrongRollupException(Exception):
+    pass
 
 
 class GBQWrongPathPatternException(Exception):
@@ -177,3 +803,11 @@ class GBQTableNotExistException(Exception):
 
 class WrongServiceAccountPathException(Exception):
     pass
+
+
+class InvalidSpecException(Exception):
+    pass
+
+
+class QueryOverBudgetException(Exception):
+    pass
@@ -0,0 +1,287 @@
+from .utils import WINDOW_AGGRS, AGGR_MAP, ROLLUP_AGGRS
+from .query_builder import _QueryBuilder
+import re
+import logging
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+
+
+# quantile levels of PERCENTILE_CONT based aggregations, read from AGGR_MAP so both backends stay in sync
+QUANTILES = {aggr: float(re.search(r"PERCENTILE_CONT\(__metric__, ([0-9.]+)\)", aggr_str).group(1))
+             for aggr, aggr_str in AGGR_MAP.items() if aggr_str.startswith("PERCENTILE_CONT")}
+
+GROUP_AGGR_FUNCS = {
+    "avg": lambda g: g.mean(),
+    "sum": lambda g: g.sum(min_count=1),
+    "min": lambda g: g.min(),
+    "max": lambda g: g.max(),
+    "count": lambda g: g.count(),
+    "count_distinct": lambda g: g.nunique(),
+    "count_nulls": lambda g: g.size() - g.count(),
+    "any": lambda g: g.first(),
+    "string_agg": lambda g: g.agg(lambda s: _string_agg(s)),
+    "array_agg": lambda g: g.agg(lambda s: s.dropna().tolist()),
+    "string_agg_distinct": lambda g: g.agg(lambda s: _string_agg(s.drop_duplicates())),
+    "array_agg_distinct": lambda g: g.agg(lambda s: s.dropna().drop_duplicates().tolist()),
+    "min_run": lambda g: g.min(),
+    "max_run": lambda g: g.max(),
+    "stdev": lambda g: g.std(ddof=0),
+    "var": lambda g: g.var(ddof=0),
+}
+
+
+def _string_agg(s: pd.Series):
+    s = s.dropna()
+    return ','.join(s.astype(str)) if s.__len__() > 0 else None
+
+
+class _LocalEngine:
+    def __init__(self,
+                 query_builder: _QueryBuilder,
+                 df: pd.DataFrame,
+                 logger: logging.Logger,
+                 rollup: Dict = None):
+        """
+        Class name with _ as its not supposed to be called directly
+
+        Evaluates validated _QueryBuilder spec on a local pandas DataFrame instead of sending SQL to GBQ.
+        Follows the same semantics as query built by glue_query:
+        - filters compare like SQL, so NULL never passes a filter
+        - groups with NULL dimension values are kept (as GROUP BY does)
+        - percentiles interpolate linearly like PERCENTILE_CONT, stdev and var are population ones
+        - ORDER BY puts NULLs first for ASC and last for DESC
+        Output columns are the same as the GBQ result: dimensions first, then aggr_metric for each aggregation
+
+        With rollup, df is the rollup (sum_m, count_m, min_m, max_m per rollup dimensions)
+        and it is re-aggregated instead of aggregating raw rows
+
+        Main method is run, which will return result DataFrame
+        """
+        self.query_builder = query_builder
+        self.df = df
+        self.logger = logger
+        self.rollup = rollup
+
+        if self.query_builder.sample is not None:
+            raise LocalUnsupportedException("Sampling is not supported by local engine, sample the DataFrame instead")
+
+        if (self.query_builder.histogram is not None) or (self.query_builder.scatter_bins is not None) or \
+                (self.query_builder.box_summary is not None):
+            raise LocalUnsupportedException(
+                "Histogram, scatter binning and box summary are not supported by local engine")
+
+        for col in self._used_cols():
+            if col not in self.df.columns:
+                raise LocalColumnMissingException(f"Column {col} not found in local DataFrame")
+
+    def _used_cols(self) -> list:
+        qb = self.query_builder
+        if self.rollup is not None:
+            cols = [f"{aggr}_{m}" for aggr in ROLLUP_AGGRS for m in qb.metrics]
+        else:
+            cols = list(qb.metrics)
+        if qb.dimensions is not None:
+            cols += qb.dimensions
+        if qb.filters is not None:
+            cols += [f[0] for f in qb.filters]
+        if qb.date_range is not None:
+            cols.append(qb.partitioning['field'])
+        return cols
+
+    def _filter_data(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Applies filters as one vectorized boolean mask
+        :param df: Source DataFrame
+        :return: Filtered DataFrame
+        """
+        qb = self.query_builder
+        if (qb.filters is None) and (qb.date_range is None):
+            return df
+
+        mask = np.ones(df.shape[0], dtype=bool)
+        if qb.date_range is not None:
+            dates = pd.to_datetime(df[qb.partitioning['field']]).dt.tz_localize(None)
+            start = pd.Timestamp(qb.date_range[0])
+            end = pd.Timestamp(qb.date_range[1]) + pd.Timedelta(days=1)
+            mask &= ((dates >= start) & (dates < end)).to_numpy()
+
+        for col, operand, values in (qb.filters or list()):
+            s = df[col]
+            if operand == 'eq':
+                m = s == values
+            elif operand == 'ne':
+                m = s != values
+            elif operand == 'gt':
+                m = s > values
+            elif operand == 'lt':
+                m = s < values
+            elif operand == 'ge':
+                m = s >= values
+            elif operand == 'le':
+                m = s <= values
+            elif operand == 'in':
+                m = s.isin(values)
+            else:
+                m = ~s.isin(values)
+            # NULL never matches in SQL
+            mask &= (m & s.notna()).to_numpy()
+        return df[mask]
+
+    def _aggr_data(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Groups and aggregates filtered data
+        :param df: Filtered DataFrame
+        :return: DataFrame with dimensions and aggr_metric columns
+        """
+        qb = self.query_builder
+        dimensions = qb.dimensions if qb.dimensions is not None else list()
+
+        if "none" in qb.aggregations:
+            out = df[dimensions].copy()
+            for m in qb.metrics:
+                out[f"none_{m}"] = df[m]
+            return out.reset_index(drop=True)
+
+        # without dimensions everything is a single group, like aggregation without GROUP BY
+        key_cols = dimensions if dimensions.__len__() > 0 else ['__all__']
+        if dimensions.__len__() == 0:
+            df = df.assign(__all__=0)
+        grouped = df.groupby(key_cols, dropna=False, sort=False)
+
+        aggr_cols = dict()
+        for aggr in qb.aggregations:
+            for m in qb.metrics:
+                if aggr in QUANTILES:
+                    aggr_cols[f"{aggr}_{m}"] = grouped[m].quantile(QUANTILES[aggr])
+                else:
+                    aggr_cols[f"{aggr}_{m}"] = GROUP_AGGR_FUNCS[aggr](grouped[m])
+        out = pd.DataFrame(aggr_cols)
+
+        if dimensions.__len__() == 0:
+            if out.shape[0] == 0:
+                # SQL aggregation over no rows still returns one row, where only COUNT gives 0 instead of NULL
+                out = out.reindex([0])
+                for aggr in set(qb.aggregations).intersection({'count', 'count_distinct'}):
+                    for m in qb.metrics:
+                        out[f"{aggr}_{m}"] = out[f"{aggr}_{m}"].fillna(0).astype('int64')
+            return out.reset_index(drop=True)
+        return out.reset_index()
+
+    def _rollup_aggr_data(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Re-aggregates filtered rollup into requested dimensions, same as ROLLUP_MAP does in GBQ
+        :param df: Filtered rollup DataFrame
+        :return: DataFrame with dimensions and aggr_metric columns
+        """
+        qb = self.query_builder
+        out = _aggregate_partials(df, dimensions=qb.dimensions, metrics=qb.metrics, aggregations=qb.aggregations)
+
+        if (qb.dimensions is None) and (out.shape[0] == 0):
+            out = out.reindex([0])
+            if 'count' in qb.aggregations:
+                for m in qb.metrics:
+                    out[f"count_{m}"] = out[f"count_{m}"].fillna(0).astype('int64')
+        return out
+
+    def _sort_data(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.query_builder.sort is None:
+            return df
+        col, direction = self.query_builder.sort
+        ascending = direction == 'asc'
+        return df.sort_values(col,
+                              ascending=ascending,
+                              na_position='first' if ascending else 'last',
+                              kind='mergesort').reset_index(drop=True)
+
+    def _limit_data(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.query_builder.limit is None:
+            return df
+        return df.head(self.query_builder.limit)
+
+    def run(self) -> pd.DataFrame:
+        """
+        Evaluates the spec in the same order as SQL: WHERE, GROUP BY, ORDER BY, LIMIT
+        :return: Result DataFrame
+        """
+        qb = self.query_builder
+        is_window_aggr = set(qb.aggregations).intersection(set(WINDOW_AGGRS)).__len__() > 0
+        self.logger.info(f"Local run: grouping {qb.metrics} by {qb.dimensions}. Aggregations: {qb.aggregations}"
+                         f"{' (window)' if is_window_aggr else ''}")
+        df = self._filter_data(self.df)
+        df = self._rollup_aggr_data(df) if self.rollup is not None else self._aggr_data(df)
+        df = self._sort_data(df)
+        df = self._limit_data(df)
+        return df
+
+
+def merge_partials(dfs: List[pd.DataFrame], dimensions: List[str], metrics: List[str]) -> pd.DataFrame:
+    """
+    Merges partial aggregates (sum_m, count_m, min_m, max_m and optional __watermark per dimensions),
+    for example stored result and aggregates of new rows, into one frame of the same shape
+    :param dfs: Partial aggregate DataFrames
+    :param dimensions: Grouping columns (None or empty for single group)
+    :param metrics: Metrics
+    :return: Merged partial aggregates
+    """
+    df = pd.concat(dfs, ignore_index=True)
+    return _aggregate_partials(df, dimensions=dimensions, metrics=metrics, aggregations=ROLLUP_AGGRS,
+                               watermark='__watermark' in df.columns)
+
+
+def _aggregate_partials(df: pd.DataFrame,
+                        dimensions: List[str],
+                        metrics: List[str],
+                        aggregations: List[str],
+                        watermark: bool = False) -> pd.DataFrame:
+    """
+    Aggregates partial aggregates (sum_m, count_m, min_m, max_m) by dimensions, same as ROLLUP_MAP does in GBQ
+    :param df: Partial aggregates
+    :param dimensions: Grouping columns (None or empty for single group)
+    :param metrics: Metrics
+    :param aggregations: Any of sum, count, min, max, avg
+    :param watermark: Keep max of __watermark column
+    :return: DataFrame with dimensions and aggr_metric columns
+    """
+    dimensions = dimensions if dimensions is not None else list()
+    key_cols = dimensions if dimensions.__len__() > 0 else ['__all__']
+    if dimensions.__len__() == 0:
+        df = df.assign(__all__=0)
+    grouped = df.groupby(key_cols, dropna=False, sort=False)
+
+    aggr_cols = dict()
+    for aggr in aggregations:
+        for m in metrics:
+            if aggr == 'sum':
+                aggr_cols[f"sum_{m}"] = grouped[f"sum_{m}"].sum(min_count=1)
+            elif aggr == 'count':
+                aggr_cols[f"count_{m}"] = grouped[f"count_{m}"].sum().astype('int64')
+            elif aggr == 'min':
+                aggr_cols[f"min_{m}"] = grouped[f"min_{m}"].min()
+            elif aggr == 'max':
+                aggr_cols[f"max_{m}"] = grouped[f"max_{m}"].max()
+            else:
+                # avg, NULL when there are no values (like SAFE_DIVIDE by 0)
+                counts = grouped[f"count_{m}"].sum()
+                aggr_cols[f"avg_{m}"] = grouped[f"sum_{m}"].sum(min_count=1) / counts.where(counts > 0)
+    if watermark:
+        aggr_cols['__watermark'] = grouped['__watermark'].max()
+    out = pd.DataFrame(aggr_cols)
+    return out.reset_index(drop=True) if dimensions.__len__() == 0 else out.reset_index()
+
+
+def cols_from_df(df: pd.DataFrame) -> Dict[str, str]:
+    """
+    Column dictionary for _QueryBuilder validation built from local DataFrame dtypes
+    :param df: Source DataFrame
+    :return: Dictionary of [column, dtype]
+    """
+    return {col: str(dtype) for col, dtype in df.dtypes.items()}
+
+
+class LocalColumnMissingException(Exception):
+    pass
+
+
+class LocalUnsupportedException(Exception):
+    pass
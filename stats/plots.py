@@ -1,11 +1,13 @@
-import matplotlib
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+import io
 import logging
-from typing import List, Union
+import threading
+from typing import Dict, List, Tuple, Union
 import itertools
+from .utils import PLOT_TYPES, RENDER_FORMATS
 
-matplotlib.use('tkagg')
+_RENDER_LOCK = threading.Lock()
 
 
 class _Plots:
@@ -23,16 +25,76 @@ class _Plots:
                  dimensions: List[str],
                  metrics: List[str],
                  aggregations: List[str],
-                 logger: logging.Logger):
+                 logger: logging.Logger,
+                 histogram: Dict = None,
+                 scatter_bins: Dict = None,
+                 box_summary: Dict = None):
 
         self.df = df
         self.dimensions = dimensions
         self.metrics = metrics
         self.aggregations = aggregations
+        # if histogram is set, df has bins pre-calculated in GBQ
+        self.histogram = histogram
+        # if scatter_bins is set, df has 2D grid pre-calculated in GBQ
+        self.scatter_bins = scatter_bins
+        # if box_summary is set, df has whiskers and fliers pre-calculated in GBQ
+        self.box_summary = box_summary
 
         self.metric_cols = self._get_possible_metrics()
         self.logger = logger
 
+    def render(self, plot_type: str, format: str = 'png', dpi: int = 100, **kwargs) -> bytes:
+        """
+        Draws plot without pyplot, on Agg canvas of its own figure, and returns it as image bytes.
+        Figure is cleared right after saving, so nothing stays registered in pyplot between renders.
+        Output is deterministic, same data and settings give the same bytes
+        :param plot_type: One of PLOT_TYPES
+        :param format: One of RENDER_FORMATS
+        :param dpi: Resolution of the image
+        :param kwargs: Plot specific settings, passed to the plot method
+        :return: Image bytes
+        """
+        if (plot_type not in PLOT_TYPES) or (not hasattr(self, plot_type)):
+            raise WrongPlotTypeException(f"Plot type has to be one of {PLOT_TYPES}, got {plot_type}")
+        if format not in RENDER_FORMATS:
+            raise WrongRenderFormatException(f"Render format has to be one of {RENDER_FORMATS}, got {format}")
+
+        import matplotlib
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        # matplotlib is not thread safe, renders within a process go one at a time
+        with _RENDER_LOCK:
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            try:
+                getattr(self, plot_type)(fig=fig, **kwargs)
+                buffer = io.BytesIO()
+                # fixed svg ids and no date in metadata, so the same data gives the same bytes
+                with matplotlib.rc_context({'svg.hashsalt': 'stats'}):
+                    fig.savefig(buffer, format=format, dpi=dpi, metadata={'Date': None})
+            finally:
+                fig.clear()
+        self.logger.info(f"Rendered {plot_type} as {format} ({buffer.tell()} bytes)")
+        return buffer.getvalue()
+
+    @staticmethod
+    def _get_figure(fig=None, figsize: Tuple[int, int] = None):
+        """
+        Returns figure to draw on
+        :param fig: Figure (headless render) or None
+        :param figsize: Size of the figure in inches, if set
+        :return: Given figure or new pyplot figure
+        """
+        if fig is None:
+            # pyplot is imported here, not at module level, so importing stats doesnt load matplotlib
+            import matplotlib.pyplot as plt
+            return plt.figure(figsize=figsize)
+        if figsize is not None:
+            fig.set_size_inches(*figsize)
+        return fig
+
     def _prep_groups(self) -> Union[str, None]:
         """
         Prepares data for category. If none, returns empty string
@@ -42,7 +104,12 @@ class _Plots:
         if self.dimensions is not None:
             if self.dimensions.__len__() > 1:
                 x = 'group'
-                self.df[x] = self.df[self.dimensions].agg('-'.join, axis=1)
+                # vectorized concatenation (works for non string dimensions too),
+                # kept as categorical so later groupby and plot calls work on codes
+                labels = self.df[self.dimensions[0]].astype(str)
+                for d in self.dimensions[1:]:
+                    labels = labels + '-' + self.df[d].astype(str)
+                self.df[x] = labels.astype('category')
             else:
                 # if not, just using provided dimension
                 x = self.dimensions[0]
@@ -50,12 +117,14 @@ class _Plots:
         else:
             return None
 
-    def bar(self) -> None:
+    def bar(self, fig=None):
         """
         Produces the bar plot with one category (X) and one metric (Y), based on:
         - self.df: data source
         - self.dimensions: concat of dimensions
         - self.metrics: picks the first one
+        :param fig: Figure to draw on, new pyplot figure if None
+        :return: Figure
         """
         x = self._prep_groups()
         if x is None:
@@ -64,18 +133,23 @@ class _Plots:
         y = self.metric_cols[0]
         self.logger.info(f"Bar Plot with x: {x} and y: {y}")
 
+        fig = self._get_figure(fig)
         # rotate labels if too many groups
         #_rot = 0 if set(self.df[x].values).__len__() <= 10 else 90
         self.df.plot.bar(x=x,
                          y=y,
-                         rot=0)
+                         rot=0,
+                         ax=fig.subplots())
+        return fig
 
-    def barh(self) -> None:
+    def barh(self, fig=None):
         """
         Produces the horizontal bar plot with one category (X) and one metric (Y), based on:
         - self.df: data source
         - self.dimensions: concat of dimensions
         - self.metrics: picks the first one
+        :param fig: Figure to draw on, new pyplot figure if None
+        :return: Figure
         """
         x = self._prep_groups()
         if x is None:
@@ -83,19 +157,24 @@ class _Plots:
 
         y = self.metric_cols[0]
         self.logger.info(f"Bar Plot with x: {x} and y: {y}")
+        fig = self._get_figure(fig)
         self.df.plot.barh(x=x,
                           y=y,
-                          rot=0)
+                          rot=0,
+                          ax=fig.subplots())
+        return fig
 
-    def boxplot(self) -> None:
+    def boxplot(self, fig=None):
         """
         Since I am pre-calculating statistics, I got to draw boxplot manually :) <- hold the pain face
 
-        Boxplot requires median, q1 and q3 to be added to aggregations
+        Boxplot requires median, q1 and q3 to be added to aggregations or box summary to be calculated in GBQ
+        :param fig: Figure to draw on, new pyplot figure if None
+        :return: Figure
         """
 
-        if (('median' not in self.aggregations) | ('q1' not in self.aggregations) | ('q3' not in self.aggregations) |
-                ('min_run' not in self.aggregations) | ('max_run' not in self.aggregations)):
+        box_aggregations = ['median', 'q1', 'q3', 'min_run', 'max_run']
+        if (self.box_summary is None) and (not set(box_aggregations).issubset(self.aggregations)):
             raise BoxplotMissingAggregationsException("Boxplot requires Q1, Median, Q3, min, max in aggregations")
 
         x = self._prep_groups()
@@ -105,42 +184,55 @@ class _Plots:
         # picking first metric
         y = self.metrics[0]
 
-        self.df[f'iqr_{y}'] = self.df[f'q3_{y}'] - self.df[f'q1_{y}']
-
         if x is None:
             x = ''
             self.df[x] = 0
-        groups = self.df[[x, f'q1_{y}', f'median_{y}', f'q3_{y}', f'iqr_{y}', f'min_run_{y}', f'max_run_{y}']].to_dict('records')
-        stats = list()
-
-        for group in groups:
-            whislo = max([(group[f'q1_{y}'] - (1.5 * group[f'iqr_{y}'])), group[f'min_run_{y}']])
-            whishi = min([(group[f'q3_{y}'] + (1.5*group[f'iqr_{y}'])), group[f'max_run_{y}']])
-
-            group_dict = {
-                "label": group[x],
-                "med":  group[f'median_{y}'],
-                "q1": group[f'q1_{y}'],
-                "q3": group[f'q3_{y}'],
-                "whislo": whislo,  # required
-                "whishi": whishi,  # required
-                "fliers": []  # required if showfliers=True
-            }
-            stats.append(group_dict)
+
+        stats_df = pd.DataFrame({'label': self.df[x],
+                                 'med': self.df[f'median_{y}'],
+                                 'q1': self.df[f'q1_{y}'],
+                                 'q3': self.df[f'q3_{y}']})
+        if self.box_summary is not None:
+            # whiskers are real data points found in GBQ
+            stats_df['whislo'] = self.df[f'whislo_{y}']
+            stats_df['whishi'] = self.df[f'whishi_{y}']
+            stats_df['fliers'] = [list(f) if isinstance(f, (list, tuple, np.ndarray)) else []
+                                  for f in self.df[f'fliers_{y}']]
+        else:
+            iqr = self.df[f'q3_{y}'] - self.df[f'q1_{y}']
+            self.df[f'iqr_{y}'] = iqr
+            stats_df['whislo'] = np.maximum(self.df[f'q1_{y}'] - 1.5 * iqr, self.df[f'min_run_{y}'])
+            stats_df['whishi'] = np.minimum(self.df[f'q3_{y}'] + 1.5 * iqr, self.df[f'max_run_{y}'])
+            stats_df['fliers'] = [[] for _ in range(stats_df.shape[0])]
+        stats = stats_df.to_dict('records')
 
         fs = 10  # fontsize
-        fig, axes = plt.subplots(nrows=1, ncols=1, figsize=(6, 6))
+        fig = self._get_figure(fig, figsize=(6, 6))
+        axes = fig.subplots(nrows=1, ncols=1)
         axes.bxp(stats)
         #axes.set_title('Boxplot for precalculated statistics', fontsize=fs)
-        plt.show()
+        return fig
 
-    def scatter(self) -> None:
+    def scatter(self,
+                max_labels: int = 50,
+                label_rank: str = 'extremes',
+                fontsize: int = 8,
+                fig=None):
         """
         Produces the scatter plot with 2 metrics
         - self.df: data source
         - self.dimensions: Used only as a label
         - self.metrics: picks the first two
+        :param max_labels: Max number of labels drawn (0 means no labels)
+        :param label_rank: Which points get labels first: 'extremes' (furthest from the mean),
+            'residuals' (furthest from linear fit) or name of the column to rank by (descending)
+        :param fontsize: Font size of labels in points
+        :param fig: Figure to draw on, new pyplot figure if None
+        :return: Figure
         """
+        if self.scatter_bins is not None:
+            return self._binned_scatter(fig)
+
         if self.metric_cols.__len__() < 2:
             raise ScatterplotTooFewMetrics(f"""Scatter plot requires at least 2 metrics. 
             Found ({self.metric_cols.__len__()})""")
@@ -150,36 +242,215 @@ class _Plots:
         y2 = self.metric_cols[1]
         self.logger.info(f"Scatter Plot with y1: {y1} and y2: {y2}")
 
+        fig = self._get_figure(fig)
         # labeled version
         if x is not None:
-            ax = self.df.plot(kind='scatter', x=y1, y=y2)
-            self.df[[y1, y2, x]].apply(lambda row: ax.text(*row), axis=1)
+            ax = self.df.plot(kind='scatter', x=y1, y=y2, ax=fig.subplots())
+            if max_labels > 0:
+                self._draw_labels(ax, x, y1, y2, max_labels, label_rank, fontsize)
         else:
             # non labeled version
-            self.df.plot.scatter(x=y1, y=y2)
+            self.df.plot.scatter(x=y1, y=y2, ax=fig.subplots())
+        return fig
 
-    def hist(self) -> None:
+    def _rank_labels(self, df: pd.DataFrame, y1: str, y2: str, label_rank: str) -> pd.Series:
+        """
+        Scores points for labeling, higher score gets label first
+        :param df: Points with both metrics present
+        :param y1: Column on x axis
+        :param y2: Column on y axis
+        :param label_rank: 'extremes', 'residuals' or column name
+        :return: Score per point
+        """
+        if label_rank == 'extremes':
+            z1 = (df[y1] - df[y1].mean()) / (df[y1].std(ddof=0) or 1.0)
+            z2 = (df[y2] - df[y2].mean()) / (df[y2].std(ddof=0) or 1.0)
+            return np.sqrt(z1 ** 2 + z2 ** 2)
+        elif label_rank == 'residuals':
+            if df[y1].nunique() < 2:
+                return (df[y2] - df[y2].mean()).abs()
+            slope, intercept = np.polyfit(df[y1].to_numpy(dtype=float), df[y2].to_numpy(dtype=float), 1)
+            return (df[y2] - (slope * df[y1] + intercept)).abs()
+        elif label_rank in df.columns:
+            return df[label_rank]
+        else:
+            raise WrongLabelRankException(f"Label rank has to be 'extremes', 'residuals' or column name, "
+                                          f"got {label_rank}")
+
+    def _draw_labels(self, ax, x: str, y1: str, y2: str, max_labels: int, label_rank: str, fontsize: int) -> None:
+        """
+        Labels up to max_labels points. Axes are split into a grid of label sized cells, points are taken
+        by rank and a point is labeled only if its cell and horizontal neighbour cells are still free,
+        so labels do not overlap. All labels are drawn as one collection of text paths.
+        :param ax: Axes with the scatter plot
+        :param x: Label column
+        :param y1: Column on x axis
+        :param y2: Column on y axis
+        :param max_labels: Max number of labels
+        :param label_rank: 'extremes', 'residuals' or column name
+        :param fontsize: Font size of labels in points
+        """
+        from matplotlib.collections import PathCollection
+        from matplotlib.textpath import TextPath
+        from matplotlib.transforms import Affine2D
+
+        cols = list(dict.fromkeys([x, y1, y2] + ([label_rank] if label_rank in self.df.columns else [])))
+        points = self.df[cols].dropna(subset=[y1, y2])
+        if points.shape[0] == 0:
+            return
+        score = self._rank_labels(points, y1, y2, label_rank)
+        points = points.loc[score.sort_values(ascending=False, na_position='last').index]
+        labels = points[x].astype(str)
+
+        # grid cell is roughly the size of typical label, in pixels
+        px_per_pt = ax.figure.dpi / 72
+        cell_w = max(labels.str.len().median(), 1) * fontsize * 0.6 * px_per_pt
+        cell_h = fontsize * 1.5 * px_per_pt
+        bbox = ax.get_window_extent()
+        (x_lo, x_hi), (y_lo, y_hi) = ax.get_xlim(), ax.get_ylim()
+        cell_x = np.floor((points[y1] - x_lo) / ((x_hi - x_lo) or 1.0) * bbox.width / cell_w).astype(int)
+        cell_y = np.floor((points[y2] - y_lo) / ((y_hi - y_lo) or 1.0) * bbox.height / cell_h).astype(int)
+
+        # best ranked point per cell (vectorized), then greedy pass over those to keep neighbours free
+        first_in_cell = ~pd.DataFrame({'cx': cell_x, 'cy': cell_y}).duplicated().to_numpy()
+        taken = set()
+        chosen = list()
+        for i, cx, cy in zip(np.flatnonzero(first_in_cell), cell_x.to_numpy()[first_in_cell],
+                             cell_y.to_numpy()[first_in_cell]):
+            if ((cx - 1, cy) in taken) or ((cx + 1, cy) in taken):
+                continue
+            taken.add((cx, cy))
+            chosen.append(i)
+            if chosen.__len__() >= max_labels:
+                break
+
+        self.logger.info(f"Labeling {chosen.__len__()} of {points.shape[0]} points by {label_rank}")
+        paths = [TextPath((3, 3), label, size=fontsize) for label in labels.iloc[chosen]]
+        label_collection = PathCollection(paths,
+                                          offsets=points[[y1, y2]].iloc[chosen].to_numpy(dtype=float),
+                                          offset_transform=ax.transData,
+                                          facecolors='black',
+                                          edgecolors='none')
+        # text paths are in points, scaled to pixels at draw time (follows savefig dpi)
+        label_collection.set_transform(Affine2D().scale(1 / 72) + ax.figure.dpi_scale_trans)
+        ax.add_collection(label_collection, autolim=False)
+
+    def _binned_scatter(self, fig=None):
+        """
+        Draws 2D grid pre-calculated in GBQ as a density heatmap (colored by count, or by average of the third
+        metric if there is one) and rows from sparse cells as real points on top of it
+        :param fig: Figure to draw on, new pyplot figure if None
+        :return: Figure
+        """
+        mx, my = self.metrics[0], self.metrics[1]
+        color_col = f'avg_{self.metrics[2]}' if self.metrics.__len__() > 2 else 'count'
+        self.logger.info(f"Binned scatter plot with x: {mx} and y: {my}, colored by {color_col}")
+
+        fig = self._get_figure(fig)
+        ax = fig.subplots()
+        bins = self.df[self.df['kind'] == 'bin']
+        points = self.df[self.df['kind'] == 'point']
+
+        if bins.shape[0] > 0:
+            nx, ny = self.scatter_bins['bins']
+            first = bins.iloc[0]
+            x_width = first[f'{mx}_end'] - first[f'{mx}_start']
+            y_width = first[f'{my}_end'] - first[f'{my}_start']
+            x_lo = first[f'{mx}_start'] - first['x_bin'] * x_width
+            y_lo = first[f'{my}_start'] - first['y_bin'] * y_width
+
+            grid = np.full((ny, nx), np.nan)
+            grid[bins['y_bin'].to_numpy(dtype=int), bins['x_bin'].to_numpy(dtype=int)] = bins[color_col].to_numpy()
+            mesh = ax.pcolormesh(x_lo + np.arange(nx + 1) * x_width,
+                                 y_lo + np.arange(ny + 1) * y_width,
+                                 np.ma.masked_invalid(grid),
+                                 shading='flat')
+            fig.colorbar(mesh, ax=ax, label=color_col)
+
+        if points.shape[0] > 0:
+            ax.scatter(points[f'{mx}_start'], points[f'{my}_start'], s=4, c='black')
+        ax.set_xlabel(mx)
+        ax.set_ylabel(my)
+        return fig
+
+    def hist(self, fig=None):
         """
         Produces the histogram with one metric
         - self.df: data source
         - self.dimensions: used as a group
         - self.metrics: picks the first one
+        :param fig: Figure to draw on, new pyplot figure if None
+        :return: Figure
         """
         x = self._prep_groups()
+        if self.histogram is not None:
+            return self._binned_hist(x, overlay=False, fig=fig)
+
         y = self.metric_cols[0]
         self.logger.info(f"Histogram for {y} grouped by {x}")
-        self.df.plot.hist(column=y, by=x)
+        fig = self._get_figure(fig)
+        if x is not None:
+            axes = fig.subplots(nrows=self.df[x].nunique(), ncols=1, squeeze=False)[:, 0]
+        else:
+            axes = fig.subplots()
+        self.df.plot.hist(column=y, by=x, ax=axes)
+        return fig
 
-    def histg(self) -> None:
+    def histg(self, fig=None):
         """
         Groups data into one histogram if there are groups
         - self.df: data source
         - self.dimensions: used as a group
         - self.metrics: picks the first one
+        :param fig: Figure to draw on, new pyplot figure if None
+        :return: Figure
         """
         x = self._prep_groups()
+        if self.histogram is not None:
+            return self._binned_hist(x, overlay=True, fig=fig)
+
         y = self.metric_cols[0]
-        self.df.pivot(columns=x, values=[y]).plot.hist(alpha=0.5)
+        fig = self._get_figure(fig)
+        self.df.pivot(columns=x, values=[y]).plot.hist(alpha=0.5, ax=fig.subplots())
+        return fig
+
+    def _binned_hist(self, x: Union[str, None], overlay: bool, fig=None):
+        """
+        Draws histogram from bins pre-calculated in GBQ (bin_start, bin_end, count columns)
+        :param x: Name of the grouping column or None
+        :param overlay: If True, all groups go into one plot, otherwise each group gets its own subplot
+        :param fig: Figure to draw on, new pyplot figure if None
+        :return: Figure
+        """
+        m = self.metrics[0]
+        self.logger.info(f"Binned histogram for {m} grouped by {x}")
+
+        fig = self._get_figure(fig)
+        # NULL dimension value is its own group in GBQ, so it is kept (and labeled) here too
+        if x is not None:
+            groups = [('NULL' if pd.isna(label) else label, group)
+                      for label, group in self.df.groupby(x, sort=False, observed=True, dropna=False)]
+        else:
+            groups = [(m, self.df)]
+        if overlay:
+            ax = fig.subplots()
+            axes = [ax] * groups.__len__()
+        else:
+            axes = fig.subplots(nrows=groups.__len__(), ncols=1, squeeze=False, sharex=True)
+            axes = axes[:, 0]
+
+        for ax, (label, group) in zip(axes, groups):
+            ax.bar(group[f'bin_start_{m}'],
+                   group[f'count_{m}'],
+                   width=group[f'bin_end_{m}'] - group[f'bin_start_{m}'],
+                   align='edge',
+                   alpha=0.5 if overlay else 1.0,
+                   label=str(label))
+            if not overlay:
+                ax.set_title(str(label))
+        if overlay and (x is not None):
+            axes[0].legend()
+        return fig
     #
     # def density(self) -> None:
     #     """
@@ -214,7 +485,8 @@ class _Plots:
         :return: List of possible metrics
         """
         possible_metrics = list()
-        for t in set(itertools.product(self.aggregations, self.metrics)):
+        # dict keeps unique pairs in aggregations x metrics order, so axes are picked deterministically
+        for t in dict.fromkeys(itertools.product(self.aggregations, self.metrics)):
             possible_metrics.append(f"{t[0]}_{t[1]}")
         return possible_metrics
 
@@ -229,3 +501,15 @@ class ScatterplotTooFewMetrics(Exception):
 
 class PlotRequiresCategoryException(Exception):
     pass
+
+
+class WrongLabelRankException(Exception):
+    pass
+
+
+class WrongPlotTypeException(Exception):
+    pass
+
+
+class WrongRenderFormatException(Exception):
+    pass
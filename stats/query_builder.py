@@ -1,9 +1,17 @@
-from .utils import WINDOW_AGGRS, OPERAND_MAP, AGGR_MAP
+from .utils import WINDOW_AGGRS, OPERAND_MAP, AGGR_MAP, APPROX_MAP, ROLLUP_MAP
 import logging
-from typing import List, Tuple, Dict
+import re
+import datetime
+from typing import List, Tuple, Dict, Union
 import numpy as np
 import itertools
 
+PARTITION_FILTER_POLICIES = ['warn', 'require', 'ignore']
+SAMPLE_METHODS = ['system', 'hash']
+HISTOGRAM_METHODS = ['count', 'width', 'quantile']
+NUMERIC_TYPES = ['INT64', 'INTEGER', 'FLOAT64', 'FLOAT', 'NUMERIC', 'BIGNUMERIC', 'DECIMAL', 'BIGDECIMAL']
+TEMPORAL_TYPES = ['DATE', 'DATETIME', 'TIMESTAMP', 'TIME']
+
 
 class _QueryBuilder:
     def __init__(self,
@@ -17,7 +25,19 @@ class _QueryBuilder:
                  aggregations: List[str] = None,
                  sort: Tuple[str, str] = None,
                  filters: List[Tuple] = None,
-                 limit: int = None
+                 limit: int = None,
+                 approximate: bool = False,
+                 partitioning: Dict = None,
+                 clustering: List[str] = None,
+                 date_range: Tuple[str, str] = None,
+                 partition_filter: str = 'warn',
+                 sample: Union[float, Dict] = None,
+                 histogram: Union[int, Dict] = None,
+                 scatter_bins: Union[int, Dict] = None,
+                 box_summary: Union[bool, Dict] = None,
+                 rollups: List[Dict] = None,
+                 watermark: str = None,
+                 parameterized: bool = False
                  ):
         """
         Class name with _ as its not supposed to be called directly
@@ -32,6 +52,37 @@ class _QueryBuilder:
         instead of trying to overcome it and send simplified query.
         It's important for user to be exactly 100% sure what data are they looking at
 
+        With approximate=True, aggregations from APPROX_MAP (count_distinct, percentiles, min_run, max_run...)
+        are computed with approximate/plain aggregate functions in a single GROUP BY, keeping the same column names
+
+        If table partitioning (and clustering) is known, filters on partition and cluster columns go first,
+        date_range is turned into partition pruning predicate and query without partition filter
+        is logged as a warning or refused, based on partition_filter ('warn', 'require', 'ignore')
+
+        With sample, query reads only a fraction of rows (TABLESAMPLE SYSTEM or deterministic hash sampling,
+        optionally stratified by first dimension). Stratified sampling adds sample_rate column to the result
+
+        With histogram, the first metric is binned inside GBQ and query returns per group bin edges and counts
+        instead of raw rows
+
+        With scatter_bins, first two metrics are binned on 2D grid inside GBQ (count and average of optional
+        third metric per cell), real points are returned only for sparse cells
+
+        With box_summary, each metric gets boxplot statistics per group (quartiles, min/max, whiskers,
+        number of fliers and capped sample of fliers). Whiskers and fliers depend on quartiles, so the table
+        is read twice (quartiles, then rows joined back to them) and billed for both scans
+
+        With rollups (materialized pre-aggregations of this table, see RollupRegistry), query that can be answered
+        from a rollup (sum/count/min/max/avg of its metrics, grouped and filtered by its dimensions) is routed
+        to the smallest such rollup and re-aggregated there, giving the same result as the source table
+
+        With watermark (column growing with ingestion, like ingestion timestamp), grouped query also returns
+        MAX(watermark) AS __watermark, so partial aggregates can be refreshed incrementally
+
+        With parameterized=True, filter values are not written into the query, but referenced as BigQuery named
+        query parameters (@pts_gt, IN UNNEST(@team_abbreviation_in)), see get_query_params.
+        Query text then works as a template: bind() changes filter values without building the query again
+
         Main method is glue_query, which will return a full query string
         """
         # table information
@@ -39,8 +90,11 @@ class _QueryBuilder:
         self.dataset_id = dataset_id
         self.table_id = table_id
         self.cols = cols
+        self.partitioning = partitioning
+        self.clustering = clustering
 
         # query parameters
+        self.approximate = approximate
         self.dimensions = dimensions
         self.metrics = metrics
         self.aggregations = aggregations
@@ -50,6 +104,18 @@ class _QueryBuilder:
         self.logger = logger
         self.filters = filters
         self.limit = limit
+        self.date_range = date_range
+        self.partition_filter = partition_filter
+        self.sample = sample
+        self.histogram = histogram
+        self.scatter_bins = scatter_bins
+        self.box_summary = box_summary
+        self.watermark = watermark
+        self.parameterized = parameterized
+        self._check_partition_pruning()
+
+        self.rollups = rollups if rollups is not None else list()
+        self.rollup = self._pick_rollup()
 
     # properties:
     @property
@@ -76,6 +142,34 @@ class _QueryBuilder:
     def sort(self):
         return self._sort
 
+    @property
+    def date_range(self):
+        return self._date_range
+
+    @property
+    def partition_filter(self):
+        return self._partition_filter
+
+    @property
+    def sample(self):
+        return self._sample
+
+    @property
+    def histogram(self):
+        return self._histogram
+
+    @property
+    def scatter_bins(self):
+        return self._scatter_bins
+
+    @property
+    def box_summary(self):
+        return self._box_summary
+
+    @property
+    def watermark(self):
+        return self._watermark
+
     # setters:
     @aggregations.setter
     def aggregations(self, aggregations):
@@ -84,7 +178,7 @@ class _QueryBuilder:
         - have to be a list of strings
         - cant be empty list
         - cant be outside of AGGR_MAP
-        - Window functions cant go together with non window functions
+        Window and non window functions can be mixed, see _mixed_aggr_data
         """
         if aggregations is None:
             raise WrongAggregationException(f"Aggregations cant be empty")
@@ -96,13 +190,6 @@ class _QueryBuilder:
             if aggregations.__len__() > 1:
                 raise WrongAggregationException(f"If there is 'none' aggregation, it cant be combined with more aggrs")
 
-        _window_aggrs = set(aggregations).intersection(set(WINDOW_AGGRS))
-
-        if (_window_aggrs.__len__() > 0) & (_window_aggrs.__len__() < aggregations.__len__()):
-            _non_window_aggrs = set(aggregations) - _window_aggrs
-            raise WrongAggregationException(f"""Window function based aggregations ({_window_aggrs})
-            cant go with non-window function based ones ({_non_window_aggrs}). Sorry, thats the limit""")
-
         for aggr in aggregations:
             if aggr not in AGGR_MAP:
                 raise WrongAggregationException(f"""Aggregation {aggr} has invalid value. 
@@ -259,35 +346,763 @@ class _QueryBuilder:
 
         self._sort = sort
 
+    def _get_window_aggrs(self, aggregations: List[str]) -> set:
+        """
+        Aggregations that will be computed with window functions.
+        In approximate mode APPROX_MAP replaces them with plain aggregates
+        :param aggregations: List of aggregations
+        :return: Set of window aggregations
+        """
+        window_aggrs = set(aggregations).intersection(set(WINDOW_AGGRS))
+        if self.approximate:
+            window_aggrs = window_aggrs - set(APPROX_MAP.keys())
+        return window_aggrs
+
+    @date_range.setter
+    def date_range(self, date_range):
+        """
+        Date range checks:
+        - Can be empty
+        - If not empty, it has to be a Tuple of 2 dates (datetime.date or 'YYYY-MM-DD' strings),
+          datetime.datetime values are truncated to their date
+        - Start cant be after end
+        - Table has to be partitioned by time
+        """
+        if date_range is not None:
+            if (not isinstance(date_range, tuple)) or (date_range.__len__() != 2):
+                raise WrongDateRangeException("Date range has to be Tuple(start_date, end_date)")
+
+            date_range = tuple(d.date() if isinstance(d, datetime.datetime) else d for d in date_range)
+            date_range = tuple(d.isoformat() if isinstance(d, datetime.date) else d for d in date_range)
+            for d in date_range:
+                if (not isinstance(d, str)) or (not re.fullmatch(r"\d{4}-\d{2}-\d{2}", d)):
+                    raise WrongDateRangeException(f"Date range value {d} has to be a date or 'YYYY-MM-DD' string")
+
+            if date_range[0] > date_range[1]:
+                raise WrongDateRangeException(f"Date range start {date_range[0]} is after end {date_range[1]}")
+
+            if (self.partitioning is None) or (self.partitioning['type'] == 'RANGE'):
+                raise WrongDateRangeException("Date range requires time partitioned table")
+
+        self._date_range = date_range
+
+    @partition_filter.setter
+    def partition_filter(self, partition_filter):
+        if partition_filter not in PARTITION_FILTER_POLICIES:
+            raise WrongPartitionFilterException(f"Partition filter has to be one of {PARTITION_FILTER_POLICIES}")
+        self._partition_filter = partition_filter
+
+    @sample.setter
+    def sample(self, sample):
+        """
+        Sample checks:
+        - Can be empty
+        - Can be a float rate (0, 1], same as {'rate': rate}
+        - If dictionary, it can have keys:
+            rate (required), method ('system' or 'hash', default 'system'),
+            key (column hashed by 'hash' method, default all selected columns),
+            stratify (bool, default False), min_rows (rows kept per stratum at least, default 100)
+        - Stratified sampling requires 'hash' method and at least one dimension
+        """
+        if sample is not None:
+            if isinstance(sample, (int, float)) and not isinstance(sample, bool):
+                sample = {'rate': sample}
+
+            if not isinstance(sample, dict):
+                raise WrongSampleException("Sample has to be a rate or dictionary with 'rate' key")
+
+            unknown_keys = set(sample.keys()) - {'rate', 'method', 'key', 'stratify', 'min_rows'}
+            if unknown_keys.__len__() > 0:
+                raise WrongSampleException(f"Unknown sample options {unknown_keys}")
+
+            sample = {'rate': sample.get('rate'),
+                      'method': sample.get('method', 'system'),
+                      'key': sample.get('key'),
+                      'stratify': sample.get('stratify', False),
+                      'min_rows': sample.get('min_rows', 100)}
+
+            if (not isinstance(sample['rate'], (int, float))) or (not 0 < sample['rate'] <= 1):
+                raise WrongSampleException("Sample rate has to be a number in (0, 1]")
+
+            if sample['method'] not in SAMPLE_METHODS:
+                raise WrongSampleException(f"Sample method has to be one of {SAMPLE_METHODS}")
+
+            if (sample['key'] is not None) and (sample['key'] not in self.cols):
+                raise WrongSampleException(f"Sample key {sample['key']} not in data source columns")
+
+            if sample['stratify']:
+                if sample['method'] != 'hash':
+                    raise WrongSampleException("Stratified sample requires 'hash' method")
+                if self.dimensions is None:
+                    raise WrongSampleException("Stratified sample requires at least one dimension")
+                if (not isinstance(sample['min_rows'], int)) or (sample['min_rows'] < 1):
+                    raise WrongSampleException("Sample min_rows has to be a positive int")
+
+        self._sample = sample
+
+    @histogram.setter
+    def histogram(self, histogram):
+        """
+        Histogram checks:
+        - Can be empty
+        - Can be an int number of bins, same as {'bins': bins}
+        - If dictionary, it can have keys:
+            method ('count' - equal width bins between min and max, 'width' - bins of fixed width,
+            'quantile' - bins with equal number of rows), bins (default 20), width (required for 'width' method)
+        - Requires 'none' aggregation, single metric and no sort or limit
+        """
+        if histogram is not None:
+            if isinstance(histogram, int) and not isinstance(histogram, bool):
+                histogram = {'bins': histogram}
+
+            if not isinstance(histogram, dict):
+                raise WrongHistogramException("Histogram has to be a number of bins or dictionary")
+
+            unknown_keys = set(histogram.keys()) - {'method', 'bins', 'width'}
+            if unknown_keys.__len__() > 0:
+                raise WrongHistogramException(f"Unknown histogram options {unknown_keys}")
+
+            histogram = {'method': histogram.get('method', 'count'),
+                         'bins': histogram.get('bins', 20),
+                         'width': histogram.get('width')}
+
+            if histogram['method'] not in HISTOGRAM_METHODS:
+                raise WrongHistogramException(f"Histogram method has to be one of {HISTOGRAM_METHODS}")
+
+            if histogram['method'] == 'width':
+                if (not isinstance(histogram['width'], (int, float))) or (histogram['width'] <= 0):
+                    raise WrongHistogramException("Histogram 'width' method requires positive width")
+            elif (not isinstance(histogram['bins'], int)) or (histogram['bins'] < 1):
+                raise WrongHistogramException("Histogram bins has to be a positive int")
+
+            if self.aggregations != ['none']:
+                raise WrongHistogramException("Histogram requires aggregations=['none']")
+
+            if self.metrics.__len__() != 1:
+                raise WrongHistogramException("Histogram requires exactly one metric")
+
+            if (self.sort is not None) or (self.limit is not None):
+                raise WrongHistogramException("Histogram cant be sorted or limited")
+
+        self._histogram = histogram
+
+    def _histogram_query(self, source_str: str, filter_str: str) -> str:
+        """
+        Creates histogram query: bins the metric (common bin edges for all groups) and counts rows per group and bin
+        Returns dimensions, bin_start_metric, bin_end_metric, count_metric
+        :param source_str: FROM source
+        :param filter_str: Filter string
+        :return: Query string
+        """
+        m = self.metrics[0]
+        method = self.histogram['method']
+        bins = self.histogram['bins']
+        dims = self.dimensions if self.dimensions is not None else list()
+        dim_str = ''.join(f"{d}, " for d in dims)
+        self.logger.info(f"Histogram of {m} by {self.dimensions}: {self.histogram}")
+
+        if method == 'width':
+            width = self.histogram['width']
+            edges_str = "SELECT 1 AS __dummy"
+            bin_str = f"CAST(FLOOR(__value / {width}) AS INT64)"
+            start_str = f"__bin * {width}"
+            end_str = f"(__bin + 1) * {width}"
+        elif method == 'count':
+            edges_str = "SELECT MIN(__value) AS __lo, MAX(__value) AS __hi FROM src"
+            width_str = f"((__hi - __lo) / {bins})"
+            bin_str = f"IFNULL(LEAST(CAST(FLOOR(SAFE_DIVIDE(__value - __lo, {width_str})) AS INT64), {bins - 1}), 0)"
+            start_str = f"ANY_VALUE(__lo) + __bin * ANY_VALUE({width_str})"
+            end_str = f"ANY_VALUE(__lo) + (__bin + 1) * ANY_VALUE({width_str})"
+        else:
+            edges_str = f"SELECT APPROX_QUANTILES(__value, {bins}) AS __q FROM src"
+            bin_str = "LEAST(GREATEST(RANGE_BUCKET(__value, __q), 1), ARRAY_LENGTH(__q) - 1)"
+            start_str = "ANY_VALUE(__q[OFFSET(__bin - 1)])"
+            end_str = "ANY_VALUE(__q[OFFSET(__bin)])"
+
+        return f"""
+        WITH src AS (
+            SELECT {dim_str}{m} AS __value
+            FROM {source_str}
+            WHERE {m} IS NOT NULL
+                {filter_str}
+        ),
+        edges AS ({edges_str}),
+        binned AS (
+            SELECT src.*, edges.*, {bin_str} AS __bin
+            FROM src CROSS JOIN edges
+        )
+        SELECT {dim_str}{start_str} AS bin_start_{m}, {end_str} AS bin_end_{m}, COUNT(*) AS count_{m}
+        FROM binned
+        GROUP BY {dim_str}__bin
+        ORDER BY {dim_str}bin_start_{m}"""
+
+    @scatter_bins.setter
+    def scatter_bins(self, scatter_bins):
+        """
+        Scatter bins checks:
+        - Can be empty
+        - Can be an int number of bins per axis, same as {'bins': bins}
+        - If dictionary, it can have keys:
+            bins (int or Tuple(x_bins, y_bins), default 50),
+            sparse (cells with at most this many rows are returned as real points, default 0)
+        - Requires 'none' aggregation, 2 or 3 numeric metrics (x, y, optional averaged one)
+        - Cant have dimensions, sort or limit
+        """
+        if scatter_bins is not None:
+            if isinstance(scatter_bins, int) and not isinstance(scatter_bins, bool):
+                scatter_bins = {'bins': scatter_bins}
+
+            if not isinstance(scatter_bins, dict):
+                raise WrongScatterBinsException("Scatter bins has to be a number of bins or dictionary")
+
+            unknown_keys = set(scatter_bins.keys()) - {'bins', 'sparse'}
+            if unknown_keys.__len__() > 0:
+                raise WrongScatterBinsException(f"Unknown scatter bins options {unknown_keys}")
+
+            bins = scatter_bins.get('bins', 50)
+            bins = tuple(bins) if isinstance(bins, (tuple, list)) else (bins, bins)
+            scatter_bins = {'bins': bins, 'sparse': scatter_bins.get('sparse', 0)}
+
+            if (bins.__len__() != 2) or any((not isinstance(b, int)) or (b < 1) for b in bins):
+                raise WrongScatterBinsException("Scatter bins has to be a positive int or Tuple of 2 positive ints")
+
+            if (not isinstance(scatter_bins['sparse'], int)) or (scatter_bins['sparse'] < 0):
+                raise WrongScatterBinsException("Scatter bins sparse threshold has to be a non negative int")
+
+            if self.aggregations != ['none']:
+                raise WrongScatterBinsException("Scatter bins require aggregations=['none']")
+
+            if self.metrics.__len__() not in [2, 3]:
+                raise WrongScatterBinsException("Scatter bins require 2 metrics (x, y) and optional third one")
+
+            not_numeric = [m for m in self.metrics if self._col_type(m) not in NUMERIC_TYPES]
+            if not_numeric.__len__() > 0:
+                raise WrongScatterBinsException(f"Scatter bins require numeric metrics, {not_numeric} are not numeric")
+
+            if (self.dimensions is not None) or (self.sort is not None) or (self.limit is not None):
+                raise WrongScatterBinsException("Scatter bins cant have dimensions, sort or limit")
+
+            if self.histogram is not None:
+                raise WrongScatterBinsException("Scatter bins cant go together with histogram")
+
+        self._scatter_bins = scatter_bins
+
+    def _scatter_bins_query(self, source_str: str, filter_str: str) -> str:
+        """
+        Creates 2D binning query. Grid spans min-max of both metrics, cells with more than 'sparse' rows
+        are returned as kind='bin' rows with cell edges, count and average of third metric.
+        Rows from sparse cells are returned as kind='point' rows, with both edges equal to the point value
+        Returns kind, x_bin, y_bin, x_start, x_end, y_start, y_end, count (and avg_z) with metric names
+        :param source_str: FROM source
+        :param filter_str: Filter string
+        :return: Query string
+        """
+        mx, my = self.metrics[0], self.metrics[1]
+        mz = self.metrics[2] if self.metrics.__len__() > 2 else None
+        nx, ny = self.scatter_bins['bins']
+        sparse = self.scatter_bins['sparse']
+        self.logger.info(f"Scatter bins of {mx} x {my}: {self.scatter_bins}")
+
+        z_src_str = f", {mz} AS z" if mz is not None else ""
+        z_bin_str = f", AVG(z) AS avg_{mz}" if mz is not None else ""
+        z_point_str = f", z AS avg_{mz}" if mz is not None else ""
+        x_width_str = f"((x_hi - x_lo) / {nx})"
+        y_width_str = f"((y_hi - y_lo) / {ny})"
+
+        return f"""
+        WITH src AS (
+            SELECT {mx} AS x, {my} AS y{z_src_str}
+            FROM {source_str}
+            WHERE {mx} IS NOT NULL AND {my} IS NOT NULL
+                {filter_str}
+        ),
+        edges AS (SELECT MIN(x) AS x_lo, MAX(x) AS x_hi, MIN(y) AS y_lo, MAX(y) AS y_hi FROM src),
+        binned AS (
+            SELECT src.*, edges.*,
+                   IFNULL(LEAST(CAST(FLOOR(SAFE_DIVIDE(x - x_lo, {x_width_str})) AS INT64), {nx - 1}), 0) AS x_bin,
+                   IFNULL(LEAST(CAST(FLOOR(SAFE_DIVIDE(y - y_lo, {y_width_str})) AS INT64), {ny - 1}), 0) AS y_bin
+            FROM src CROSS JOIN edges
+        ),
+        grid AS (
+            SELECT x_bin, y_bin,
+                   ANY_VALUE(x_lo) + x_bin * ANY_VALUE({x_width_str}) AS {mx}_start,
+                   ANY_VALUE(x_lo) + (x_bin + 1) * ANY_VALUE({x_width_str}) AS {mx}_end,
+                   ANY_VALUE(y_lo) + y_bin * ANY_VALUE({y_width_str}) AS {my}_start,
+                   ANY_VALUE(y_lo) + (y_bin + 1) * ANY_VALUE({y_width_str}) AS {my}_end,
+                   COUNT(*) AS count{z_bin_str}
+            FROM binned
+            GROUP BY x_bin, y_bin
+        )
+        SELECT 'bin' AS kind, grid.*
+        FROM grid
+        WHERE count > {sparse}
+        UNION ALL
+        SELECT 'point' AS kind, binned.x_bin, binned.y_bin, x AS {mx}_start, x AS {mx}_end,
+               y AS {my}_start, y AS {my}_end, 1 AS count{z_point_str}
+        FROM binned JOIN grid USING (x_bin, y_bin)
+        WHERE grid.count <= {sparse}"""
+
+    @box_summary.setter
+    def box_summary(self, box_summary):
+        """
+        Box summary checks:
+        - Can be empty or False
+        - True is the same as empty dictionary
+        - If dictionary, it can have keys:
+            whis (whiskers reach, in IQRs from the box, default 1.5), fliers (max fliers returned per group, default 50)
+        - Requires 'none' aggregation, no sort, limit, histogram or scatter bins
+        """
+        if box_summary is False:
+            box_summary = None
+
+        if box_summary is not None:
+            if box_summary is True:
+                box_summary = dict()
+
+            if not isinstance(box_summary, dict):
+                raise WrongBoxSummaryException("Box summary has to be True or dictionary")
+
+            unknown_keys = set(box_summary.keys()) - {'whis', 'fliers'}
+            if unknown_keys.__len__() > 0:
+                raise WrongBoxSummaryException(f"Unknown box summary options {unknown_keys}")
+
+            box_summary = {'whis': box_summary.get('whis', 1.5), 'fliers': box_summary.get('fliers', 50)}
+
+            if (not isinstance(box_summary['whis'], (int, float))) or (box_summary['whis'] < 0):
+                raise WrongBoxSummaryException("Box summary whis has to be a non negative number")
+
+            if (not isinstance(box_summary['fliers'], int)) or (box_summary['fliers'] < 0):
+                raise WrongBoxSummaryException("Box summary fliers has to be a non negative int")
+
+            if self.aggregations != ['none']:
+                raise WrongBoxSummaryException("Box summary requires aggregations=['none']")
+
+            if (self.sort is not None) or (self.limit is not None):
+                raise WrongBoxSummaryException("Box summary cant be sorted or limited")
+
+            if (self.histogram is not None) or (self.scatter_bins is not None):
+                raise WrongBoxSummaryException("Box summary cant go together with histogram or scatter bins")
+
+        self._box_summary = box_summary
+
+    @watermark.setter
+    def watermark(self, watermark):
+        """
+        Watermark checks:
+        - Can be empty
+        - Has to be a table column
+        - Works only with aggregations that can be merged (sum, count, min, max, avg)
+        """
+        if watermark is not None:
+            if watermark not in self.cols:
+                raise WrongWatermarkException(f"Watermark column {watermark} not in data source columns")
+            if not set(self.aggregations).issubset(set(ROLLUP_MAP.keys())):
+                raise WrongWatermarkException(f"Watermark works only with {list(ROLLUP_MAP.keys())} aggregations")
+            if (self.sample is not None) or (self.histogram is not None) or (self.scatter_bins is not None) or \
+                    (self.box_summary is not None):
+                raise WrongWatermarkException("Watermark cant go together with sample, histogram or binning")
+        self._watermark = watermark
+
+    def _box_summary_query(self, source_str: str, filter_str: str) -> str:
+        """
+        Creates boxplot statistics query. Quartiles, min and max come from APPROX_QUANTILES(metric, 4)
+        (approximate) computed in one GROUP BY, then rows are joined back to their group to find whiskers
+        (most extreme values within whis * IQR from the box), count fliers and pick up to 'fliers' of them.
+        Groups are joined by equality on __key (JSON of dimensions, so NULL dimension is its own group),
+        which GBQ can run as hash join. GBQ doesnt materialize src CTE, so the source is scanned (and billed) twice.
+        Returns dimensions and for every metric: q1, median, q3, min_run, max_run, whislo, whishi, n_fliers, fliers
+        :param source_str: FROM source
+        :param filter_str: Filter string
+        :return: Query string
+        """
+        whis = self.box_summary['whis']
+        dims = self.dimensions if self.dimensions is not None else list()
+        self.logger.info(f"Box summary of {self.metrics} by {self.dimensions}: {self.box_summary}")
+
+        src_cols_str = ', '.join(list(dict.fromkeys(dims + self.metrics)))
+        quantiles_str = ', '.join(f"APPROX_QUANTILES({m}, 4) AS __q_{m}" for m in self.metrics)
+
+        stats_cols = list()
+        metric_cols = list()
+        for m in self.metrics:
+            iqr_str = f"(__q_{m}[OFFSET(3)] - __q_{m}[OFFSET(1)])"
+            stats_cols += [f"__q_{m}[OFFSET(0)] AS min_run_{m}",
+                           f"__q_{m}[OFFSET(1)] AS q1_{m}",
+                           f"__q_{m}[OFFSET(2)] AS median_{m}",
+                           f"__q_{m}[OFFSET(3)] AS q3_{m}",
+                           f"__q_{m}[OFFSET(4)] AS max_run_{m}",
+                           f"__q_{m}[OFFSET(1)] - {whis} * {iqr_str} AS __lo_{m}",
+                           f"__q_{m}[OFFSET(3)] + {whis} * {iqr_str} AS __hi_{m}"]
+            flier_str = f"(src.{m} < stats.__lo_{m} OR src.{m} > stats.__hi_{m})"
+            metric_cols += [f"ANY_VALUE(stats.{c}_{m}) AS {c}_{m}"
+                            for c in ['q1', 'median', 'q3', 'min_run', 'max_run']]
+            metric_cols += [f"MIN(IF(src.{m} >= stats.__lo_{m}, src.{m}, NULL)) AS whislo_{m}",
+                            f"MAX(IF(src.{m} <= stats.__hi_{m}, src.{m}, NULL)) AS whishi_{m}",
+                            f"COUNTIF({flier_str}) AS n_fliers_{m}",
+                            f"ARRAY_AGG(IF({flier_str}, src.{m}, NULL) IGNORE NULLS "
+                            f"LIMIT {self.box_summary['fliers']}) AS fliers_{m}"]
+        stats_cols_str = ', '.join(stats_cols)
+        metric_cols_str = ',\n               '.join(metric_cols)
+
+        if dims.__len__() > 0:
+            key_str = f", TO_JSON_STRING(STRUCT({', '.join(dims)})) AS __key"
+            stats_key_str = "__key, "
+            group_by_str = "GROUP BY __key"
+            join_str = "JOIN stats ON src.__key = stats.__key"
+            outer_dim_str = ''.join(f"src.{d}, " for d in dims)
+            outer_group_by_str = f"GROUP BY {', '.join(f'src.{d}' for d in dims)}"
+        else:
+            key_str = ""
+            stats_key_str = ""
+            group_by_str = ""
+            join_str = "CROSS JOIN stats"
+            outer_dim_str = ""
+            outer_group_by_str = ""
+
+        return f"""
+        WITH src AS (
+            SELECT {src_cols_str}{key_str}
+            FROM {source_str}
+            WHERE 1=1
+                {filter_str}
+        ),
+        stats AS (
+            SELECT {stats_key_str}{stats_cols_str}
+            FROM (
+                SELECT {stats_key_str}{quantiles_str}
+                FROM src
+                {group_by_str}
+            )
+        )
+        SELECT {outer_dim_str}{metric_cols_str}
+        FROM src {join_str}
+        {outer_group_by_str}"""
+
+    def _is_rollup_compatible(self, rollup: Dict) -> bool:
+        """
+        Checks if rollup can answer the query exactly: only re-aggregatable aggregations, metrics stored in rollup,
+        dimensions, filter columns and date range partition column among rollup dimensions,
+        no sampling or binning
+        :param rollup: Rollup dictionary
+        :return: True if query can be routed to rollup
+        """
+        if not set(self.aggregations).issubset(set(ROLLUP_MAP.keys())):
+            return False
+        if (self.sample is not None) or (self.histogram is not None) or (self.scatter_bins is not None) or \
+                (self.box_summary is not None):
+            return False
+        if not set(self.metrics).issubset(set(rollup['metrics'])):
+            return False
+
+        used_dims = list(self.dimensions) if self.dimensions is not None else list()
+        if self.filters is not None:
+            used_dims += [f[0] for f in self.filters]
+        if self.date_range is not None:
+            used_dims.append(self.partitioning['field'])
+        return set(used_dims).issubset(set(rollup['dimensions']))
+
+    def _pick_rollup(self) -> Union[Dict, None]:
+        """
+        Picks the smallest rollup (by number of rows, then number of dimensions) able to answer the query
+        :return: Rollup dictionary or None if query has to go to the source table
+        """
+        compatible = [r for r in self.rollups if self._is_rollup_compatible(r)]
+        if compatible.__len__() == 0:
+            return None
+        rollup = min(compatible, key=lambda r: (r['num_rows'] if r['num_rows'] is not None else float('inf'),
+                                                r['dimensions'].__len__()))
+        self.logger.info(f"Query routed to rollup {rollup['name']} ({rollup['target']}: {rollup['location']})")
+        return rollup
+
+    def _rollup_query(self, filter_str: str) -> str:
+        """
+        Creates query re-aggregating rollup table columns (sum_m, count_m, min_m, max_m) into requested grouping
+        :param filter_str: Filter string (filters use only rollup dimensions)
+        :return: Query string
+        """
+        if self.dimensions is not None:
+            dim_str = ', '.join(self.dimensions) + ', '
+            group_by_str = f" GROUP BY {', '.join(self.dimensions)} "
+        else:
+            dim_str = ""
+            group_by_str = ""
+
+        metrics_str = ', '.join([f"{ROLLUP_MAP[aggr].replace('__metric__', m)} AS {aggr}_{m}"
+                                 for aggr in self.aggregations for m in self.metrics])
+        return f"""
+        SELECT {dim_str}{metrics_str}
+        FROM `{self.rollup['location']}`
+        WHERE 1=1
+            {filter_str}
+            {group_by_str}
+            {self._sort_data()}
+            {self._limit_data()}"""
+
+    def _is_stratified(self) -> bool:
+        return (self.sample is not None) and self.sample['stratify']
+
+    def _sample_key_str(self) -> str:
+        """
+        Expression hashed by 'hash' sampling method
+        :return: FARM_FINGERPRINT of sample key column or of all selected columns
+        """
+        if self.sample['key'] is not None:
+            return f"FARM_FINGERPRINT(CAST({self.sample['key']} AS STRING))"
+        key_cols = list(dict.fromkeys((self.dimensions or list()) + self.metrics))
+        return f"FARM_FINGERPRINT(TO_JSON_STRING(STRUCT({', '.join(key_cols)})))"
+
+    def _source_data(self, filter_str: str) -> str:
+        """
+        Creates FROM source: table, sampled table or (for stratified sample) subquery with filtered and sampled rows.
+        Stratified sample keeps ceil(rate * group size) rows of each first dimension group, but at least min_rows,
+        picked by hash, and adds sample_rate column with actual rate of the group
+        :param filter_str: Filter string, used only by stratified subquery
+        :return: FROM string
+        """
+        table_str = f"`{self.project_id}.{self.dataset_id}.{self.table_id}`"
+        if self.sample is None:
+            return table_str
+
+        rate = self.sample['rate']
+        self.logger.info(f"Sampling {rate} of rows ({self.sample})")
+        if self.sample['method'] == 'system':
+            return f"{table_str} TABLESAMPLE SYSTEM ({rate * 100} PERCENT)"
+
+        if not self._is_stratified():
+            return table_str
+
+        cols = (self.dimensions or list()) + self.metrics + [f[0] for f in (self.filters or list())]
+        if self.date_range is not None:
+            cols.append(self.partitioning['field'])
+        cols_str = ', '.join(dict.fromkeys(cols))
+        strat_str = self.dimensions[0]
+        keep_str = f"GREATEST(CEIL(__n * {rate}), {self.sample['min_rows']})"
+        return f"""(
+            SELECT * EXCEPT(__rn, __n), LEAST(1, {keep_str} / __n) AS sample_rate
+            FROM (
+                SELECT {cols_str},
+                       ROW_NUMBER() OVER(PARTITION BY {strat_str} ORDER BY {self._sample_key_str()}) AS __rn,
+                       COUNT(*) OVER(PARTITION BY {strat_str}) AS __n
+                FROM {table_str}
+                WHERE 1=1
+                    {filter_str}
+            )
+            WHERE __rn <= {keep_str}
+        )"""
+
+    def _sample_data(self) -> str:
+        """
+        Creates 'hash' sampling predicate (non stratified)
+        :return: Predicate string or empty string
+        """
+        if (self.sample is None) or (self.sample['method'] != 'hash') or self._is_stratified():
+            return ""
+        return f"AND MOD(ABS({self._sample_key_str()}), 1000000) < {int(round(self.sample['rate'] * 1000000))} "
+
+    def _check_partition_pruning(self) -> None:
+        """
+        Checks if query on partitioned table filters by partition column (or uses date_range).
+        Depending on partition_filter, unpruned scan is logged as warning or raises exception
+        """
+        if (self.partitioning is None) or (self.partition_filter == 'ignore'):
+            return
+
+        partition_col = self.partitioning['field']
+        is_pruned = self.date_range is not None
+        if self.filters is not None:
+            is_pruned |= any((f[0] == partition_col) & (f[1] not in ['ne', 'nin']) for f in self.filters)
+
+        if not is_pruned:
+            msg = f"Query doesnt filter by partition column {partition_col}, it will scan the whole table"
+            if self.partition_filter == 'require':
+                raise UnprunedScanException(msg)
+            self.logger.warning(msg)
+
+    def _ordered_filters(self) -> List[Tuple[str, Tuple]]:
+        """
+        Orders filters so predicates on partition column go first, then clustering columns (in clustering order),
+        then the rest in original order
+        :return: Sorted list of (parameter name, filter)
+        """
+        priority_cols = list()
+        if self.partitioning is not None:
+            priority_cols.append(self.partitioning['field'])
+        if self.clustering is not None:
+            priority_cols += [c for c in self.clustering if c not in priority_cols]
+
+        def priority(named_filter):
+            col = named_filter[1][0]
+            return priority_cols.index(col) if col in priority_cols else priority_cols.__len__()
+        return sorted(zip(self._param_names(), self.filters), key=priority)
+
+    def _param_names(self) -> List[str]:
+        """
+        Names of query parameters of self.filters, in filters order: column_operand,
+        with _1, _2... suffix for repeated column and operand pair (pts_gt, pts_gt_1)
+        :return: List of parameter names
+        """
+        names = list()
+        counts = dict()
+        for col, operand, _ in self.filters or list():
+            name = f"{col}_{operand}"
+            count = counts.get(name, 0)
+            counts[name] = count + 1
+            names.append(name if count == 0 else f"{name}_{count}")
+        return names
+
+    def get_query_params(self) -> Dict[str, Dict]:
+        """
+        Query parameters to send along with parameterized query
+        :return: Dictionary of {name: {'type': parameter type, 'value': value(s), 'array': True for 'in'/'nin'}},
+            empty if query is not parameterized. Type comes from python value (BOOL, INT64, FLOAT64, STRING),
+            so parameter compares the same way as literal would (pts > 10.5 on INT64 column).
+            Strings filtering DATE, DATETIME, TIMESTAMP and TIME columns get the column type
+        """
+        if (not self.parameterized) or (self.filters is None):
+            return dict()
+
+        params = dict()
+        for name, (col, operand, values) in zip(self._param_names(), self.filters):
+            is_array = operand in ['in', 'nin']
+            value = [self._param_value(v) for v in values] if is_array else self._param_value(values)
+            params[name] = {'type': self._param_type(col, value if is_array else [value]),
+                            'value': value,
+                            'array': is_array}
+        return params
+
+    @staticmethod
+    def _param_value(value) -> Union[int, float, str]:
+        return value.item() if isinstance(value, np.generic) else value
+
+    def _col_type(self, col: str) -> str:
+        # INFORMATION_SCHEMA type without parameters, NUMERIC(10, 2) -> NUMERIC
+        return re.sub(r'\(.*\)', '', str(self.cols[col])).upper()
+
+    def _param_type(self, col: str, values: List) -> str:
+        """
+        Query parameter type of filter values
+        :param col: Filtered column
+        :param values: Filter values (single value in a list for scalar operands)
+        :return: BigQuery type name
+        """
+        col_type = self._col_type(col)
+        if values.__len__() == 0:
+            return col_type
+        if (col_type in TEMPORAL_TYPES) and all(isinstance(v, (str, datetime.date)) for v in values):
+            return col_type
+        if all(isinstance(v, bool) for v in values):
+            return 'BOOL'
+        if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+            return 'INT64'
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            return 'FLOAT64'
+        return 'STRING'
+
+    def _is_value_of_type(self, col: str, value) -> bool:
+        """
+        Checks if filter value can be compared with column (numbers with numeric column, strings with string column,
+        strings or dates with date/time column)
+        :param col: Filtered column
+        :param value: Single filter value
+        :return: True if value fits column type, or column type isnt checked
+        """
+        col_type = self._col_type(col)
+        value = self._param_value(value)
+        if col_type in NUMERIC_TYPES:
+            return isinstance(value, (int, float)) and not isinstance(value, bool)
+        if col_type == 'STRING':
+            return isinstance(value, str)
+        if col_type in ('BOOL', 'BOOLEAN'):
+            return isinstance(value, bool)
+        if col_type in TEMPORAL_TYPES:
+            return isinstance(value, (str, datetime.date))
+        return True
+
+    def bind(self, **values) -> None:
+        """
+        Sets new filter values of parameterized query without building the query again.
+        Values are checked the same way as in filters and have to fit column type, query text and routing stay the same
+        :param values: Parameter name and new value(s), names as in get_query_params (pts_gt=10)
+        """
+        if not self.parameterized:
+            raise WrongBindException("Only parameterized query can be bound with new values")
+
+        names = self._param_names()
+        for name in values:
+            if name not in names:
+                raise WrongBindException(f"Parameter {name} is not one of {names}")
+
+        for name, (col, operand, _) in zip(names, self.filters):
+            if name not in values:
+                continue
+            new_values = values[name] if isinstance(values[name], list) else [values[name]]
+            for value in new_values:
+                if not self._is_value_of_type(col, value):
+                    raise WrongBindException(f"Value {value!r} of {name} doesnt fit column {col} "
+                                             f"type {self._col_type(col)}")
+
+        self.filters = [(col, operand, values.get(name, value))
+                        for name, (col, operand, value) in zip(names, self.filters)]
+
+    def _date_range_data(self) -> str:
+        """
+        Creates partition pruning predicate from self.date_range, typed by partition column type
+        :return: Predicate string or empty string if there is no date range
+        """
+        if self.date_range is None:
+            return ""
+
+        col = self.partitioning['field']
+        start, end = self.date_range
+        col_type = 'TIMESTAMP' if col == '_PARTITIONTIME' else str(self.cols.get(col, 'DATE')).upper()
+        self.logger.info(f"Applying date range on {col}: {start} - {end}")
+        if col_type == 'DATE':
+            return f"AND {col} BETWEEN DATE '{start}' AND DATE '{end}' "
+        return (f"AND {col} >= {col_type}(DATE '{start}') "
+                f"AND {col} < {col_type}(DATE_ADD(DATE '{end}', INTERVAL 1 DAY)) ")
+
     # prepare query methods:
     def _filter_data(self) -> str:
         """
-        Creates filter strings (like pts > 1) from self.filters
+        Creates filter strings (like pts > 1) from self.filters and self.date_range.
+        Partition and clustering column predicates go first
         :return: Joined filter string or empty string if filters are not specified
         """
+        date_range_str = self._date_range_data()
         if self.filters is not None:
-            filters_str_list = list()
-            for index, f in enumerate(self.filters):
+            filters_str_list = [date_range_str]
+            for index, (name, f) in enumerate(self._ordered_filters()):
                 col = f[0]
                 operand = f[1]
                 values = f[2]
                 self.logger.info(f"Applying filter index[{index}]: {col} {operand} {values}")
 
-                qstr = ""  # to add quote or not
-                if operand in ('eq', 'ne', 'le', 'lt', 'ge', 'gt'):
-                    if isinstance(values, str):
-                        qstr = "'"
-                    filter_str = f'AND {col} {OPERAND_MAP[operand]} {qstr}{values}{qstr} '
+                if self.parameterized:
+                    if operand in ('eq', 'ne', 'le', 'lt', 'ge', 'gt'):
+                        filter_str = f'AND {col} {OPERAND_MAP[operand]} @{name} '
+                    else:
+                        filter_str = f'AND {col} {OPERAND_MAP[operand]} UNNEST(@{name}) '
+                elif operand in ('eq', 'ne', 'le', 'lt', 'ge', 'gt'):
+                    filter_str = f'AND {col} {OPERAND_MAP[operand]} {self._literal(values)} '
                 else:
-                    if isinstance(values[0], str):
-                        qstr = "'"
-                    values_str = f"({qstr}" + f"{qstr},{qstr}".join(values) + f"{qstr})"
+                    values_str = "(" + ",".join(self._literal(v) for v in values) + ")"
                     filter_str = f'AND {col} {OPERAND_MAP[operand]} {values_str} '
 
                 filters_str_list.append(filter_str)
             return "".join(filters_str_list)
         else:
-            return ""
+            return date_range_str
+
+    @staticmethod
+    def _literal(value: Union[int, float, str]) -> str:
+        """
+        Writes filter value as SQL literal, strings are quoted with backslashes and quotes escaped
+        :param value: Filter value
+        :return: Literal string
+        """
+        if isinstance(value, str):
+            return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+        return str(value)
 
     def _aggr_data(self) -> Tuple[str, str]:
         """
@@ -302,7 +1117,7 @@ class _QueryBuilder:
         :return: Tuple of select string, group by string
         """
         # check if we are dealing with window functions
-        is_window_aggr = True if set(self.aggregations).intersection(set(WINDOW_AGGRS)).__len__() > 0 else False
+        is_window_aggr = True if self._get_window_aggrs(self.aggregations).__len__() > 0 else False
         distinct_str = " DISTINCT " if is_window_aggr else ""
 
         # check if dimensions are provided
@@ -333,7 +1148,7 @@ class _QueryBuilder:
         # list for all aggregation x metric combinations
         aggr_x_metrics_list = list()
         for aggr in self.aggregations:
-            aggr_str = AGGR_MAP[aggr]
+            aggr_str = APPROX_MAP[aggr] if (self.approximate and aggr in APPROX_MAP) else AGGR_MAP[aggr]
 
             # if there are dimensions it will replace with OVER(PARTITION BY ) otherwise with OVER()
             if is_window_aggr:
@@ -342,10 +1157,67 @@ class _QueryBuilder:
             metrics_str = ', '.join([f"{aggr_str.replace('__metric__', m)} AS {aggr}_{m}" for m in self.metrics])
             aggr_x_metrics_list.append(metrics_str)
 
+        if self.watermark is not None:
+            aggr_x_metrics_list.append(f"MAX({self.watermark}) AS __watermark")
+
+        # stratified sample rate is the same within first dimension group
+        if self._is_stratified():
+            aggr_x_metrics_list.append("ANY_VALUE(sample_rate) AS sample_rate" if group_by_str != "" else "sample_rate")
+
         metrics_str = ", ".join(aggr_x_metrics_list)
         select_values_str = f" {distinct_str}{dim_str}{comma_str}{metrics_str} "
         return select_values_str, group_by_str
 
+    def _is_mixed_aggr(self) -> bool:
+        """
+        Checks if window function based aggregations go together with plain ones
+        :return: True if aggregations are mixed
+        """
+        window_aggrs = self._get_window_aggrs(self.aggregations)
+        return (window_aggrs.__len__() > 0) & (window_aggrs.__len__() < self.aggregations.__len__())
+
+    def _mixed_aggr_data(self) -> Tuple[str, str, str]:
+        """
+        Creates SELECT strings for mix of window and plain aggregations, computed in a single table scan:
+        inner query adds window aggregations (OVER(PARTITION BY dimensions)) to every row,
+        outer query groups by dimensions, computes plain aggregations and picks the window values with ANY_VALUE
+        (they are the same within a group)
+        :return: Tuple of outer select string, inner select string, group by string
+        """
+        window_aggrs = self._get_window_aggrs(self.aggregations)
+
+        if self.dimensions is not None:
+            dim_str = ','.join(self.dimensions)
+            partition_by_str = f" OVER(PARTITION BY {dim_str}) "
+            group_by_str = f" GROUP BY {dim_str} "
+            inner_cols = list(self.dimensions)
+            outer_cols = list(self.dimensions)
+        else:
+            partition_by_str = " OVER() "
+            group_by_str = ""
+            inner_cols = list()
+            outer_cols = list()
+
+        self.logger.info(f"Grouping {self.metrics} by {self.dimensions}. Aggregations: {self.aggregations} "
+                         f"(window aggregations {window_aggrs} in subquery)")
+
+        inner_cols += [m for m in self.metrics if m not in inner_cols]
+        for aggr in self.aggregations:
+            for m in self.metrics:
+                if aggr in window_aggrs:
+                    aggr_str = AGGR_MAP[aggr].replace("__over__", partition_by_str).replace('__metric__', m)
+                    inner_cols.append(f"{aggr_str} AS {aggr}_{m}")
+                    outer_cols.append(f"ANY_VALUE({aggr}_{m}) AS {aggr}_{m}")
+                else:
+                    aggr_str = APPROX_MAP[aggr] if (self.approximate and aggr in APPROX_MAP) else AGGR_MAP[aggr]
+                    outer_cols.append(f"{aggr_str.replace('__metric__', m)} AS {aggr}_{m}")
+
+        if self._is_stratified():
+            inner_cols.append("sample_rate")
+            outer_cols.append("ANY_VALUE(sample_rate) AS sample_rate")
+
+        return f" {', '.join(outer_cols)} ", f" {', '.join(inner_cols)} ", group_by_str
+
     def _sort_data(self) -> str:
         """
         Creates ORDER BY string from self.sort tuple
@@ -373,20 +1245,46 @@ class _QueryBuilder:
         _aggr_data   (GROUP BY and SELECT clauses)
         _sort_data   (ORDER BY clause)
         _limit_data  (LIMIT cluase)
-        To prepare its part of query and then builds the final query string
+        To prepare its part of query and then builds the final query string.
+        Mix of window and plain aggregations uses _mixed_aggr_data with a subquery instead of _aggr_data
         :return: Query string
         """
         filter_str = self._filter_data()
-        select_val_str, group_by_str = self._aggr_data()
+        source_str = self._source_data(filter_str)
+        # stratified sample subquery is filtered already
+        filter_str = "" if self._is_stratified() else filter_str + self._sample_data()
         sort_by_str = self._sort_data()
         limit_str = self._limit_data()
 
-        query = f"""
-        SELECT {select_val_str} 
-        FROM `{self.project_id}.{self.dataset_id}.{self.table_id}`
+        if (self.rollup is not None) and (self.rollup['target'] == 'gbq'):
+            query = self._rollup_query(filter_str=filter_str)
+        elif self.histogram is not None:
+            query = self._histogram_query(source_str=source_str, filter_str=filter_str)
+        elif self.scatter_bins is not None:
+            query = self._scatter_bins_query(source_str=source_str, filter_str=filter_str)
+        elif self.box_summary is not None:
+            query = self._box_summary_query(source_str=source_str, filter_str=filter_str)
+        elif self._is_mixed_aggr():
+            select_val_str, inner_select_str, group_by_str = self._mixed_aggr_data()
+            query = f"""
+        SELECT {select_val_str}
+        FROM (
+            SELECT {inner_select_str}
+            FROM {source_str}
+            WHERE 1=1
+                {filter_str}
+        )
+            {group_by_str}
+            {sort_by_str}
+            {limit_str}"""
+        else:
+            select_val_str, group_by_str = self._aggr_data()
+            query = f"""
+        SELECT {select_val_str}
+        FROM {source_str}
         WHERE 1=1
-            {filter_str} 
-            {group_by_str} 
+            {filter_str}
+            {group_by_str}
             {sort_by_str}
             {limit_str}"""
         self.logger.info("Final query: ")
@@ -394,6 +1292,43 @@ class _QueryBuilder:
 
         return query
 
+    def get_spec(self) -> Dict:
+        """
+        Canonical form of validated query parameters, so equivalent specs give the same dictionary:
+        - filters are sorted and 'in'/'nin' values are sorted and deduplicated
+        - single value 'in'/'nin' is the same as 'eq'/'ne'
+        Dimensions, metrics and aggregations keep their order as it decides the order of output columns
+        :return: Dictionary of table, dimensions, metrics, aggregations, filters, sort, limit
+        """
+        filters = None
+        if self.filters is not None:
+            filters_set = set()
+            for col, operand, values in self.filters:
+                if operand in ['in', 'nin']:
+                    values = sorted(set(values), key=lambda v: (str(type(v)), v))
+                    if values.__len__() == 1:
+                        operand = 'eq' if operand == 'in' else 'ne'
+                        values = values[0]
+                    else:
+                        values = tuple(values)
+                filters_set.add((col, operand, values))
+            filters = [list(f) for f in sorted(filters_set, key=repr)]
+
+        return {'table': f"{self.project_id}.{self.dataset_id}.{self.table_id}",
+                'dimensions': self.dimensions,
+                'metrics': self.metrics,
+                'aggregations': self.aggregations,
+                'filters': filters,
+                'sort': list(self.sort) if self.sort is not None else None,
+                'limit': self.limit,
+                'approximate': self.approximate,
+                'date_range': list(self.date_range) if self.date_range is not None else None,
+                'sample': self.sample,
+                'histogram': self.histogram,
+                'scatter_bins': self.scatter_bins,
+                'box_summary': self.box_summary,
+                'watermark': self.watermark}
+
     def _get_possible_sorters(self) -> list:
         """
         Generates list of possible sorters
@@ -411,6 +1346,42 @@ class _QueryBuilder:
             return poss_sorts_list
 
 
+class WrongBindException(Exception):
+    pass
+
+
+class WrongDateRangeException(Exception):
+    pass
+
+
+class WrongPartitionFilterException(Exception):
+    pass
+
+
+class WrongHistogramException(Exception):
+    pass
+
+
+class WrongScatterBinsException(Exception):
+    pass
+
+
+class WrongWatermarkException(Exception):
+    pass
+
+
+class WrongBoxSummaryException(Exception):
+    pass
+
+
+class WrongSampleException(Exception):
+    pass
+
+
+class UnprunedScanException(Exception):
+    pass
+
+
 class WrongLimitValue(Exception):
     pass
 
@@ -0,0 +1,244 @@
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Union
+import pandas as pd
+from .gbq_data import GBQData, InvalidSpecException
+from .utils import get_logger, PLOT_TYPES, RENDER_FORMATS
+
+
+class ReportRunner:
+    def __init__(self,
+                 report: Dict,
+                 max_queries: int = 8,
+                 max_renders: int = None,
+                 force: bool = False,
+                 log_level: str = "info"):
+        """
+        Runs report: list of charts, each is one .set() spec of the same table and one or more plots of its result.
+        Queries run concurrently (at most max_queries at a time) and every finished query is sent to
+        a pool of max_renders processes for rendering, so query and render stages overlap.
+        Output file is written only if its content changed.
+
+        Report dictionary:
+        {
+            "table": "project.dataset.table",
+            "sa_path": "sa.json",
+            "cache_dir": "cache",  (optional, same for other GBQData parameters)
+            "charts": [
+                {"set": {"dimensions": ["a"], "metrics": ["b"], "aggregations": ["sum"]},
+                 "plots": [{"type": "bar", "path": "out/bar.png", "dpi": 100, "options": {}}]}
+            ]
+        }
+        :param report: Report dictionary
+        :param max_queries: Max number of queries running at the same time
+        :param max_renders: Number of render processes (None means number of CPUs)
+        :param force: Write outputs even if they didnt change
+        :param log_level: logging level
+        """
+        self.report = report
+        self.max_queries = max_queries
+        self.max_renders = max_renders
+        self.force = force
+        self.log_level = log_level
+        self.logger = get_logger('stats.report', log_level=log_level)
+
+        self.charts = self._validate(report)
+        # stage name -> {'wall': seconds from run start to stage end, 'busy': summed task seconds, 'tasks': count},
+        # busy is None for queries, they run in threads of GBQData.iter_many
+        self.timings = dict()
+
+    @staticmethod
+    def load(path: str) -> Dict:
+        """
+        Reads report spec from YAML (requires PyYAML) or JSON file
+        :param path: Path to .yaml, .yml or .json file
+        :return: Report dictionary
+        """
+        with open(path, 'r') as f:
+            if path.endswith(('.yaml', '.yml')):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ReportSpecException("YAML report spec requires PyYAML, install it or use JSON")
+                return yaml.safe_load(f)
+            return json.load(f)
+
+    def _validate(self, report: Dict) -> List[Dict]:
+        """
+        Checks report structure and fills plot defaults (format from path extension, dpi)
+        :param report: Report dictionary
+        :return: List of charts
+        """
+        for key in ['table', 'sa_path', 'charts']:
+            if key not in report:
+                raise ReportSpecException(f"Report spec is missing '{key}'")
+
+        charts = list()
+        for index, chart in enumerate(report['charts']):
+            if ('set' not in chart) or ('plots' not in chart):
+                raise ReportSpecException(f"Chart [{index}] needs 'set' and 'plots'")
+            plots = list()
+            for plot in chart['plots']:
+                if plot.get('type') not in PLOT_TYPES:
+                    raise ReportSpecException(f"Chart [{index}] plot type has to be one of {PLOT_TYPES}")
+                if 'path' not in plot:
+                    raise ReportSpecException(f"Chart [{index}] plot {plot['type']} needs output 'path'")
+                format = plot.get('format', os.path.splitext(plot['path'])[1].lstrip('.').lower())
+                if format not in RENDER_FORMATS:
+                    raise ReportSpecException(f"Chart [{index}] output format has to be one of {RENDER_FORMATS}")
+                plots.append({'type': plot['type'],
+                              'path': plot['path'],
+                              'format': format,
+                              'dpi': plot.get('dpi', 100),
+                              'options': plot.get('options', dict())})
+            charts.append({'set': chart['set'], 'plots': plots})
+        return charts
+
+    def _make_gbq_data(self) -> GBQData:
+        gbq_params = {k: v for k, v in self.report.items() if k not in ('table', 'sa_path', 'charts')}
+        return GBQData(gbq_path=self.report['table'],
+                       sa_path=self.report['sa_path'],
+                       log_level=self.log_level,
+                       **gbq_params)
+
+    def run(self) -> Dict:
+        """
+        Runs all queries and renders all plots
+        :return: Summary dictionary: written, unchanged, failed counts and stage timings
+        """
+        run_start = time.perf_counter()
+        summary = {'written': 0, 'unchanged': 0, 'failed': 0}
+
+        g = self._make_gbq_data()
+        specs = [chart['set'] for chart in self.charts]
+        try:
+            results = g.iter_many(specs, max_workers=self.max_queries)
+        except InvalidSpecException as e:
+            raise ReportSpecException(f"Chart spec is invalid: {e}") from e
+        self._add_timing('setup', time.perf_counter() - run_start, run_start)
+
+        # spawned, not forked: fork while query threads and client connection pool are running
+        # can copy a held lock into the render process
+        with ProcessPoolExecutor(max_workers=self.max_renders,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = dict()
+            for result in results:
+                self._add_timing('query', None, run_start)
+                if result.error is not None:
+                    summary['failed'] += self.charts[result.index]['plots'].__len__()
+                    continue
+                for plot in self.charts[result.index]['plots']:
+                    future = executor.submit(_render_plot, result.df, self._plot_params(result.canonical_spec), plot,
+                                             self.force)
+                    futures[future] = (result.index, plot['path'])
+
+            for future in as_completed(futures):
+                index, path = futures[future]
+                try:
+                    status, seconds = future.result()
+                except Exception as e:
+                    self.logger.error(f"Chart [{index}] {path} failed: {e}")
+                    summary['failed'] += 1
+                    continue
+                summary[status] += 1
+                self._add_timing('render', seconds, run_start)
+
+        summary['timings'] = self.timings
+        summary['total_seconds'] = time.perf_counter() - run_start
+        return summary
+
+    @staticmethod
+    def _plot_params(canonical_spec: Dict) -> Dict:
+        # plot settings of the spec, normalized the same way as in .set()
+        keys = ['dimensions', 'metrics', 'aggregations', 'histogram', 'scatter_bins', 'box_summary']
+        return {k: canonical_spec[k] for k in keys}
+
+    def _add_timing(self, stage: str, busy: Union[float, None], run_start: float) -> None:
+        timing = self.timings.setdefault(stage, {'wall': 0.0, 'busy': None if busy is None else 0.0, 'tasks': 0})
+        timing['wall'] = time.perf_counter() - run_start
+        if busy is not None:
+            timing['busy'] += busy
+        timing['tasks'] += 1
+
+    def format_summary(self, summary: Dict) -> str:
+        """
+        Formats run summary as text table
+        :param summary: Result of run()
+        :return: Summary text
+        """
+        lines = [f"{'stage':<8}{'tasks':>7}{'busy [s]':>11}{'done at [s]':>13}"]
+        for stage, timing in summary['timings'].items():
+            busy_str = f"{timing['busy']:.2f}" if timing['busy'] is not None else '-'
+            lines.append(f"{stage:<8}{timing['tasks']:>7}{busy_str:>11}{timing['wall']:>13.2f}")
+        lines.append(f"written: {summary['written']}, unchanged: {summary['unchanged']}, "
+                     f"failed: {summary['failed']}, total: {summary['total_seconds']:.2f}s")
+        return '\n'.join(lines)
+
+
+def _render_plot(df: pd.DataFrame, plot_params: Dict, plot: Dict, force: bool):
+    """
+    Renders one plot in render process and writes it if content changed
+    :param df: Query result
+    :param plot_params: dimensions, metrics, aggregations and binning settings of the query
+    :param plot: Plot dictionary (type, path, format, dpi, options)
+    :param force: Write output even if it didnt change
+    :return: Tuple of status ('written' or 'unchanged') and render seconds
+    """
+    from .plots import _Plots
+    start = time.perf_counter()
+    plots = _Plots(df=df, logger=logging.getLogger('stats.report'), **plot_params)
+    image = plots.render(plot['type'], format=plot['format'], dpi=plot['dpi'], **plot['options'])
+
+    path = plot['path']
+    if (not force) and os.path.isfile(path) and (_file_digest(path) == hashlib.sha256(image).hexdigest()):
+        return 'unchanged', time.perf_counter() - start
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(image)
+    os.replace(tmp_path, path)
+    return 'written', time.perf_counter() - start
+
+
+def _file_digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def main(argv: Union[List[str], None] = None) -> int:
+    """
+    Console entry point: stats report.yaml [--max-queries 8] [--max-renders 4] [--force]
+    """
+    parser = argparse.ArgumentParser(prog='stats', description='Runs report of GBQ charts from YAML/JSON spec')
+    parser.add_argument('report', help='Path to report spec (.yaml, .yml or .json)')
+    parser.add_argument('--max-queries', type=int, default=8, help='Max number of queries running at the same time')
+    parser.add_argument('--max-renders', type=int, default=None, help='Number of render processes')
+    parser.add_argument('--force', action='store_true', help='Write outputs even if they didnt change')
+    parser.add_argument('--log-level', default='warning', help='Logging level')
+    args = parser.parse_args(argv)
+
+    runner = ReportRunner(report=ReportRunner.load(args.report),
+                          max_queries=args.max_queries,
+                          max_renders=args.max_renders,
+                          force=args.force,
+                          log_level=args.log_level)
+    summary = runner.run()
+    print(runner.format_summary(summary))
+    return 1 if summary['failed'] > 0 else 0
+
+
+class ReportSpecException(Exception):
+    pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
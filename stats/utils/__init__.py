@@ -1,3 +1,10 @@
 from .gbq import GBQ
+from .cache import QueryCache
+from .metadata import TableMetadataCache
+from .rollups import RollupRegistry
 from .logger import get_logger
-from .utils import WINDOW_AGGRS, AGGR_MAP, OPERAND_MAP, PLOT_TYPES
+from .utils import WINDOW_AGGRS, AGGR_MAP, APPROX_MAP, OPERAND_MAP, PLOT_TYPES, RENDER_FORMATS, ROLLUP_AGGRS, \
+    ROLLUP_MAP
+
+__all__ = ['GBQ', 'QueryCache', 'TableMetadataCache', 'RollupRegistry', 'get_logger', 'WINDOW_AGGRS', 'AGGR_MAP',
+           'APPROX_MAP', 'OPERAND_MAP', 'PLOT_TYPES', 'RENDER_FORMATS', 'ROLLUP_AGGRS', 'ROLLUP_MAP']
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Union
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class QueryCache:
+    def __init__(self,
+                 cache_dir: str,
+                 logger: logging.Logger,
+                 max_bytes: int = 1024 ** 3,
+                 ttl: Union[int, float] = 3600):
+        """
+        Local disk cache of query results, stored as parquet files.
+        Entries are keyed by canonical query spec (see _QueryBuilder.get_spec), evicted by least recent use
+        when total size goes over max_bytes and expired after ttl seconds.
+
+        Index of entries lives in cache_dir/index.json and every access to it goes through a file lock,
+        so multiple worker processes can share one cache directory.
+        :param cache_dir: Directory for parquet files and index
+        :param logger: project logger
+        :param max_bytes: Max total size of cached files in bytes
+        :param ttl: Time to live of single entry in seconds (None means no expiration)
+        """
+        self.cache_dir = cache_dir
+        self.logger = logger
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index_path = os.path.join(self.cache_dir, 'index.json')
+        self.lock_path = os.path.join(self.cache_dir, '.lock')
+
+    @staticmethod
+    def make_key(spec: Dict) -> str:
+        """
+        Hashes canonical query spec into cache key
+        :param spec: Canonical query spec dictionary
+        :return: Hex digest used as cache key and file name
+        """
+        spec_str = json.dumps(spec, sort_keys=True, default=str)
+        return hashlib.sha256(spec_str.encode('utf-8')).hexdigest()
+
+    def get(self, spec: Dict) -> Union[pd.DataFrame, None]:
+        """
+        Reads cached result for given spec
+        :param spec: Canonical query spec dictionary
+        :return: Cached DataFrame or None if there is no valid entry
+        """
+        key = self.make_key(spec)
+        with self._lock():
+            index = self._read_index()
+            entry = index.get(key)
+            if entry is None:
+                return None
+
+            file_path = self._file_path(key)
+            if self._is_expired(entry) or not os.path.isfile(file_path):
+                self._remove(index, key)
+                self._write_index(index)
+                return None
+
+            df = pd.read_parquet(file_path)
+            entry['last_access'] = time.time()
+            self._write_index(index)
+
+        self.logger.info(f"Cache hit for {spec['table']} ({key})")
+        return df
+
+    def put(self, spec: Dict, df: pd.DataFrame) -> None:
+        """
+        Stores query result for given spec and evicts old entries if cache is over size limit
+        :param spec: Canonical query spec dictionary
+        :param df: Query result
+        """
+        key = self.make_key(spec)
+        file_path = self._file_path(key)
+        tmp_path = f"{file_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        df.to_parquet(tmp_path, index=False)
+
+        with self._lock():
+            os.replace(tmp_path, file_path)
+            index = self._read_index()
+            now = time.time()
+            index[key] = {'table': spec['table'],
+                          'created': now,
+                          'last_access': now,
+                          'size': os.path.getsize(file_path)}
+            self._evict(index)
+            self._write_index(index)
+        self.logger.info(f"Cached result for {spec['table']} ({key})")
+
+    def invalidate(self, table: str = None) -> None:
+        """
+        Removes cached entries
+        :param table: project.dataset.table path to remove entries for. If None, clears whole cache
+        """
+        with self._lock():
+            index = self._read_index()
+            for key in [k for k, e in index.items() if (table is None) or (e['table'] == table)]:
+                self._remove(index, key)
+            self._write_index(index)
+        self.logger.info(f"Invalidated cache for {table if table is not None else 'all tables'}")
+
+    def _evict(self, index: Dict) -> None:
+        """
+        Drops expired entries and then least recently used ones, until total size fits max_bytes
+        :param index: Cache index (modified in place)
+        """
+        for key in [k for k, e in index.items() if self._is_expired(e)]:
+            self._remove(index, key)
+
+        total_size = sum(e['size'] for e in index.values())
+        for key in sorted(index, key=lambda k: index[k]['last_access']):
+            if total_size <= self.max_bytes:
+                break
+            total_size -= index[key]['size']
+            self._remove(index, key)
+
+    def _is_expired(self, entry: Dict) -> bool:
+        return (self.ttl is not None) and (time.time() - entry['created'] > self.ttl)
+
+    def _remove(self, index: Dict, key: str) -> None:
+        index.pop(key, None)
+        file_path = self._file_path(key)
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+
+    def _file_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def _read_index(self) -> Dict:
+        if not os.path.isfile(self.index_path):
+            return dict()
+        with open(self.index_path, 'r') as f:
+            return json.load(f)
+
+    def _write_index(self, index: Dict) -> None:
+        tmp_path = f"{self.index_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    @contextmanager
+    def _lock(self):
+        """
+        Exclusive lock on cache directory shared between processes (no-op where fcntl is not available)
+        """
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -1,33 +1,88 @@
+from __future__ import annotations
+import asyncio
+import datetime
+import functools
+import importlib.util
+import io
 import logging
-from google.cloud.exceptions import NotFound
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import pandas as pd
-from google.cloud import bigquery
-from google.oauth2 import service_account
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Iterator, Tuple, Union
+
+# google-cloud-bigquery and pyarrow are imported on first use, so importing stats stays cheap
+if TYPE_CHECKING:
+    import pyarrow as pa
+    from google.cloud import bigquery
+
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+# staging table of bulk load is dropped after commit, expiration removes it if the process was killed
+STAGING_EXPIRATION = datetime.timedelta(days=1)
 
 
 class GBQ:
     def __init__(self,
                  project_id: str,
                  sa_credentials: str,
-                 logger: logging.Logger):
+                 logger: logging.Logger,
+                 max_bytes_billed: int = None):
         """
         Managing GBQ from python
         :param project_id: gbq project id
         :param sa_credentials: path to service account credentials
         :param logger: project logger
+        :param max_bytes_billed: Max bytes billed for a single query job, jobs over it fail without being charged
         """
 
         self.project_id = project_id
         self.sa_credentials = sa_credentials
         self.logger = logger
+        self.max_bytes_billed = max_bytes_billed
 
         self.client = self._init_bq()
 
     def _init_bq(self) -> bigquery.Client:
+        from google.cloud import bigquery
+        from google.oauth2 import service_account
         sa_credentials = service_account.Credentials.from_service_account_file(self.sa_credentials)
         client = bigquery.Client(credentials=sa_credentials, project=self.project_id)
         return client
 
+    def _query_job_config(self, dry_run: bool = False, params: Dict = None) -> bigquery.QueryJobConfig:
+        """
+        Query job config with byte budget, optional dry run and query parameters
+        :param dry_run: Only validate the query and estimate processed bytes
+        :param params: Named query parameters {name: {'type': 'INT64', 'value': 1, 'array': False}}
+        :return: QueryJobConfig
+        """
+        from google.cloud import bigquery
+        job_config = bigquery.QueryJobConfig(maximum_bytes_billed=self.max_bytes_billed)
+        if dry_run:
+            job_config.dry_run = True
+            job_config.use_query_cache = False
+        if params:
+            job_config.query_parameters = [
+                bigquery.ArrayQueryParameter(name, p['type'], p['value']) if p['array']
+                else bigquery.ScalarQueryParameter(name, p['type'], p['value'])
+                for name, p in params.items()]
+        return job_config
+
+    def dry_run(self, query: str, params: Dict = None) -> Dict:
+        """
+        Validates query on the server side and estimates its cost, without running it
+        :param query: query text
+        :param params: Named query parameters
+        :return: Dictionary of total_bytes_processed and referenced_tables
+        """
+        job = self.client.query(query, job_config=self._query_job_config(dry_run=True, params=params))
+        estimate = {'total_bytes_processed': job.total_bytes_processed,
+                    'referenced_tables': [f"{t.project}.{t.dataset_id}.{t.table_id}" for t in job.referenced_tables]}
+        self.logger.info(f"Dry run: query will process {estimate['total_bytes_processed']} bytes "
+                         f"from {estimate['referenced_tables']}")
+        return estimate
+
     def drop_table(self, table_path: str) -> None:
         self.client.delete_table(table_path, not_found_ok=True)
         self.logger.info(f"Dropped table {table_path}")
@@ -41,13 +96,15 @@ class GBQ:
         self.send_query(query)
         self.logger.info(f"Truncated table {table_path}")
 
-    def send_query(self, query: str) -> bigquery.table.RowIterator:
+    def send_query(self, query: str, page_size: int = None, params: Dict = None) -> bigquery.table.RowIterator:
         """
         Sends query from variable
         :param query: query text
+        :param page_size: Number of rows fetched per result page (None leaves it to the API)
+        :param params: Named query parameters
         :return: Bigquery query result
         """
-        r = self.client.query(query).result()
+        r = self.client.query(query, job_config=self._query_job_config(params=params)).result(page_size=page_size)
         self.logger.info(f"Run query {query}")
         return r
 
@@ -60,17 +117,180 @@ class GBQ:
         with open(file, 'r') as file:
             query = file.read().replace('\n', '')
         self.logger.info(f"Read query from {file}: {query}")
-        r = self.client.query(query).result()
+        r = self.client.query(query, job_config=self._query_job_config()).result()
         self.logger.info(f"Run query finished")
         return r
 
-    def get_data(self, query: str) -> pd.DataFrame:
+    def get_data(self,
+                 query: str,
+                 use_arrow: bool = True,
+                 zero_copy: bool = False,
+                 params: Dict = None) -> pd.DataFrame:
         """
         Get data from gbq
         :param query: Query string to get data
+        :param use_arrow: Fetch the result as Arrow record batches (columnar). Falls back to row dicts without pyarrow
+        :param zero_copy: Let pyarrow release its buffers while converting, so the frame doesnt need twice the memory
+        :param params: Named query parameters
         :return: Pandad dataframe
         """
-        rows = self.send_query(query)
+        rows = self.send_query(query, params=params)
+        if use_arrow and HAS_PYARROW and hasattr(rows, 'to_arrow'):
+            return self._rows_to_df_arrow(rows, zero_copy=zero_copy)
+        return self._rows_to_df_dicts(rows)
+
+    def iter_data(self,
+                  query: str,
+                  page_size: int = 10000,
+                  use_arrow: bool = True,
+                  as_arrow: bool = False,
+                  params: Dict = None) -> Iterator[Union[pd.DataFrame, pa.RecordBatch]]:
+        """
+        Streams data from gbq, one result page at a time. Pages are fetched lazily,
+        so closing the generator (or breaking out of the loop) stops further fetches
+        :param query: Query string to get data
+        :param page_size: Max number of rows in a single page/batch
+        :param use_arrow: Fetch pages as Arrow record batches. Falls back to row dicts without pyarrow
+        :param as_arrow: Yield pyarrow.RecordBatch instead of pd.DataFrame (requires arrow fetch)
+        :param params: Named query parameters
+        :return: Generator of DataFrames (or RecordBatches)
+        """
+        rows = self.send_query(query, page_size=page_size, params=params)
+        yield from self._iter_pages(rows, use_arrow=use_arrow, as_arrow=as_arrow)
+
+    def _iter_pages(self,
+                    rows: bigquery.table.RowIterator,
+                    use_arrow: bool = True,
+                    as_arrow: bool = False) -> Iterator[Union[pd.DataFrame, pa.RecordBatch]]:
+        """
+        Converts query result page by page, next page is fetched only when previous one was consumed
+        :param rows: BigQuery query result
+        :param use_arrow: Fetch pages as Arrow record batches. Falls back to row dicts without pyarrow
+        :param as_arrow: Yield pyarrow.RecordBatch instead of pd.DataFrame (requires arrow fetch)
+        :return: Generator of DataFrames (or RecordBatches)
+        """
+        if use_arrow and HAS_PYARROW and hasattr(rows, 'to_arrow_iterable'):
+            for batch in rows.to_arrow_iterable():
+                yield batch if as_arrow else batch.to_pandas()
+        else:
+            if as_arrow:
+                raise ValueError("as_arrow requires pyarrow and arrow fetch (use_arrow=True)")
+            for page in rows.pages:
+                yield self._rows_to_df_dicts(page)
+
+    async def asend_query(self,
+                          query: str,
+                          page_size: int = None,
+                          poll_interval: float = 0.5,
+                          params: Dict = None) -> bigquery.table.RowIterator:
+        """
+        Async version of send_query. Submits the job and polls its state without blocking the event loop
+        (blocking API calls run in the default executor). If awaiting task is cancelled, the job is cancelled too
+        :param query: query text
+        :param page_size: Number of rows fetched per result page (None leaves it to the API)
+        :param poll_interval: Seconds between job state checks
+        :param params: Named query parameters
+        :return: Bigquery query result
+        """
+        loop = asyncio.get_running_loop()
+        job = await loop.run_in_executor(None, functools.partial(self.client.query,
+                                                                 query,
+                                                                 job_config=self._query_job_config(params=params)))
+        try:
+            while not await loop.run_in_executor(None, job.done):
+                await asyncio.sleep(poll_interval)
+            r = await loop.run_in_executor(None, functools.partial(job.result, page_size=page_size))
+        except asyncio.CancelledError:
+            self.logger.info(f"Cancelling job {job.job_id}")
+            await loop.run_in_executor(None, job.cancel)
+            raise
+        self.logger.info(f"Run query {query}")
+        return r
+
+    async def aiter_data(self,
+                         query: str,
+                         page_size: int = 10000,
+                         use_arrow: bool = True,
+                         as_arrow: bool = False,
+                         poll_interval: float = 0.5,
+                         params: Dict = None) -> AsyncIterator[Union[pd.DataFrame, pa.RecordBatch]]:
+        """
+        Async version of iter_data, every page is fetched in the default executor
+        :param query: Query string to get data
+        :param page_size: Max number of rows in a single page/batch
+        :param use_arrow: Fetch pages as Arrow record batches. Falls back to row dicts without pyarrow
+        :param as_arrow: Yield pyarrow.RecordBatch instead of pd.DataFrame (requires arrow fetch)
+        :param poll_interval: Seconds between job state checks
+        :param params: Named query parameters
+        :return: Async generator of DataFrames (or RecordBatches)
+        """
+        rows = await self.asend_query(query, page_size=page_size, poll_interval=poll_interval, params=params)
+        async for page in self._aiter_pages(rows, use_arrow=use_arrow, as_arrow=as_arrow):
+            yield page
+
+    async def _aiter_pages(self,
+                           rows: bigquery.table.RowIterator,
+                           use_arrow: bool = True,
+                           as_arrow: bool = False) -> AsyncIterator[Union[pd.DataFrame, pa.RecordBatch]]:
+        """
+        Async version of _iter_pages, every page is fetched in the default executor
+        :param rows: BigQuery query result
+        :param use_arrow: Fetch pages as Arrow record batches. Falls back to row dicts without pyarrow
+        :param as_arrow: Yield pyarrow.RecordBatch instead of pd.DataFrame (requires arrow fetch)
+        :return: Async generator of DataFrames (or RecordBatches)
+        """
+        pages = self._iter_pages(rows, use_arrow=use_arrow, as_arrow=as_arrow)
+        loop = asyncio.get_running_loop()
+        while True:
+            page = await loop.run_in_executor(None, next, pages, None)
+            if page is None:
+                break
+            yield page
+
+    async def aget_data(self,
+                        query: str,
+                        use_arrow: bool = True,
+                        poll_interval: float = 0.5,
+                        params: Dict = None) -> pd.DataFrame:
+        """
+        Async version of get_data
+        :param query: Query string to get data
+        :param use_arrow: Fetch the result as Arrow record batches (columnar). Falls back to row dicts without pyarrow
+        :param poll_interval: Seconds between job state checks
+        :param params: Named query parameters
+        :return: Pandas dataframe
+        """
+        rows = await self.asend_query(query, poll_interval=poll_interval, params=params)
+        # arrow batches only when result can be fetched as arrow (older clients lack to_arrow_iterable)
+        use_arrow = use_arrow and HAS_PYARROW and hasattr(rows, 'to_arrow_iterable')
+        pages = [page async for page in self._aiter_pages(rows, use_arrow=use_arrow, as_arrow=use_arrow)]
+        if pages.__len__() == 0:
+            return pd.DataFrame()
+        if use_arrow:
+            import pyarrow as pa
+            return pa.Table.from_batches(pages).to_pandas()
+        return pd.concat(pages, ignore_index=True)
+
+    @staticmethod
+    def _rows_to_df_arrow(rows: bigquery.table.RowIterator, zero_copy: bool = False) -> pd.DataFrame:
+        """
+        Columnar conversion of query result: RowIterator -> pyarrow.Table -> pd.DataFrame
+        :param rows: BigQuery query result
+        :param zero_copy: split_blocks + self_destruct conversion, arrow table cant be used afterwards
+        :return: Pandas dataframe
+        """
+        table = rows.to_arrow()
+        if zero_copy:
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+        return table.to_pandas()
+
+    @staticmethod
+    def _rows_to_df_dicts(rows: bigquery.table.RowIterator) -> pd.DataFrame:
+        """
+        Row by row conversion of query result, used as a fallback when arrow is not available
+        :param rows: BigQuery query result
+        :return: Pandas dataframe
+        """
         row_list = list()
         for r in rows:
             row_list.append(dict(zip(r.keys(), r.values())))
@@ -106,6 +326,7 @@ class GBQ:
         :param dataset_id: dataset id
         :param table_id: table id
         """
+        from google.cloud import bigquery
         table_schema = self.get_table_schema(dataset_id, table_id)
         table_path = f"{self.project_id}.{dataset_id}.{table_id}"
         schema_list = list()
@@ -131,6 +352,7 @@ class GBQ:
         :param dataset_id: dataset id
         :param table_id: table id
         """
+        from google.cloud import bigquery
         table_path = f"{self.project_id}.{dataset_id}.{table_id}"
         job_config = bigquery.LoadJobConfig(autodetect=True)
         job = self.client.load_table_from_dataframe(
@@ -138,6 +360,26 @@ class GBQ:
         )
         r = job.result()
 
+    def _is_job_done(self, job_id: str, location: str = None) -> bool:
+        """
+        Checks if job finished without errors, running job is waited for.
+        Error of the lookup itself is raised, as job state stays unknown
+        :param job_id: Job id
+        :param location: Location of the job (outside US and EU jobs are not found without it)
+        :return: True if job is done and has no error
+        """
+        from google.api_core.exceptions import GoogleAPICallError, NotFound
+        try:
+            job = self.client.get_job(job_id, location=location)
+        except NotFound:
+            return False
+        if job.state != 'DONE':
+            try:
+                job.result()
+            except GoogleAPICallError:
+                pass
+        return (job.state == 'DONE') and (job.error_result is None)
+
     def check_if_table_exists(self, dataset_id: str, table_id: str) -> bool:
         """
         Method checking if given table exists
@@ -145,6 +387,7 @@ class GBQ:
         :param table_id: name of table
         :return: True/False
         """
+        from google.cloud.exceptions import NotFound
         try:
             table_path = f'{self.project_id}.{dataset_id}.{table_id}'
             self.client.get_table(table_path)
@@ -153,16 +396,62 @@ class GBQ:
             table_exists = False
         return table_exists
 
-    def write_data(self, df: pd.DataFrame, dataset_id: str, table_id: str, if_exists: str = 'append') -> None:
+    def get_table_info(self, dataset_id: str, table_id: str) -> Union[Dict, None]:
+        """
+        Gets table level metadata with a single tables.get call (no query job)
+        :param dataset_id: name of dataset
+        :param table_id: name of table
+        :return: Dictionary of modified, partitioning, clustering, num_rows or None if table doesnt exist
+        """
+        from google.cloud.exceptions import NotFound
+        table_path = f'{self.project_id}.{dataset_id}.{table_id}'
+        try:
+            table = self.client.get_table(table_path)
+        except NotFound:
+            return None
+
+        partitioning = None
+        if table.time_partitioning is not None:
+            partitioning = {'type': table.time_partitioning.type_,
+                            'field': table.time_partitioning.field or '_PARTITIONTIME'}
+        elif table.range_partitioning is not None:
+            partitioning = {'type': 'RANGE',
+                            'field': table.range_partitioning.field}
+
+        return {'modified': table.modified.isoformat() if table.modified is not None else None,
+                'partitioning': partitioning,
+                'clustering': table.clustering_fields,
+                'num_rows': table.num_rows}
+
+    def write_data(self,
+                   df: pd.DataFrame,
+                   dataset_id: str,
+                   table_id: str,
+                   if_exists: str = 'append',
+                   chunk_rows: int = None,
+                   max_workers: int = 4,
+                   max_retries: int = 3,
+                   progress: Callable[[Dict], None] = None) -> Union[Dict, None]:
         """
         Safely writes data
         :param df: pandas dataframe to insert
         :param dataset_id: Name of dataset
         :param table_id: Name of table
         :param if_exists: 'append' or 'replace'
+        :param chunk_rows: If set, data is written with bulk load (see _bulk_write) in parquet chunks of chunk_rows rows
+        :param max_workers: Bulk load: number of chunks serialized and loaded at the same time
+        :param max_retries: Bulk load: retries of a single chunk after transient error
+        :param progress: Bulk load: callback called with load metrics after every loaded chunk
+        :return: Load metrics of bulk load, None for single load
         """
         table_exists = self.check_if_table_exists(dataset_id, table_id)
         table_path = f"{self.project_id}.{dataset_id}.{table_id}"
+        if (chunk_rows is not None) and (df.shape[0] > 0):
+            self.logger.info(f"Bulk loading {df.shape[0]} rows to {table_path} ({if_exists})")
+            return self._bulk_write(df, table_path, table_exists=table_exists, append=(if_exists == 'append'),
+                                    chunk_rows=chunk_rows, max_workers=max_workers, max_retries=max_retries,
+                                    progress=progress)
+
         if table_exists:
             # table exists, check the if_exists argument:
             if if_exists == 'append':
@@ -175,3 +464,166 @@ class GBQ:
         else:
             self.logger.info(f"Table {table_path} doesnt exist, creating")
             self._add_rows_new_table(df, dataset_id, table_id)
+
+    def _bulk_write(self,
+                    df: pd.DataFrame,
+                    table_path: str,
+                    table_exists: bool,
+                    append: bool,
+                    chunk_rows: int,
+                    max_workers: int = 4,
+                    max_retries: int = 3,
+                    progress: Callable[[Dict], None] = None) -> Dict:
+        """
+        Bulk load through staging table. Frame is split into chunks of chunk_rows, every chunk is serialized
+        to parquet and loaded to staging table by its own load job, at most max_workers chunks at a time,
+        so memory stays bounded by max_workers serialized chunks. Failed chunk is retried alone.
+        When all chunks are loaded, staging table is copied to target in a single copy job
+        (WRITE_APPEND or WRITE_TRUNCATE), so target gets either all rows or none. Staging table is always dropped
+        and expires after STAGING_EXPIRATION, in case the process is killed before dropping it.
+
+        Appending: staging table is created with target schema, partitioning and clustering.
+        Replacing or new table: schema comes from parquet of the first chunk, loaded before the others.
+        Replaced table keeps its partitioning and clustering (copy job requires the same on both tables)
+        :param df: pandas dataframe to insert
+        :param table_path: project.dataset.table
+        :param table_exists: Target table exists
+        :param append: Append to existing table, otherwise target is created or replaced
+        :param chunk_rows: Number of rows in a single chunk
+        :param max_workers: Number of chunks serialized and loaded at the same time
+        :param max_retries: Retries of a single chunk after transient error
+        :param progress: Callback called with load metrics after every loaded chunk
+        :return: Load metrics: rows, rows_total, chunks, chunks_total, bytes (parquet), retries, seconds,
+            rows_per_second, bytes_per_second
+        """
+        if not HAS_PYARROW:
+            raise ValueError("Bulk load requires pyarrow")
+        if chunk_rows <= 0:
+            raise ValueError("chunk_rows has to be greater than 0")
+        if max_workers <= 0:
+            raise ValueError("max_workers has to be greater than 0")
+        if max_retries < 0:
+            raise ValueError("max_retries cant be negative")
+        from google.cloud import bigquery
+        import pyarrow as pa
+
+        # pyarrow sets up its pandas support on first conversion and that isnt thread safe,
+        # so it is done here before chunks are converted in parallel
+        pa.Table.from_pandas(df.iloc[:0], preserve_index=False)
+
+        start = time.perf_counter()
+        starts = list(range(0, df.shape[0], chunk_rows))
+        metrics = {'table': table_path, 'rows': 0, 'rows_total': df.shape[0], 'chunks': 0,
+                   'chunks_total': starts.__len__(), 'bytes': 0, 'retries': 0, 'seconds': 0.0,
+                   'rows_per_second': 0.0, 'bytes_per_second': 0.0}
+        staging_path = f"{table_path}__staging_{uuid.uuid4().hex[:8]}"
+        # load jobs run (and are looked up) in the dataset location
+        location = self.client.get_dataset(table_path.rsplit('.', 1)[0]).location
+
+        append = append and table_exists
+        job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.PARQUET,
+                                            write_disposition=bigquery.job.WriteDisposition.WRITE_APPEND)
+        if table_exists:
+            target = self.client.get_table(table_path)
+            job_config.time_partitioning = target.time_partitioning
+            job_config.range_partitioning = target.range_partitioning
+            job_config.clustering_fields = target.clustering_fields
+        if append:
+            job_config.schema = target.schema
+            staging = bigquery.Table(staging_path, schema=target.schema)
+            staging.time_partitioning = target.time_partitioning
+            staging.range_partitioning = target.range_partitioning
+            staging.clustering_fields = target.clustering_fields
+            staging.expires = datetime.datetime.now(datetime.timezone.utc) + STAGING_EXPIRATION
+            self.client.create_table(staging)
+
+        def on_loaded(result: Tuple[int, int, int]) -> None:
+            rows, size, retries = result
+            metrics['rows'] += rows
+            metrics['chunks'] += 1
+            metrics['bytes'] += size
+            metrics['retries'] += retries
+            metrics['seconds'] = time.perf_counter() - start
+            metrics['rows_per_second'] = metrics['rows'] / metrics['seconds']
+            metrics['bytes_per_second'] = metrics['bytes'] / metrics['seconds']
+            self.logger.info(f"Loaded chunk {metrics['chunks']}/{metrics['chunks_total']} to {staging_path}, "
+                             f"{metrics['rows_per_second']:.0f} rows/s")
+            if progress is not None:
+                progress(dict(metrics))
+
+        try:
+            if not append:
+                # first chunk creates staging table, so parallel loads dont race to create it
+                first = self._load_chunk(df.iloc[:chunk_rows], staging_path, job_config, 0, location, max_retries)
+                on_loaded(first)
+                starts = starts[1:]
+                staging = self.client.get_table(staging_path)
+                staging.expires = datetime.datetime.now(datetime.timezone.utc) + STAGING_EXPIRATION
+                self.client.update_table(staging, ['expires'])
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                pending = set()
+                for chunk_start in starts:
+                    if pending.__len__() >= max_workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            on_loaded(future.result())
+                    pending.add(executor.submit(self._load_chunk, df.iloc[chunk_start:chunk_start + chunk_rows],
+                                                staging_path, job_config, chunk_start, location, max_retries))
+                for future in wait(pending).done:
+                    on_loaded(future.result())
+
+            write_disposition = bigquery.job.WriteDisposition.WRITE_APPEND if append \
+                else bigquery.job.WriteDisposition.WRITE_TRUNCATE
+            self.client.copy_table(staging_path, table_path,
+                                   job_config=bigquery.CopyJobConfig(write_disposition=write_disposition)).result()
+            self.logger.info(f"Committed {metrics['rows']} rows from {staging_path} to {table_path}")
+        finally:
+            self.drop_table(staging_path)
+
+        metrics['seconds'] = time.perf_counter() - start
+        return metrics
+
+    def _load_chunk(self,
+                    chunk: pd.DataFrame,
+                    staging_path: str,
+                    job_config: bigquery.LoadJobConfig,
+                    chunk_start: int,
+                    location: str = None,
+                    max_retries: int = 3) -> Tuple[int, int, int]:
+        """
+        Serializes chunk to parquet in memory and appends it to staging table. Load job either loads all rows
+        or none. Every attempt has its own deterministic job id, so after an error (which can also come from
+        polling a job that succeeded on the server) the job is looked up and chunk is sent again only if it
+        didnt load
+        :param chunk: Part of the frame
+        :param staging_path: project.dataset.table of staging table
+        :param job_config: Parquet append load config (schema, partitioning and clustering of staging table)
+        :param chunk_start: Index of the first row of chunk in the frame, part of job id
+        :param location: Location of the dataset, load job runs and is looked up there
+        :param max_retries: Retries after transient error (server error, rate limit, connection error)
+        :return: Tuple of rows, parquet bytes and number of retries
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        from google.api_core.exceptions import ServerError, TooManyRequests
+
+        job_id_prefix = re.sub(r'[^A-Za-z0-9_-]', '_', f"{staging_path}_{chunk_start}")
+
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pandas(chunk, preserve_index=False), buffer)
+        size = buffer.tell()
+        for attempt in range(max_retries + 1):
+            job_id = f"{job_id_prefix}_{attempt}"
+            try:
+                self.client.load_table_from_file(buffer, staging_path, rewind=True, job_id=job_id,
+                                                 location=location, job_config=job_config).result()
+                return chunk.shape[0], size, attempt
+            except (ServerError, TooManyRequests, OSError) as e:
+                if self._is_job_done(job_id, location=location):
+                    self.logger.info(f"Load job {job_id} succeeded despite error ({e})")
+                    return chunk.shape[0], size, attempt
+                if attempt == max_retries:
+                    raise
+                self.logger.warning(f"Chunk load to {staging_path} failed ({e}), retry {attempt + 1}/{max_retries}")
+                time.sleep(min(2 ** attempt, 30))
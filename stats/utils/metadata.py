@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import uuid
+from typing import Dict, Union
+
+
+class TableMetadataCache:
+    # shared by all instances within the process
+    _memory = dict()
+
+    def __init__(self,
+                 logger: logging.Logger,
+                 metadata_dir: str = None):
+        """
+        Cache of table metadata (cols, partitioning, clustering, last modified time),
+        kept in process memory and optionally as json files in metadata_dir.
+        Entry is valid as long as its 'modified' value matches the current table last modified time,
+        which is cheap to get (tables.get API call, no query job)
+        :param logger: project logger
+        :param metadata_dir: Directory for json metadata files. If None, metadata is cached only in memory
+        """
+        self.logger = logger
+        self.metadata_dir = metadata_dir
+        if self.metadata_dir is not None:
+            os.makedirs(self.metadata_dir, exist_ok=True)
+
+    def get(self, table_path: str, modified: str) -> Union[Dict, None]:
+        """
+        Returns cached metadata if it is still valid
+        :param table_path: project.dataset.table
+        :param modified: Current last modified time of the table
+        :return: Metadata dictionary or None if missing or outdated
+        """
+        meta = self._memory.get(table_path)
+        if (meta is None) and (self.metadata_dir is not None):
+            meta = self._read_file(table_path)
+            if meta is not None:
+                self._memory[table_path] = meta
+
+        if meta is None:
+            return None
+
+        if meta['modified'] != modified:
+            self.logger.info(f"Metadata of {table_path} is outdated (modified {modified})")
+            return None
+
+        self.logger.info(f"Using cached metadata of {table_path}")
+        return meta
+
+    def put(self, table_path: str, meta: Dict) -> None:
+        """
+        Stores table metadata in memory and on disk
+        :param table_path: project.dataset.table
+        :param meta: Metadata dictionary, has to have 'modified' key
+        """
+        self._memory[table_path] = meta
+        if self.metadata_dir is not None:
+            file_path = self._file_path(table_path)
+            tmp_path = f"{file_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, file_path)
+
+    def invalidate(self, table_path: str) -> None:
+        """
+        Removes table metadata from memory and disk
+        :param table_path: project.dataset.table
+        """
+        self._memory.pop(table_path, None)
+        if self.metadata_dir is not None:
+            file_path = self._file_path(table_path)
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+
+    def _read_file(self, table_path: str) -> Union[Dict, None]:
+        file_path = self._file_path(table_path)
+        if not os.path.isfile(file_path):
+            return None
+        with open(file_path, 'r') as f:
+            return json.load(f)
+
+    def _file_path(self, table_path: str) -> str:
+        return os.path.join(self.metadata_dir, f"{table_path}.json")
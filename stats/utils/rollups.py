@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import uuid
+from typing import Dict, List
+
+
+class RollupRegistry:
+    def __init__(self,
+                 logger: logging.Logger,
+                 rollup_dir: str = None):
+        """
+        Registry of materialized rollups (pre-aggregated copies of source table), kept in memory
+        and optionally in rollup_dir/rollups.json, next to parquet rollups.
+        Each rollup is a dictionary of:
+            name, dimensions, metrics, target ('gbq' or 'parquet'), location (table path or parquet file),
+            num_rows and source_modified (last modified time of source table when rollup was built)
+        :param logger: project logger
+        :param rollup_dir: Directory for registry file and parquet rollups. If None, registry lives only in memory
+        """
+        self.logger = logger
+        self.rollup_dir = rollup_dir
+        self._rollups = dict()
+        if self.rollup_dir is not None:
+            os.makedirs(self.rollup_dir, exist_ok=True)
+            self.index_path = os.path.join(self.rollup_dir, 'rollups.json')
+            if os.path.isfile(self.index_path):
+                with open(self.index_path, 'r') as f:
+                    self._rollups = json.load(f)
+
+    def get(self, table_path: str) -> List[Dict]:
+        """
+        Returns rollups of the source table
+        :param table_path: project.dataset.table of source table
+        :return: List of rollup dictionaries
+        """
+        return list(self._rollups.get(table_path, dict()).values())
+
+    def put(self, table_path: str, rollup: Dict) -> None:
+        """
+        Registers (or replaces) rollup of the source table
+        :param table_path: project.dataset.table of source table
+        :param rollup: Rollup dictionary
+        """
+        self._rollups.setdefault(table_path, dict())[rollup['name']] = rollup
+        self._write()
+        self.logger.info(f"Registered rollup {rollup['name']} of {table_path} ({rollup['num_rows']} rows)")
+
+    def remove(self, table_path: str, name: str) -> None:
+        """
+        Removes rollup from registry
+        :param table_path: project.dataset.table of source table
+        :param name: Rollup name
+        """
+        self._rollups.get(table_path, dict()).pop(name, None)
+        self._write()
+
+    def _write(self) -> None:
+        if self.rollup_dir is None:
+            return
+        tmp_path = f"{self.index_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._rollups, f)
+        os.replace(tmp_path, self.index_path)
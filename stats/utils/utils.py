@@ -37,11 +37,46 @@ AGGR_MAP = {"avg": "AVG(__metric__)",
             "none": "__metric__",
             "min_run": "MIN(__metric__) __over__",
             "max_run": "MAX(__metric__) __over__",
-            "stdev": "STDDEV_POP(__metric_) __over__",
-            "var": "VAR_POP(__metric_) __over__"
+            "stdev": "STDDEV_POP(__metric__) __over__",
+            "var": "VAR_POP(__metric__) __over__"
             }
 
+# used instead of AGGR_MAP with approximate=True, so these can be computed in plain GROUP BY
+APPROX_MAP = {"count_distinct": "APPROX_COUNT_DISTINCT(__metric__)",
+              "median": "APPROX_QUANTILES(__metric__, 100)[OFFSET(50)]",
+              "q1": "APPROX_QUANTILES(__metric__, 100)[OFFSET(25)]",
+              "q3": "APPROX_QUANTILES(__metric__, 100)[OFFSET(75)]",
+              "p05": "APPROX_QUANTILES(__metric__, 100)[OFFSET(5)]",
+              "p10": "APPROX_QUANTILES(__metric__, 100)[OFFSET(10)]",
+              "p20": "APPROX_QUANTILES(__metric__, 100)[OFFSET(20)]",
+              "p30": "APPROX_QUANTILES(__metric__, 100)[OFFSET(30)]",
+              "p40": "APPROX_QUANTILES(__metric__, 100)[OFFSET(40)]",
+              "p60": "APPROX_QUANTILES(__metric__, 100)[OFFSET(60)]",
+              "p80": "APPROX_QUANTILES(__metric__, 100)[OFFSET(80)]",
+              "p85": "APPROX_QUANTILES(__metric__, 100)[OFFSET(85)]",
+              "p90": "APPROX_QUANTILES(__metric__, 100)[OFFSET(90)]",
+              "p95": "APPROX_QUANTILES(__metric__, 100)[OFFSET(95)]",
+              "p99": "APPROX_QUANTILES(__metric__, 100)[OFFSET(99)]",
+              "min_run": "MIN(__metric__)",
+              "max_run": "MAX(__metric__)",
+              "stdev": "STDDEV_POP(__metric__)",
+              "var": "VAR_POP(__metric__)"
+              }
+
 WINDOW_AGGRS = ["q1", "median", "q3", "stdev", "var", "min_run", "max_run",
-                "p05", "p10", "p20", "p30", "p40", "p60", "p80", "p90", "p95", "p99"]
+                "p05", "p10", "p20", "p30", "p40", "p60", "p80", "p85", "p90", "p95", "p99"]
+
+# aggregates stored per metric in rollup tables, they re-aggregate exactly into any coarser grouping
+ROLLUP_AGGRS = ["sum", "count", "min", "max"]
+
+# aggregations that can be answered from rollup columns (aggr_metric), avg is rebuilt from sum and count
+ROLLUP_MAP = {"sum": "SUM(sum___metric__)",
+              "count": "COALESCE(SUM(count___metric__), 0)",
+              "min": "MIN(min___metric__)",
+              "max": "MAX(max___metric__)",
+              "avg": "SAFE_DIVIDE(SUM(sum___metric__), SUM(count___metric__))"
+              }
 
 PLOT_TYPES = ["bar", "barh", "boxplot", "density", "densityg", "hist", "histg", "scatter"]
+
+RENDER_FORMATS = ["png", "svg"]
@@ -0,0 +1,94 @@
+import unittest
+import asyncio
+import logging
+from unittest import mock
+import pandas as pd
+from stats.utils.gbq import GBQ
+from tests.gbq_fetch_tests import FakeRowIterator
+
+
+class LegacyRowIterator:
+    """
+    Stand-in for RowIterator of older bigquery clients, without to_arrow_iterable
+    """
+    def __init__(self, data: dict):
+        self.rows = FakeRowIterator(data)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    @property
+    def pages(self):
+        return self.rows.pages
+
+
+class FakeJob:
+    """
+    Stand-in for bigquery.QueryJob, done after given number of polls
+    """
+    def __init__(self, data: dict, polls_to_done: int):
+        self.job_id = 'fake_job'
+        self.data = data
+        self.polls_left = polls_to_done
+        self.cancelled = False
+
+    def done(self):
+        self.polls_left -= 1
+        return self.polls_left < 0
+
+    def result(self, page_size=None):
+        return FakeRowIterator(self.data, page_size=page_size)
+
+    def cancel(self):
+        self.cancelled = True
+        return True
+
+
+class FakeClient:
+    """
+    Stand-in for bigquery.Client, creates FakeJob for every query
+    """
+    def __init__(self, data: dict, polls_to_done: int = 2):
+        self.data = data
+        self.polls_to_done = polls_to_done
+        self.jobs = list()
+
+    def query(self, query, job_config=None):
+        job = FakeJob(self.data, self.polls_to_done)
+        self.jobs.append(job)
+        return job
+
+
+class GBQAsyncTests(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.object(GBQ, '_init_bq'):
+            self.gbq = GBQ(project_id='project', sa_credentials='sa.json', logger=logging.getLogger('stats'))
+        self.data = {'team_abbreviation': ['DEN', 'LAL', 'BOS'], 'sum_pts': [10, 20, 30]}
+        self.gbq.client = FakeClient(self.data)
+
+    def test_aget_data(self):
+        for use_arrow in [True, False]:
+            df = asyncio.run(self.gbq.aget_data('SELECT 1', use_arrow=use_arrow, poll_interval=0))
+            pd.testing.assert_frame_equal(df, pd.DataFrame(self.data))
+
+    def test_aget_data_without_arrow_iterable(self):
+        with mock.patch.object(FakeJob, 'result', lambda job, page_size=None: LegacyRowIterator(job.data)):
+            df = asyncio.run(self.gbq.aget_data('SELECT 1', poll_interval=0))
+        pd.testing.assert_frame_equal(df, pd.DataFrame(self.data))
+
+    def test_aiter_data(self):
+        async def collect():
+            return [b async for b in self.gbq.aiter_data('SELECT 1', page_size=2, poll_interval=0)]
+        assert [b.shape[0] for b in asyncio.run(collect())] == [2, 1]
+
+    def test_cancel_cancels_job(self):
+        self.gbq.client = FakeClient(self.data, polls_to_done=10 ** 6)
+
+        async def cancel_after_start():
+            task = asyncio.ensure_future(self.gbq.aget_data('SELECT 1', poll_interval=0.01))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        asyncio.run(cancel_after_start())
+        assert self.gbq.client.jobs[0].cancelled
@@ -0,0 +1,57 @@
+import unittest
+import logging
+from unittest import mock
+from stats import GBQData
+from stats.gbq_data import QueryOverBudgetException
+from stats.utils import GBQ
+from tests.helpers import GBQDataTestCase
+
+
+class GBQDryRunTests(unittest.TestCase):
+    def test_dry_run_job_config_and_estimate(self):
+        with mock.patch.object(GBQ, '_init_bq'):
+            gbq = GBQ(project_id='p', sa_credentials='sa.json', logger=logging.getLogger('stats'),
+                      max_bytes_billed=1000)
+        table_ref = mock.Mock(project='p', dataset_id='d', table_id='t')
+        gbq.client.query.return_value = mock.Mock(total_bytes_processed=123, referenced_tables=[table_ref])
+        estimate = gbq.dry_run('SELECT 1')
+        job_config = gbq.client.query.call_args.kwargs['job_config']
+        assert job_config.dry_run
+        assert job_config.maximum_bytes_billed == 1000
+        assert estimate == {'total_bytes_processed': 123, 'referenced_tables': ['p.d.t']}
+
+    def test_query_parameters_job_config(self):
+        with mock.patch.object(GBQ, '_init_bq'):
+            gbq = GBQ(project_id='p', sa_credentials='sa.json', logger=logging.getLogger('stats'))
+        job_config = gbq._query_job_config(params={'pts_gt': {'type': 'INT64', 'value': 10, 'array': False},
+                                                   'team_in': {'type': 'STRING', 'value': ['DEN'], 'array': True}})
+        params = {p.name: p for p in job_config.query_parameters}
+        assert (params['pts_gt'].type_, params['pts_gt'].value) == ('INT64', 10)
+        assert (params['team_in'].array_type, params['team_in'].values) == ('STRING', ['DEN'])
+
+
+class GBQDataBudgetTests(GBQDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gbq.dry_run.return_value = {'total_bytes_processed': 5000, 'referenced_tables': ['p.d.t']}
+
+    def test_over_budget_is_rejected(self):
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error', max_bytes_billed=1000)
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'])
+        with self.assertRaises(QueryOverBudgetException):
+            g.get()
+        assert self.gbq.get_data.call_count == 0
+
+    def test_within_budget_runs(self):
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error', max_bytes_billed=10000)
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'])
+        g.get()
+        assert self.gbq.get_data.call_count == 1
+        assert g.estimate()['total_bytes_processed'] == 5000
+
+    def test_over_budget_streaming_is_rejected(self):
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error', max_bytes_billed=1000)
+        g.set(metrics=['pts'], aggregations=['none'])
+        with self.assertRaises(QueryOverBudgetException):
+            g.iter_batches()
+        assert self.gbq.iter_data.call_count == 0
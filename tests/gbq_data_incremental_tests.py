@@ -0,0 +1,65 @@
+import os
+import pandas as pd
+from stats import GBQData
+from stats.gbq_data import QueryOverBudgetException
+from tests.helpers import GBQDataTestCase
+
+SCHEMA_DF = pd.DataFrame({'column_name': ['team_abbreviation', 'pts', 'ingested_at'],
+                          'data_type': ['STRING', 'INT64', 'TIMESTAMP']})
+
+
+def partials(teams, sums, counts, mins, maxs, watermarks):
+    return pd.DataFrame({'team_abbreviation': teams, 'sum_pts': sums, 'count_pts': counts,
+                         'min_pts': mins, 'max_pts': maxs,
+                         '__watermark': pd.to_datetime(watermarks, utc=True)})
+
+
+class GBQDataIncrementalTests(GBQDataTestCase):
+    schema_df = SCHEMA_DF
+
+    def test_refresh_merges_new_rows(self):
+        self.gbq.get_data.side_effect = [
+            partials(['DEN', 'LAL'], [30, 10], [2, 1], [10, 10], [20, 10], ['2022-01-01', '2022-01-02']),
+            partials(['LAL', 'BOS'], [50, 5], [1, 1], [50, 5], [50, 5], ['2022-01-03', '2022-01-03'])]
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error',
+                    cache_dir=os.path.join(self.tmp_dir.name, 'cache'))
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum', 'avg', 'max'],
+              filters=[('pts', 'gt', 0)], sort=('sum_pts', 'desc'))
+
+        df = g.get(incremental='ingested_at')
+        assert not df.attrs['incremental']
+        assert 'MAX(ingested_at) AS __watermark' in self.gbq.get_data.call_args.kwargs['query']
+        assert df['sum_pts'].tolist() == [30, 10]
+
+        # new instance reads stored partial aggregates from cache and queries only newer rows
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error',
+                    cache_dir=os.path.join(self.tmp_dir.name, 'cache'))
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum', 'avg', 'max'],
+              filters=[('pts', 'gt', 0)], sort=('sum_pts', 'desc'))
+        df = g.get(incremental='ingested_at')
+        query = self.gbq.get_data.call_args.kwargs['query']
+        assert "AND ingested_at > '2022-01-02T00:00:00+00:00'" in query
+        assert "AND pts > 0" in query
+        assert df.attrs['incremental']
+        assert df.columns.tolist() == ['team_abbreviation', 'sum_pts', 'avg_pts', 'max_pts']
+        assert df['team_abbreviation'].tolist() == ['LAL', 'DEN', 'BOS']
+        assert df['sum_pts'].tolist() == [60, 30, 5]
+        assert df['avg_pts'].tolist() == [30.0, 15.0, 5.0]
+        assert df['max_pts'].tolist() == [50, 20, 5]
+
+    def test_non_mergeable_falls_back_to_full_query(self):
+        self.gbq.get_data.return_value = pd.DataFrame({'team_abbreviation': ['DEN'], 'median_pts': [10.0]})
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error')
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['median'])
+        df = g.get(incremental='ingested_at')
+        assert not df.attrs['incremental']
+        assert self.gbq.get_data.call_args.kwargs['query'] == g.query
+
+    def test_over_budget_state_query_not_sent(self):
+        self.gbq.dry_run.return_value = {'total_bytes_processed': 2000}
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error', max_bytes_billed=1000)
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'])
+        with self.assertRaises(QueryOverBudgetException):
+            g.get(incremental='ingested_at')
+        assert 'MAX(ingested_at) AS __watermark' in self.gbq.dry_run.call_args.kwargs['query']
+        self.gbq.get_data.assert_not_called()
@@ -0,0 +1,22 @@
+from stats import GBQData
+from tests.helpers import GBQDataTestCase
+
+
+class GBQDataLazyTests(GBQDataTestCase):
+    def test_lazy_init_does_not_connect(self):
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error', lazy=True)
+        assert self.gbq_mock.call_count == 0
+        assert g.cols is None
+
+    def test_lazy_connects_on_set(self):
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error', lazy=True)
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'])
+        assert self.gbq_mock.call_count == 1
+        assert 'pts' in g.cols
+
+    def test_background_warmup(self):
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error', lazy=True)
+        g.warmup(background=True).join()
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'])
+        assert self.gbq_mock.call_count == 1
+        assert self.gbq_mock.return_value.get_table_info.call_count == 1
@@ -0,0 +1,46 @@
+import pandas as pd
+from stats import GBQData
+from stats.gbq_data import InvalidSpecException
+from tests.helpers import GBQDataTestCase
+
+SCHEMA_DF = pd.DataFrame({'column_name': ['team_abbreviation', 'pts', 'fga'],
+                          'data_type': ['STRING', 'INT64', 'INT64']})
+
+
+def fake_get_data(query, use_arrow=True, params=None):
+    if 'fga' in query:
+        raise RuntimeError('query failed')
+    return pd.DataFrame({'query': [query]})
+
+
+class GBQDataManyTests(GBQDataTestCase):
+    schema_df = SCHEMA_DF
+
+    def setUp(self):
+        super().setUp()
+        self.gbq.get_data.side_effect = fake_get_data
+        self.g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='critical')
+
+    def test_results_in_order_with_isolated_errors(self):
+        specs = [dict(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=[aggr])
+                 for aggr in ['sum', 'avg', 'max']]
+        specs.insert(1, dict(metrics=['fga'], aggregations=['sum']))
+        results = self.g.get_many(specs, max_workers=2)
+        assert [r.index for r in results] == [0, 1, 2, 3]
+        assert isinstance(results[1].error, RuntimeError)
+        assert 'SUM(pts)' in results[0].df['query'][0]
+        assert 'MAX(pts)' in results[3].df['query'][0]
+
+    def test_results_carry_canonical_spec(self):
+        specs = [dict(metrics=['pts'], aggregations=['none'], histogram=10)]
+        result = self.g.get_many(specs)[0]
+        assert result.spec is specs[0]
+        assert result.canonical_spec['histogram'] == {'method': 'count', 'bins': 10, 'width': None}
+        assert result.canonical_spec['dimensions'] is None
+
+    def test_invalid_spec_raises_before_sending(self):
+        specs = [dict(metrics=['pts'], aggregations=['sum']),
+                 dict(metrics=['not_a_column'], aggregations=['sum'])]
+        with self.assertRaises(InvalidSpecException):
+            self.g.get_many(specs)
+        assert self.gbq.get_data.call_count == 0
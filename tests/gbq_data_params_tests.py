@@ -0,0 +1,37 @@
+import os
+import pandas as pd
+from stats import GBQData
+from stats.gbq_data import WrongBindException
+from tests.helpers import GBQDataTestCase
+
+
+class GBQDataParamsTests(GBQDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gbq.get_data.return_value = pd.DataFrame({'team_abbreviation': ['DEN'], 'sum_pts': [10]})
+
+    def test_bind_sends_same_query_with_new_params(self):
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error',
+                    cache_dir=os.path.join(self.tmp_dir.name, 'cache'))
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'],
+              filters=[('team_abbreviation', 'in', ['DEN', 'LAL'])], parameterized=True)
+        query = g.query
+        g.get()
+        assert self.gbq.get_data.call_args.kwargs['params']['team_abbreviation_in']['value'] == ['DEN', 'LAL']
+
+        g.bind(team_abbreviation_in=['BOS'])
+        g.get()
+        assert g.query == query
+        assert self.gbq.get_data.call_args.kwargs['query'] == query
+        assert self.gbq.get_data.call_args.kwargs['params']['team_abbreviation_in']['value'] == ['BOS']
+
+        # result of bound values is cached under the same spec as literal query
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'],
+              filters=[('team_abbreviation', 'eq', 'BOS')])
+        g.get()
+        assert self.gbq.get_data.call_count == 2
+
+    def test_bind_before_set(self):
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error')
+        with self.assertRaises(WrongBindException):
+            g.bind(pts_gt=1)
@@ -0,0 +1,24 @@
+import os
+import matplotlib.pyplot as plt
+import pandas as pd
+from stats import GBQData
+from tests.helpers import GBQDataTestCase
+
+
+class GBQDataRenderTests(GBQDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gbq.get_data.return_value = pd.DataFrame({'team_abbreviation': ['DEN', 'LAL'], 'sum_pts': [10, 20]})
+
+    def test_render_bytes_and_file(self):
+        g = GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error')
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'])
+        g.get(use_cache=False)
+
+        assert g.render('bar', format='svg').lstrip().startswith(b'<?xml')
+        path = os.path.join(self.tmp_dir.name, 'bar.png')
+        assert g.render('bar', dpi=50, path=path) is None
+        with open(path, 'rb') as f:
+            assert f.read(4) == b'\x89PNG'
+        assert list(g.df.columns) == ['team_abbreviation', 'sum_pts']
+        assert plt.get_fignums() == []
@@ -0,0 +1,82 @@
+import os
+import pandas as pd
+from stats import GBQData
+from stats.gbq_data import WrongRollupException
+from tests.helpers import GBQDataTestCase
+
+SCHEMA_DF = pd.DataFrame({'column_name': ['team_abbreviation', 'player_name', 'pts'],
+                          'data_type': ['STRING', 'STRING', 'INT64']})
+ROLLUP_DF = pd.DataFrame({'team_abbreviation': ['DEN', 'DEN', 'LAL'],
+                          'player_name': ['a', 'b', 'c'],
+                          'sum_pts': [10, 20, 30], 'count_pts': [1, 2, 3],
+                          'min_pts': [10, 5, 1], 'max_pts': [10, 15, 20]})
+
+
+class GBQDataRollupTests(GBQDataTestCase):
+    schema_df = SCHEMA_DF
+
+    def setUp(self):
+        super().setUp()
+        self.gbq.get_data.return_value = ROLLUP_DF
+
+    def _gbq_data(self):
+        return GBQData(gbq_path='p.d.t', sa_path=self.sa_path, log_level='error',
+                       rollup_dir=os.path.join(self.tmp_dir.name, 'rollups'))
+
+    def test_parquet_rollup_answers_locally(self):
+        g = self._gbq_data()
+        rollup = g.create_rollup('team_player', dimensions=['team_abbreviation', 'player_name'], metrics=['pts'],
+                                 target='parquet')
+        assert 'GROUP BY team_abbreviation, player_name' in self.gbq.get_data.call_args.kwargs['query']
+        assert rollup['num_rows'] == 3
+
+        # registry is read back from rollup_dir by new instance
+        g = self._gbq_data()
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum', 'min', 'avg'],
+              sort=('team_abbreviation', 'asc'))
+        df = g.get()
+        assert self.gbq.get_data.call_count == 1
+        assert df['sum_pts'].tolist() == [30, 30]
+        assert df['min_pts'].tolist() == [5, 1]
+        assert df['avg_pts'].tolist() == [10.0, 10.0]
+
+    def test_gbq_rollup_routing_and_staleness(self):
+        g = self._gbq_data()
+        g.create_rollup('team', dimensions=['team_abbreviation'], metrics=['pts'])
+        assert 'CREATE OR REPLACE TABLE `p.d.t__rollup_team`' in self.gbq.send_query.call_args.args[0]
+
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'])
+        assert 'FROM `p.d.t__rollup_team`' in g.query
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'], use_rollups=False)
+        assert 'FROM `p.d.t`' in g.query
+
+        # source table changed, rollup is not used until refreshed
+        self.table_info['modified'] = '2022-02-01T00:00:00+00:00'
+        g = self._gbq_data()
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'])
+        assert 'FROM `p.d.t`' in g.query
+        g.refresh_rollups()
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'])
+        assert 'FROM `p.d.t__rollup_team`' in g.query
+
+    def test_modified_table_stops_routing_of_same_instance(self):
+        g = self._gbq_data()
+        g.create_rollup('team', dimensions=['team_abbreviation'], metrics=['pts'])
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'])
+        assert 'FROM `p.d.t__rollup_team`' in g.query
+
+        # rows appended to the source table, same long-lived instance
+        self.table_info['modified'] = '2022-02-01T00:00:00+00:00'
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'])
+        assert 'FROM `p.d.t`' in g.query
+
+        self.gbq.get_table_info.side_effect = RuntimeError('api error')
+        g.set(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'])
+        assert 'FROM `p.d.t`' in g.query
+
+    def test_wrong_rollup(self):
+        g = self._gbq_data()
+        with self.assertRaises(WrongRollupException):
+            g.create_rollup('team-1', dimensions=['team_abbreviation'], metrics=['pts'])
+        with self.assertRaises(WrongRollupException):
+            g.create_rollup('team', dimensions=['team_abbreviation'], metrics=['pts'], target='csv')
@@ -0,0 +1,79 @@
+import unittest
+import logging
+from unittest import mock
+import pandas as pd
+import pyarrow as pa
+from google.cloud.bigquery.table import Row
+from stats.utils.gbq import GBQ
+
+
+class FakeRowIterator:
+    """
+    Stand-in for bigquery.table.RowIterator, serving both rows and arrow table
+    """
+    def __init__(self, data: dict, page_size: int = None):
+        self.data = data
+        self.page_size = page_size or len(next(iter(data.values())))
+        self.pages_fetched = 0
+
+    def __iter__(self):
+        cols = list(self.data.keys())
+        field_to_index = {c: i for i, c in enumerate(cols)}
+        for values in zip(*self.data.values()):
+            yield Row(values, field_to_index)
+
+    def to_arrow(self):
+        return pa.table(self.data)
+
+    def to_arrow_iterable(self):
+        for batch in pa.table(self.data).to_batches(max_chunksize=self.page_size):
+            self.pages_fetched += 1
+            yield batch
+
+    @property
+    def pages(self):
+        rows = list(self)
+        for i in range(0, len(rows), self.page_size):
+            self.pages_fetched += 1
+            yield rows[i:i + self.page_size]
+
+
+class GBQFetchTests(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.object(GBQ, '_init_bq'):
+            self.gbq = GBQ(project_id='project', sa_credentials='sa.json', logger=logging.getLogger('stats'))
+        self.data = {'team_abbreviation': ['DEN', 'LAL', 'BOS'], 'sum_pts': [10, 20, 30]}
+        self.gbq.send_query = mock.Mock(side_effect=self._fake_send_query)
+
+    def _fake_send_query(self, query, page_size=None, params=None):
+        self.rows = FakeRowIterator(self.data, page_size=page_size)
+        return self.rows
+
+    def test_arrow_matches_dicts(self):
+        df_arrow = self.gbq.get_data('SELECT 1', use_arrow=True)
+        df_dicts = self.gbq.get_data('SELECT 1', use_arrow=False)
+        pd.testing.assert_frame_equal(df_arrow, df_dicts)
+
+    def test_arrow_zero_copy(self):
+        df = self.gbq.get_data('SELECT 1', zero_copy=True)
+        assert df['sum_pts'].tolist() == [10, 20, 30]
+
+    def test_fallback_without_to_arrow(self):
+        self.gbq.send_query = mock.Mock(return_value=iter(FakeRowIterator(self.data)))
+        df = self.gbq.get_data('SELECT 1')
+        assert df.shape == (3, 2)
+
+    def test_iter_data_batches(self):
+        for use_arrow in [True, False]:
+            batches = list(self.gbq.iter_data('SELECT 1', page_size=2, use_arrow=use_arrow))
+            assert [b.shape[0] for b in batches] == [2, 1]
+            assert pd.concat(batches)['sum_pts'].tolist() == [10, 20, 30]
+
+    def test_iter_data_as_arrow(self):
+        batches = list(self.gbq.iter_data('SELECT 1', page_size=2, as_arrow=True))
+        assert all(isinstance(b, pa.RecordBatch) for b in batches)
+
+    def test_iter_data_early_stop(self):
+        for batch in self.gbq.iter_data('SELECT 1', page_size=1):
+            break
+        assert self.rows.pages_fetched == 1
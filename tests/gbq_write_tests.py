@@ -0,0 +1,123 @@
+import unittest
+import logging
+from unittest import mock
+import pandas as pd
+import pyarrow.parquet as pq
+from google.api_core.exceptions import ServiceUnavailable, BadRequest
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
+from stats.utils import GBQ
+
+
+class GBQBulkWriteTests(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.object(GBQ, '_init_bq'):
+            self.gbq = GBQ(project_id='p', sa_credentials='sa.json', logger=logging.getLogger('stats'))
+        self.gbq.client = mock.Mock()
+        self.loaded = list()
+        self.gbq.client.load_table_from_file.side_effect = self._fake_load
+        self.df = pd.DataFrame({'team_abbreviation': ['DEN', 'LAL', 'BOS'] * 10, 'pts': range(30)})
+
+    @staticmethod
+    def _fake_get_table(table_path):
+        # target doesnt exist, staging table was created by the first load
+        if '__staging_' not in table_path:
+            raise NotFound(table_path)
+        return bigquery.Table(table_path)
+
+    def _fake_load(self, buffer, destination, rewind=False, job_id=None, location=None, job_config=None):
+        buffer.seek(0)
+        self.loaded.append((destination, pq.read_table(buffer).to_pandas()))
+        return mock.Mock()
+
+    def test_chunks_loaded_to_staging_and_copied(self):
+        progress = list()
+        self.gbq.client.get_table.side_effect = self._fake_get_table
+        metrics = self.gbq.write_data(self.df, 'd', 't', chunk_rows=7, max_workers=2, progress=progress.append)
+
+        staging_paths = {destination for destination, _ in self.loaded}
+        assert staging_paths.__len__() == 1
+        staging_path = staging_paths.pop()
+        assert staging_path.startswith('p.d.t__staging_')
+        loaded_df = pd.concat([chunk for _, chunk in self.loaded]).sort_values('pts', ignore_index=True)
+        pd.testing.assert_frame_equal(loaded_df, self.df)
+
+        copy_args = self.gbq.client.copy_table.call_args
+        assert copy_args.args == (staging_path, 'p.d.t')
+        assert copy_args.kwargs['job_config'].write_disposition == 'WRITE_TRUNCATE'
+        self.gbq.client.delete_table.assert_called_with(staging_path, not_found_ok=True)
+
+        assert [p['chunks'] for p in progress] == [1, 2, 3, 4, 5]
+        assert progress[-1]['rows'] == 30
+        assert (metrics['rows'], metrics['chunks_total'], metrics['retries']) == (30, 5, 0)
+        assert metrics['bytes'] > 0
+
+    def test_append_uses_target_schema(self):
+        target = mock.Mock(schema=None, time_partitioning=None, range_partitioning=None, clustering_fields=None)
+        self.gbq.client.get_table.return_value = target
+        self.gbq.write_data(self.df, 'd', 't', chunk_rows=10)
+        assert self.gbq.client.create_table.call_count == 1
+        assert self.gbq.client.create_table.call_args.args[0].expires is not None
+        assert self.gbq.client.copy_table.call_args.kwargs['job_config'].write_disposition == 'WRITE_APPEND'
+
+    def test_replace_keeps_target_partitioning(self):
+        target = bigquery.Table('p.d.t')
+        target.time_partitioning = bigquery.TimePartitioning(field='game_date')
+        target.clustering_fields = ['team_abbreviation']
+        self.gbq.client.get_table.side_effect = lambda table_path: target if table_path == 'p.d.t' \
+            else bigquery.Table(table_path)
+        self.gbq.write_data(self.df, 'd', 't', if_exists='replace', chunk_rows=10)
+
+        job_config = self.gbq.client.load_table_from_file.call_args_list[0].kwargs['job_config']
+        assert job_config.time_partitioning.field == 'game_date'
+        assert job_config.clustering_fields == ['team_abbreviation']
+        assert job_config.schema is None
+        assert self.gbq.client.create_table.call_count == 0
+        staging, fields = self.gbq.client.update_table.call_args.args
+        assert (staging.expires is not None) and (fields == ['expires'])
+        assert self.gbq.client.copy_table.call_args.kwargs['job_config'].write_disposition == 'WRITE_TRUNCATE'
+
+    @mock.patch('stats.utils.gbq.time.sleep')
+    def test_failed_chunk_is_retried(self, sleep):
+        self.gbq.client.get_table.side_effect = self._fake_get_table
+        self.gbq.client.get_job.side_effect = NotFound('job')
+        self.gbq.client.load_table_from_file.side_effect = [ServiceUnavailable('down'), mock.Mock(), mock.Mock()]
+        metrics = self.gbq.write_data(self.df, 'd', 't', chunk_rows=15)
+        assert metrics['retries'] == 1
+        assert self.gbq.client.load_table_from_file.call_count == 3
+        job_ids = [c.kwargs['job_id'] for c in self.gbq.client.load_table_from_file.call_args_list]
+        assert job_ids[0].endswith('_0_0') and job_ids[1].endswith('_0_1') and job_ids[2].endswith('_15_0')
+
+    def test_succeeded_job_is_not_resent(self):
+        self.gbq.client.get_table.side_effect = self._fake_get_table
+        self.gbq.client.get_job.return_value = mock.Mock(state='DONE', error_result=None)
+        self.gbq.client.load_table_from_file.side_effect = [ConnectionError('polling failed'), mock.Mock()]
+        metrics = self.gbq.write_data(self.df, 'd', 't', chunk_rows=15)
+        assert self.gbq.client.load_table_from_file.call_count == 2
+        assert (metrics['rows'], metrics['retries']) == (30, 0)
+
+    def test_job_lookup_uses_dataset_location(self):
+        self.gbq.client.get_dataset.return_value = mock.Mock(location='asia-northeast1')
+        self.gbq.client.get_table.side_effect = self._fake_get_table
+        self.gbq.client.get_job.return_value = mock.Mock(state='DONE', error_result=None)
+        self.gbq.client.load_table_from_file.side_effect = [ConnectionError('polling failed'), mock.Mock()]
+        self.gbq.write_data(self.df, 'd', 't', chunk_rows=15)
+        self.gbq.client.get_dataset.assert_called_with('p.d')
+        assert self.gbq.client.get_job.call_args.kwargs['location'] == 'asia-northeast1'
+        locations = [c.kwargs['location'] for c in self.gbq.client.load_table_from_file.call_args_list]
+        assert locations == ['asia-northeast1', 'asia-northeast1']
+
+    def test_failure_doesnt_touch_target(self):
+        self.gbq.client.get_table.side_effect = self._fake_get_table
+        self.gbq.client.load_table_from_file.side_effect = [mock.Mock(), BadRequest('wrong schema'), mock.Mock()]
+        with self.assertRaises(BadRequest):
+            self.gbq.write_data(self.df, 'd', 't', chunk_rows=10, max_workers=1)
+        assert self.gbq.client.copy_table.call_count == 0
+        assert self.gbq.client.delete_table.call_args.args[0].startswith('p.d.t__staging_')
+
+    def test_wrong_bulk_parameters(self):
+        self.gbq.client.get_table.side_effect = self._fake_get_table
+        for params in [dict(chunk_rows=0), dict(chunk_rows=10, max_workers=0), dict(chunk_rows=10, max_retries=-1)]:
+            with self.assertRaises(ValueError):
+                self.gbq.write_data(self.df, 'd', 't', **params)
+        assert self.gbq.client.load_table_from_file.call_count == 0
@@ -0,0 +1,36 @@
+import unittest
+import os
+import tempfile
+from unittest import mock
+import pandas as pd
+from stats.utils import TableMetadataCache
+
+TABLE_INFO = {'modified': '2022-01-01T00:00:00+00:00', 'partitioning': None, 'clustering': None, 'num_rows': 1000}
+SCHEMA_DF = pd.DataFrame({'column_name': ['team_abbreviation', 'pts'], 'data_type': ['STRING', 'INT64']})
+
+
+class GBQDataTestCase(unittest.TestCase):
+    """
+    Base of GBQData tests with mocked GBQ class. Table metadata comes from table_info and schema_df,
+    which subclasses can override. self.table_info is a per test copy, changing it changes table metadata
+    returned from then on
+    """
+    table_info = TABLE_INFO
+    schema_df = SCHEMA_DF
+
+    def setUp(self):
+        TableMetadataCache._memory.clear()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.sa_path = os.path.join(self.tmp_dir.name, 'sa.json')
+        open(self.sa_path, 'w').close()
+        self.table_info = dict(self.table_info)
+        self.gbq_patch = mock.patch('stats.gbq_data.GBQ')
+        self.gbq_mock = self.gbq_patch.start()
+        self.gbq = self.gbq_mock.return_value
+        self.gbq.get_table_info.side_effect = lambda **kwargs: dict(self.table_info)
+        self.gbq.get_table_schema.return_value = self.schema_df
+
+    def tearDown(self):
+        self.gbq_patch.stop()
+        TableMetadataCache._memory.clear()
+        self.tmp_dir.cleanup()
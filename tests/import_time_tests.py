@@ -0,0 +1,30 @@
+import unittest
+import json
+import subprocess
+import sys
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from stats import GBQData
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed,
+                  'matplotlib': 'matplotlib' in sys.modules,
+                  'bigquery': 'google.cloud.bigquery' in sys.modules}))
+"""
+
+# generous budget, its meant to catch heavy imports sneaking back in, not to measure small differences
+MAX_IMPORT_SECONDS = 3.0
+
+
+class ImportTimeTests(unittest.TestCase):
+    def setUp(self):
+        out = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], capture_output=True, text=True, check=True)
+        self.result = json.loads(out.stdout.strip().splitlines()[-1])
+
+    def test_no_heavy_imports(self):
+        assert not self.result['matplotlib']
+        assert not self.result['bigquery']
+
+    def test_import_time(self):
+        assert self.result['elapsed'] < MAX_IMPORT_SECONDS, f"Importing stats took {self.result['elapsed']:.2f}s"
@@ -0,0 +1,93 @@
+import unittest
+import logging
+import numpy as np
+import pandas as pd
+from stats.query_builder import _QueryBuilder
+from stats.local_engine import _LocalEngine, cols_from_df
+
+
+class LocalEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('stats')
+        self.df = pd.DataFrame({'team_abbreviation': ['DEN', 'DEN', 'LAL', 'LAL', 'LAL', None],
+                                'player_name': ['a', 'b', 'c', 'd', 'c', 'e'],
+                                'pts': [10, 20, 30, 40, 50, 60],
+                                'fga': [1.0, np.nan, 3.0, 4.0, 5.0, 6.0]})
+
+    def _run(self, **params):
+        qb = _QueryBuilder(project_id='p', dataset_id='d', table_id='t', cols=cols_from_df(self.df),
+                           logger=self.logger, **params)
+        return _LocalEngine(query_builder=qb, df=self.df, logger=self.logger).run()
+
+    def test_group_sum_sort_limit(self):
+        df = self._run(dimensions=['team_abbreviation'], metrics=['pts', 'fga'], aggregations=['sum', 'count'],
+                       sort=('sum_pts', 'desc'), limit=2)
+        assert df.columns.tolist() == ['team_abbreviation', 'sum_pts', 'sum_fga', 'count_pts', 'count_fga']
+        assert df['team_abbreviation'][0] == 'LAL'
+        assert pd.isna(df['team_abbreviation'][1])
+        assert df['sum_pts'].tolist() == [120, 60]
+        assert df['count_fga'].tolist() == [3, 1]
+
+    def test_filters_skip_nulls(self):
+        df = self._run(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'],
+                       filters=[('team_abbreviation', 'ne', 'DEN'), ('fga', 'ge', 1)])
+        assert df['team_abbreviation'].tolist() == ['LAL']
+        assert df['sum_pts'].tolist() == [120]
+
+    def test_window_aggregations(self):
+        df = self._run(dimensions=['team_abbreviation'], metrics=['pts'],
+                       aggregations=['q1', 'median', 'q3', 'min_run', 'max_run', 'stdev'],
+                       sort=('team_abbreviation', 'asc'), filters=[('team_abbreviation', 'in', ['DEN', 'LAL'])])
+        lal = df[df['team_abbreviation'] == 'LAL'].iloc[0]
+        assert lal['median_pts'] == 40
+        assert lal['q1_pts'] == 35
+        assert lal['q3_pts'] == 45
+        assert lal['min_run_pts'] == 30
+        assert np.isclose(lal['stdev_pts'], np.std([30, 40, 50]))
+
+    def test_string_and_distinct_aggregations(self):
+        df = self._run(dimensions=['team_abbreviation'], metrics=['player_name'],
+                       aggregations=['count_distinct', 'array_agg_distinct'],
+                       filters=[('team_abbreviation', 'eq', 'LAL')])
+        assert df['count_distinct_player_name'].tolist() == [2]
+        assert df['array_agg_distinct_player_name'].tolist() == [['c', 'd']]
+
+    def test_none_aggregation(self):
+        df = self._run(dimensions=['player_name'], metrics=['pts'], aggregations=['none'],
+                       filters=[('pts', 'gt', 30)])
+        assert df.columns.tolist() == ['player_name', 'none_pts']
+        assert df.shape[0] == 3
+
+    def test_no_dimensions_on_empty_result(self):
+        df = self._run(metrics=['pts'], aggregations=['count', 'sum'], filters=[('pts', 'gt', 100)])
+        assert df.shape[0] == 1
+        assert df['count_pts'][0] == 0
+        assert pd.isna(df['sum_pts'][0])
+
+    def test_date_range(self):
+        self.df['game_date'] = pd.to_datetime(['2022-01-01', '2022-01-02', '2022-01-03',
+                                               '2022-01-04', '2022-01-05', '2022-01-06'])
+        qb = _QueryBuilder(project_id='p', dataset_id='d', table_id='t', cols=cols_from_df(self.df),
+                           logger=self.logger, metrics=['pts'], aggregations=['sum'],
+                           partitioning={'type': 'DAY', 'field': 'game_date'}, date_range=('2022-01-02', '2022-01-03'))
+        df = _LocalEngine(query_builder=qb, df=self.df, logger=self.logger).run()
+        assert df['sum_pts'].tolist() == [50]
+
+    def test_rollup_reaggregation_is_exact(self):
+        dims = ['team_abbreviation', 'player_name']
+        grouped = self.df.groupby(dims, dropna=False)
+        rollup_df = pd.DataFrame({f'{aggr}_{m}': (grouped[m].sum(min_count=1) if aggr == 'sum'
+                                                  else getattr(grouped[m], aggr)())
+                                  for aggr in ['sum', 'count', 'min', 'max'] for m in ['pts', 'fga']}).reset_index()
+        rollup = {'name': 'team_player', 'dimensions': dims, 'metrics': ['pts', 'fga'], 'target': 'parquet',
+                  'location': 'x.parquet', 'num_rows': rollup_df.shape[0], 'source_modified': 'x'}
+        params = dict(dimensions=['team_abbreviation'], metrics=['pts', 'fga'],
+                      aggregations=['sum', 'count', 'min', 'max', 'avg'], filters=[('player_name', 'ne', 'd')],
+                      sort=('sum_pts', 'desc'))
+        qb = _QueryBuilder(project_id='p', dataset_id='d', table_id='t', cols=cols_from_df(self.df),
+                           logger=self.logger, rollups=[rollup], **params)
+        assert qb.rollup is rollup
+
+        from_rollup = _LocalEngine(query_builder=qb, df=rollup_df, logger=self.logger, rollup=rollup).run()
+        from_rows = self._run(**params)
+        pd.testing.assert_frame_equal(from_rollup, from_rows, check_dtype=False)
@@ -0,0 +1,157 @@
+import unittest
+import logging
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from stats.plots import _Plots, WrongLabelRankException, WrongPlotTypeException, WrongRenderFormatException
+
+matplotlib.use('Agg')
+
+
+class PlotsTests(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('stats')
+        self.binned_df = pd.DataFrame({'team_abbreviation': ['DEN', 'DEN', 'LAL', 'LAL'],
+                                       'bin_start_pts': [0.0, 10.0, 0.0, 10.0],
+                                       'bin_end_pts': [10.0, 20.0, 10.0, 20.0],
+                                       'count_pts': [5, 3, 2, 7]})
+
+    def tearDown(self):
+        plt.close('all')
+
+    def _plots(self, df, dimensions, aggregations, **kwargs):
+        return _Plots(df=df, dimensions=dimensions, metrics=['pts'], aggregations=aggregations,
+                      logger=self.logger, **kwargs)
+
+    def test_prep_groups(self):
+        df = pd.DataFrame({'team_abbreviation': ['DEN', 'LAL', 'DEN'], 'season': [2021, 2022, 2021], 'pts': [1, 2, 3]})
+        x = self._plots(df, ['team_abbreviation', 'season'], ['sum'])._prep_groups()
+        assert x == 'group'
+        assert isinstance(df[x].dtype, pd.CategoricalDtype)
+        assert df[x].tolist() == ['DEN-2021', 'LAL-2022', 'DEN-2021']
+        assert df[x].cat.categories.__len__() == 2
+
+    def test_binned_hist(self):
+        self._plots(self.binned_df, ['team_abbreviation'], ['none'], histogram={'method': 'count'}).hist()
+        axes = plt.gcf().axes
+        assert axes.__len__() == 2
+        assert [p.get_height() for p in axes[1].patches] == [2, 7]
+
+    def test_hist_subplots_match_non_null_groups(self):
+        df = pd.DataFrame({'team_abbreviation': ['DEN', 'LAL', None, 'DEN'], 'sum_pts': [1, 2, 3, 4]})
+        self._plots(df, ['team_abbreviation'], ['sum']).hist()
+        axes = plt.gcf().axes
+        assert axes.__len__() == 2
+        assert all(ax.patches.__len__() > 0 for ax in axes)
+
+    def test_binned_hist_keeps_null_group(self):
+        df = self.binned_df.copy()
+        df['team_abbreviation'] = ['DEN', 'DEN', None, None]
+        self._plots(df, ['team_abbreviation'], ['none'], histogram={'method': 'count'}).hist()
+        axes = plt.gcf().axes
+        assert [ax.get_title() for ax in axes] == ['DEN', 'NULL']
+        assert [p.get_height() for p in axes[1].patches] == [2, 7]
+
+    def test_binned_histg(self):
+        self._plots(self.binned_df, ['team_abbreviation'], ['none'], histogram={'method': 'count'}).histg()
+        axes = plt.gcf().axes
+        assert axes.__len__() == 1
+        assert axes[0].patches.__len__() == 4
+
+    def test_binned_scatter(self):
+        df = pd.DataFrame({'kind': ['bin', 'bin', 'point'],
+                           'x_bin': [0, 1, 1],
+                           'y_bin': [0, 1, 0],
+                           'pts_start': [0.0, 5.0, 6.0], 'pts_end': [5.0, 10.0, 6.0],
+                           'fga_start': [0.0, 2.0, 1.0], 'fga_end': [2.0, 4.0, 1.0],
+                           'count': [10, 20, 1]})
+        plots = _Plots(df=df, dimensions=None, metrics=['pts', 'fga'], aggregations=['none'],
+                       logger=self.logger, scatter_bins={'bins': (2, 2), 'sparse': 1})
+        plots.scatter()
+        ax = plt.gcf().axes[0]
+        assert ax.collections[0].get_array().count() == 2
+        assert ax.collections[1].get_offsets().shape == (1, 2)
+
+    def test_boxplot_from_aggregations(self):
+        df = pd.DataFrame({'team_abbreviation': ['DEN', 'LAL'],
+                           'q1_pts': [10.0, 5.0], 'median_pts': [15.0, 8.0], 'q3_pts': [20.0, 9.0],
+                           'min_run_pts': [0.0, 4.0], 'max_run_pts': [50.0, 10.0]})
+        self._plots(df, ['team_abbreviation'], ['q1', 'median', 'q3', 'min_run', 'max_run']).boxplot()
+        y_values = {y for line in plt.gcf().axes[0].lines for y in line.get_ydata()}
+        assert {0.0, 35.0, 4.0, 10.0} <= y_values
+        assert 50.0 not in y_values
+
+    def test_boxplot_from_box_summary(self):
+        df = pd.DataFrame({'team_abbreviation': ['DEN'],
+                           'q1_pts': [10.0], 'median_pts': [15.0], 'q3_pts': [20.0],
+                           'whislo_pts': [2.0], 'whishi_pts': [33.0], 'n_fliers_pts': [1], 'fliers_pts': [[60.0]]})
+        self._plots(df, ['team_abbreviation'], ['none'], box_summary={'whis': 1.5, 'fliers': 50}).boxplot()
+        y_values = {y for line in plt.gcf().axes[0].lines for y in line.get_ydata()}
+        assert {2.0, 33.0, 60.0} <= y_values
+
+    def _labeled_scatter_df(self, n):
+        rng = np.random.default_rng(0)
+        return pd.DataFrame({'player_name': [f'player_{i}' for i in range(n)],
+                             'sum_pts': rng.normal(size=n),
+                             'sum_fga': rng.normal(size=n)})
+
+    def test_scatter_labels_culled(self):
+        df = self._labeled_scatter_df(20000)
+        plots = _Plots(df=df, dimensions=['player_name'], metrics=['pts', 'fga'], aggregations=['sum'],
+                       logger=self.logger)
+        plots.scatter(max_labels=30)
+        plt.gcf().canvas.draw()
+        ax = plt.gcf().axes[0]
+        # labels are drawn as a single collection of at most max_labels paths, not one Text artist per point
+        assert ax.texts.__len__() == 0
+        assert ax.collections.__len__() == 2
+        assert 0 < ax.collections[1].get_paths().__len__() <= 30
+
+    def test_scatter_labels_by_residuals(self):
+        df = pd.DataFrame({'player_name': ['a', 'b', 'c', 'd', 'outlier'],
+                           'sum_pts': [1.0, 2.0, 3.0, 4.0, 2.5],
+                           'sum_fga': [1.0, 2.0, 3.0, 4.0, 40.0]})
+        plots = _Plots(df=df, dimensions=['player_name'], metrics=['pts', 'fga'], aggregations=['sum'],
+                       logger=self.logger)
+        plots.scatter(max_labels=1, label_rank='residuals')
+        assert list(plt.gcf().axes[0].collections[1].get_offsets()[0]) == [2.5, 40.0]
+
+    def test_scatter_wrong_label_rank(self):
+        plots = _Plots(df=self._labeled_scatter_df(10), dimensions=['player_name'], metrics=['pts', 'fga'],
+                       aggregations=['sum'], logger=self.logger)
+        with self.assertRaises(WrongLabelRankException):
+            plots.scatter(label_rank='random')
+
+    def _agg_plots(self):
+        df = pd.DataFrame({'team_abbreviation': ['DEN', 'LAL', 'BOS'],
+                           'season': ['2021', '2021', '2022'],
+                           'q1_pts': [10.0, 5.0, 7.0], 'median_pts': [15.0, 8.0, 9.0], 'q3_pts': [20.0, 9.0, 12.0],
+                           'min_run_pts': [0.0, 4.0, 1.0], 'max_run_pts': [50.0, 10.0, 20.0]})
+        return _Plots(df=df, dimensions=['team_abbreviation', 'season'], metrics=['pts'],
+                      aggregations=['q1', 'median', 'q3', 'min_run', 'max_run'], logger=self.logger)
+
+    def test_render_headless(self):
+        for plot_type in ['bar', 'barh', 'boxplot', 'hist', 'histg', 'scatter']:
+            image = self._agg_plots().render(plot_type, format='png', dpi=50)
+            assert image.startswith(b'\x89PNG'), plot_type
+        svg = self._agg_plots().render('bar', format='svg')
+        assert b'<svg' in svg
+        assert plt.get_fignums() == []
+
+    def test_render_from_threads(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            images = list(executor.map(lambda _: self._agg_plots().render('boxplot', dpi=50), range(8)))
+        assert all(image.startswith(b'\x89PNG') for image in images)
+        assert plt.get_fignums() == []
+
+    def test_render_wrong_params(self):
+        with self.assertRaises(WrongPlotTypeException):
+            self._agg_plots().render('density')
+        with self.assertRaises(WrongRenderFormatException):
+            self._agg_plots().render('bar', format='jpg')
+
+    def test_plot_returns_figure(self):
+        fig = self._agg_plots().boxplot()
+        assert fig is plt.gcf()
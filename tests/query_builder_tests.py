@@ -0,0 +1,292 @@
+import unittest
+import datetime
+import logging
+from stats.query_builder import _QueryBuilder, UnprunedScanException, WrongDateRangeException, \
+    WrongHistogramException, WrongSampleException, WrongScatterBinsException, WrongBoxSummaryException, \
+    WrongBindException, WrongFilterException
+
+COLS = {'team_abbreviation': 'STRING', 'player_name': 'STRING', 'pts': 'INT64', 'fga': 'INT64', 'ast': 'INT64'}
+
+
+class QueryBuilderTests(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('stats')
+
+    def _qb(self, **params):
+        return _QueryBuilder(project_id='p', dataset_id='d', table_id='t', cols=COLS, logger=self.logger, **params)
+
+    def test_approximate_quantiles_group_by(self):
+        query = self._qb(dimensions=['team_abbreviation'], metrics=['pts'],
+                         aggregations=['q1', 'median', 'q3'], approximate=True).glue_query()
+        assert 'APPROX_QUANTILES(pts, 100)[OFFSET(50)] AS median_pts' in query
+        assert 'GROUP BY team_abbreviation' in query
+        assert 'OVER' not in query
+        assert 'DISTINCT' not in query
+
+    def test_approximate_count_distinct(self):
+        query = self._qb(metrics=['player_name'], aggregations=['count_distinct'], approximate=True).glue_query()
+        assert 'APPROX_COUNT_DISTINCT(player_name) AS count_distinct_player_name' in query
+
+    def test_approximate_allows_mixing_with_plain_aggregations(self):
+        query = self._qb(dimensions=['team_abbreviation'], metrics=['pts'],
+                         aggregations=['median', 'avg'], approximate=True).glue_query()
+        assert 'AVG(pts) AS avg_pts' in query
+        assert 'OVER' not in query
+
+    def test_mixed_window_and_plain_aggregations_single_scan(self):
+        query = self._qb(dimensions=['team_abbreviation', 'player_name'], metrics=['pts'],
+                         aggregations=['median', 'avg'], sort=('avg_pts', 'desc'), limit=10).glue_query()
+        assert query.count('`p.d.t`') == 1
+        assert 'PERCENTILE_CONT(pts, 0.5)  OVER(PARTITION BY team_abbreviation,player_name)  AS median_pts' in query
+        assert 'ANY_VALUE(median_pts) AS median_pts' in query
+        assert 'AVG(pts) AS avg_pts' in query
+        assert 'GROUP BY team_abbreviation,player_name' in query
+        assert query.index('GROUP BY') > query.index(')\n')
+
+    def test_mixed_aggregations_no_dimensions(self):
+        query = self._qb(metrics=['pts'], aggregations=['q1', 'sum']).glue_query()
+        assert 'PERCENTILE_CONT(pts, 0.25)  OVER()  AS q1_pts' in query
+        assert 'GROUP BY' not in query
+
+    def test_system_sample(self):
+        query = self._qb(metrics=['pts'], aggregations=['none'], sample=0.01).glue_query()
+        assert 'FROM `p.d.t` TABLESAMPLE SYSTEM (1.0 PERCENT)' in query
+
+    def test_hash_sample(self):
+        query = self._qb(metrics=['pts'], aggregations=['none'],
+                         sample={'rate': 0.1, 'method': 'hash', 'key': 'player_name'}).glue_query()
+        assert 'AND MOD(ABS(FARM_FINGERPRINT(CAST(player_name AS STRING))), 1000000) < 100000' in query
+
+    def test_stratified_sample(self):
+        query = self._qb(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['avg'],
+                         filters=[('fga', 'gt', 1)],
+                         sample={'rate': 0.1, 'method': 'hash', 'stratify': True, 'min_rows': 50}).glue_query()
+        assert 'ROW_NUMBER() OVER(PARTITION BY team_abbreviation' in query
+        assert 'WHERE __rn <= GREATEST(CEIL(__n * 0.1), 50)' in query
+        assert 'ANY_VALUE(sample_rate) AS sample_rate' in query
+        assert query.count('AND fga > 1') == 1
+
+    def test_wrong_sample(self):
+        for sample in [0, 1.5, {'rate': 0.1, 'method': 'bernoulli'}, {'rate': 0.1, 'stratify': True},
+                       {'rate': 0.1, 'method': 'hash', 'key': 'not_a_column'}]:
+            with self.assertRaises(WrongSampleException):
+                self._qb(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['avg'], sample=sample)
+
+    def test_histogram_fixed_count(self):
+        query = self._qb(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['none'],
+                         histogram=10).glue_query()
+        assert 'SELECT MIN(__value) AS __lo, MAX(__value) AS __hi FROM src' in query
+        assert 'COUNT(*) AS count_pts' in query
+        assert 'GROUP BY team_abbreviation, __bin' in query
+
+    def test_histogram_width_and_quantile(self):
+        query = self._qb(metrics=['pts'], aggregations=['none'],
+                         histogram={'method': 'width', 'width': 5}).glue_query()
+        assert 'CAST(FLOOR(__value / 5) AS INT64) AS __bin' in query
+        query = self._qb(metrics=['pts'], aggregations=['none'],
+                         histogram={'method': 'quantile', 'bins': 4}).glue_query()
+        assert 'APPROX_QUANTILES(__value, 4) AS __q' in query
+
+    def test_histogram_dimension_named_like_internal_column(self):
+        cols = dict(COLS, bin='STRING', value='INT64')
+        query = _QueryBuilder(project_id='p', dataset_id='d', table_id='t', cols=cols, logger=self.logger,
+                              dimensions=['bin'], metrics=['value'], aggregations=['none'],
+                              histogram={'method': 'width', 'width': 5}).glue_query()
+        assert 'SELECT bin, value AS __value' in query
+        assert 'GROUP BY bin, __bin' in query
+        assert 'AS bin_start_value' in query
+
+    def test_wrong_histogram(self):
+        with self.assertRaises(WrongHistogramException):
+            self._qb(metrics=['pts'], aggregations=['sum'], histogram=10)
+        with self.assertRaises(WrongHistogramException):
+            self._qb(metrics=['pts'], aggregations=['none'], histogram={'method': 'width'})
+
+    def test_scatter_bins(self):
+        query = self._qb(metrics=['pts', 'fga', 'ast'], aggregations=['none'],
+                         scatter_bins={'bins': (10, 20), 'sparse': 3}).glue_query()
+        assert 'COUNT(*) AS count, AVG(z) AS avg_ast' in query
+        assert 'LEAST(CAST(FLOOR(SAFE_DIVIDE(y - y_lo, ((y_hi - y_lo) / 20))) AS INT64), 19)' in query
+        assert 'WHERE grid.count <= 3' in query
+
+    def test_wrong_scatter_bins(self):
+        with self.assertRaises(WrongScatterBinsException):
+            self._qb(metrics=['pts'], aggregations=['none'], scatter_bins=10)
+        with self.assertRaises(WrongScatterBinsException):
+            self._qb(metrics=['pts', 'fga', 'player_name'], aggregations=['none'], scatter_bins=10)
+        with self.assertRaises(WrongScatterBinsException):
+            self._qb(dimensions=['team_abbreviation'], metrics=['pts', 'fga'], aggregations=['none'], scatter_bins=10)
+
+    def test_box_summary(self):
+        query = self._qb(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['none'],
+                         box_summary={'whis': 2, 'fliers': 5}).glue_query()
+        assert 'APPROX_QUANTILES(pts, 4) AS __q_pts' in query
+        assert '__q_pts[OFFSET(3)] + 2 * (__q_pts[OFFSET(3)] - __q_pts[OFFSET(1)]) AS __hi_pts' in query
+        assert 'COUNTIF((src.pts < stats.__lo_pts OR src.pts > stats.__hi_pts)) AS n_fliers_pts' in query
+        assert 'IGNORE NULLS LIMIT 5) AS fliers_pts' in query
+        assert 'TO_JSON_STRING(STRUCT(team_abbreviation)) AS __key' in query
+        assert 'JOIN stats ON src.__key = stats.__key' in query
+        assert 'IS NOT DISTINCT FROM' not in query
+        assert 'GROUP BY src.team_abbreviation' in query
+
+    def test_wrong_box_summary(self):
+        with self.assertRaises(WrongBoxSummaryException):
+            self._qb(metrics=['pts'], aggregations=['median'], box_summary=True)
+        with self.assertRaises(WrongBoxSummaryException):
+            self._qb(metrics=['pts'], aggregations=['none'], box_summary={'fliers': -1})
+
+
+class QueryBuilderRollupTests(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('stats')
+        self.rollups = [{'name': 'team_player', 'dimensions': ['team_abbreviation', 'player_name'],
+                         'metrics': ['pts', 'fga'], 'target': 'gbq', 'location': 'p.d.t__rollup_team_player',
+                         'num_rows': 500, 'source_modified': 'x'},
+                        {'name': 'team', 'dimensions': ['team_abbreviation'],
+                         'metrics': ['pts'], 'target': 'gbq', 'location': 'p.d.t__rollup_team',
+                         'num_rows': 30, 'source_modified': 'x'}]
+
+    def _qb(self, **params):
+        return _QueryBuilder(project_id='p', dataset_id='d', table_id='t', cols=COLS, logger=self.logger,
+                             rollups=self.rollups, **params)
+
+    def test_routes_to_smallest_rollup(self):
+        qb = self._qb(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum', 'avg'],
+                      filters=[('team_abbreviation', 'ne', 'DEN')], sort=('sum_pts', 'desc'))
+        assert qb.rollup['name'] == 'team'
+        query = qb.glue_query()
+        assert 'FROM `p.d.t__rollup_team`' in query
+        assert 'SUM(sum_pts) AS sum_pts' in query
+        assert 'SAFE_DIVIDE(SUM(sum_pts), SUM(count_pts)) AS avg_pts' in query
+        assert "AND team_abbreviation != 'DEN'" in query
+        assert 'GROUP BY team_abbreviation' in query
+        assert 'ORDER BY sum_pts DESC' in query
+
+    def test_routes_to_finer_rollup(self):
+        qb = self._qb(dimensions=['player_name'], metrics=['fga'], aggregations=['count', 'max'])
+        assert qb.rollup['name'] == 'team_player'
+        assert 'COALESCE(SUM(count_fga), 0) AS count_fga' in qb.glue_query()
+
+    def test_incompatible_specs_use_source_table(self):
+        assert self._qb(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['median']).rollup is None
+        assert self._qb(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'],
+                        filters=[('pts', 'gt', 10)]).rollup is None
+        assert self._qb(metrics=['pts'], aggregations=['none']).rollup is None
+        assert self._qb(dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'],
+                        sample=0.1).rollup is None
+
+
+class QueryBuilderPartitionTests(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('stats')
+        self.cols = dict(COLS, game_date='DATE', updated_at='TIMESTAMP')
+
+    def _qb(self, partitioning=None, **params):
+        partitioning = partitioning or {'type': 'DAY', 'field': 'game_date'}
+        return _QueryBuilder(project_id='p', dataset_id='d', table_id='t', cols=self.cols, logger=self.logger,
+                             partitioning=partitioning, clustering=['team_abbreviation', 'player_name'],
+                             dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'], **params)
+
+    def test_date_range_predicate(self):
+        query = self._qb(date_range=('2022-01-01', '2022-01-31')).glue_query()
+        assert "AND game_date BETWEEN DATE '2022-01-01' AND DATE '2022-01-31'" in query
+
+    def test_date_range_on_timestamp_partition(self):
+        query = self._qb(partitioning={'type': 'DAY', 'field': 'updated_at'},
+                         date_range=(datetime.date(2022, 1, 1), '2022-01-31')).glue_query()
+        assert "AND updated_at >= TIMESTAMP(DATE '2022-01-01')" in query
+        assert "AND updated_at < TIMESTAMP(DATE_ADD(DATE '2022-01-31', INTERVAL 1 DAY))" in query
+
+    def test_date_range_from_datetime(self):
+        qb = self._qb(date_range=(datetime.datetime(2022, 1, 1, 12, 30), datetime.datetime(2022, 1, 31)))
+        assert qb.date_range == ('2022-01-01', '2022-01-31')
+        assert "AND game_date BETWEEN DATE '2022-01-01' AND DATE '2022-01-31'" in qb.glue_query()
+
+    def test_partition_and_cluster_filters_first(self):
+        query = self._qb(filters=[('pts', 'gt', 10),
+                                  ('player_name', 'eq', 'a'),
+                                  ('team_abbreviation', 'eq', 'DEN'),
+                                  ('game_date', 'ge', '2022-01-01')]).glue_query()
+        positions = [query.index(f"AND {col}") for col in ['game_date', 'team_abbreviation', 'player_name', 'pts']]
+        assert positions == sorted(positions)
+
+    def test_unpruned_scan(self):
+        with self.assertLogs('stats', level='WARNING'):
+            self._qb()
+        with self.assertRaises(UnprunedScanException):
+            self._qb(partition_filter='require', filters=[('game_date', 'ne', '2022-01-01')])
+        self._qb(partition_filter='require', filters=[('game_date', 'eq', '2022-01-01')])
+
+    def test_wrong_date_range(self):
+        with self.assertRaises(WrongDateRangeException):
+            self._qb(date_range=('2022-02-01', '2022-01-01'))
+        with self.assertRaises(WrongDateRangeException):
+            _QueryBuilder(project_id='p', dataset_id='d', table_id='t', cols=self.cols, logger=self.logger,
+                          metrics=['pts'], aggregations=['sum'], date_range=('2022-01-01', '2022-01-02'))
+
+
+class QueryBuilderParamsTests(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('stats')
+
+    def _qb(self, **params):
+        return _QueryBuilder(project_id='p', dataset_id='d', table_id='t', cols=COLS, logger=self.logger,
+                             dimensions=['team_abbreviation'], metrics=['pts'], aggregations=['sum'], **params)
+
+    def test_literal_filters(self):
+        query = self._qb(filters=[('pts', 'in', [10, 20]), ('player_name', 'eq', "O'Neal")]).glue_query()
+        assert 'AND pts IN (10,20)' in query
+        assert "AND player_name = 'O\\'Neal'" in query
+
+    def test_parameterized_query(self):
+        qb = self._qb(filters=[('pts', 'gt', 10), ('pts', 'gt', 20), ('team_abbreviation', 'nin', ['DEN', 'LAL'])],
+                      parameterized=True)
+        query = qb.glue_query()
+        assert 'AND pts > @pts_gt ' in query
+        assert 'AND pts > @pts_gt_1 ' in query
+        assert 'AND team_abbreviation NOT IN UNNEST(@team_abbreviation_nin)' in query
+        assert "'DEN'" not in query
+        assert qb.get_query_params() == {'pts_gt': {'type': 'INT64', 'value': 10, 'array': False},
+                                         'pts_gt_1': {'type': 'INT64', 'value': 20, 'array': False},
+                                         'team_abbreviation_nin': {'type': 'STRING', 'value': ['DEN', 'LAL'],
+                                                                   'array': True}}
+        assert self._qb(filters=[('pts', 'gt', 10)]).get_query_params() == dict()
+
+    def test_bind_keeps_query(self):
+        qb = self._qb(filters=[('pts', 'gt', 10), ('team_abbreviation', 'in', ['DEN'])], parameterized=True)
+        query = qb.glue_query()
+        qb.bind(team_abbreviation_in=['LAL', 'BOS'])
+        assert qb.glue_query() == query
+        assert qb.filters == [('pts', 'gt', 10), ('team_abbreviation', 'in', ['LAL', 'BOS'])]
+        assert qb.get_query_params()['team_abbreviation_in']['value'] == ['LAL', 'BOS']
+        assert qb.get_spec()['filters'] == [['pts', 'gt', 10], ['team_abbreviation', 'in', ('BOS', 'LAL')]]
+
+    def test_param_type_from_value(self):
+        cols = dict(COLS, game_date='DATE', active='BOOL')
+        qb = _QueryBuilder(project_id='p', dataset_id='d', table_id='t', cols=cols, logger=self.logger,
+                           metrics=['pts'], aggregations=['sum'], parameterized=True,
+                           filters=[('pts', 'gt', 10.5), ('fga', 'in', [1, 2.5]), ('game_date', 'ge', '2022-01-01'),
+                                    ('active', 'eq', True), ('player_name', 'in', [])])
+        types = {name: p['type'] for name, p in qb.get_query_params().items()}
+        assert types == {'pts_gt': 'FLOAT64', 'fga_in': 'FLOAT64', 'game_date_ge': 'DATE', 'active_eq': 'BOOL',
+                         'player_name_in': 'STRING'}
+        qb.bind(pts_gt=10)
+        assert qb.get_query_params()['pts_gt'] == {'type': 'INT64', 'value': 10, 'array': False}
+
+    def test_bind_checks_column_type(self):
+        qb = self._qb(filters=[('pts', 'gt', 10), ('team_abbreviation', 'in', ['DEN'])], parameterized=True)
+        with self.assertRaises(WrongBindException):
+            qb.bind(pts_gt='abc')
+        with self.assertRaises(WrongBindException):
+            qb.bind(team_abbreviation_in=['DEN', 1])
+        qb.bind(pts_gt=10.5)
+        assert qb.filters[0] == ('pts', 'gt', 10.5)
+
+    def test_wrong_bind(self):
+        with self.assertRaises(WrongBindException):
+            self._qb(filters=[('pts', 'gt', 10)]).bind(pts_gt=5)
+        qb = self._qb(filters=[('pts', 'gt', 10)], parameterized=True)
+        with self.assertRaises(WrongBindException):
+            qb.bind(pts_lt=5)
+        with self.assertRaises(WrongFilterException):
+            qb.bind(pts_gt=[5, 6])
@@ -0,0 +1,75 @@
+import unittest
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from stats.utils import QueryCache
+from stats.query_builder import _QueryBuilder
+
+COLS = {'team_abbreviation': 'STRING', 'player_name': 'STRING', 'pts': 'INT64', 'fga': 'INT64'}
+
+
+class QueryCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('stats')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = QueryCache(cache_dir=self.tmp_dir.name, logger=self.logger)
+        self.df = pd.DataFrame({'team_abbreviation': ['DEN', 'LAL'], 'sum_pts': [10, 20]})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _spec(self, filters, table_id='traditional'):
+        qb = _QueryBuilder(project_id='project', dataset_id='dataset', table_id=table_id, cols=COLS,
+                           logger=self.logger, dimensions=['team_abbreviation'], metrics=['pts'],
+                           aggregations=['sum'], filters=filters)
+        return qb.get_spec()
+
+    def test_reordered_filters_collide(self):
+        spec1 = self._spec([('pts', 'gt', 10), ('team_abbreviation', 'in', ['LAL', 'DEN', 'LAL'])])
+        spec2 = self._spec([('team_abbreviation', 'in', ['DEN', 'LAL']), ('pts', 'gt', 10)])
+        assert QueryCache.make_key(spec1) == QueryCache.make_key(spec2)
+
+    def test_single_value_in_is_eq(self):
+        spec1 = self._spec([('team_abbreviation', 'in', ['DEN'])])
+        spec2 = self._spec([('team_abbreviation', 'eq', 'DEN')])
+        assert QueryCache.make_key(spec1) == QueryCache.make_key(spec2)
+
+    def test_concurrent_put_from_threads(self):
+        spec = self._spec(None)
+        big_df = pd.DataFrame({'team_abbreviation': ['DEN'] * 100000, 'sum_pts': range(100000)})
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: self.cache.put(spec, big_df), range(16)))
+        pd.testing.assert_frame_equal(self.cache.get(spec), big_df)
+        assert not [f for f in os.listdir(self.tmp_dir.name) if f.endswith('.tmp')]
+
+    def test_put_get(self):
+        spec = self._spec(None)
+        assert self.cache.get(spec) is None
+        self.cache.put(spec, self.df)
+        pd.testing.assert_frame_equal(self.cache.get(spec), self.df)
+
+    def test_ttl(self):
+        self.cache.ttl = -1
+        spec = self._spec(None)
+        self.cache.put(spec, self.df)
+        assert self.cache.get(spec) is None
+
+    def test_lru_eviction(self):
+        spec1 = self._spec([('pts', 'gt', 1)])
+        spec2 = self._spec([('pts', 'gt', 2)])
+        self.cache.put(spec1, self.df)
+        self.cache.max_bytes = self.cache._read_index()[QueryCache.make_key(spec1)]['size']
+        self.cache.put(spec2, self.df)
+        assert self.cache.get(spec1) is None
+        assert self.cache.get(spec2) is not None
+
+    def test_invalidate_table(self):
+        spec1 = self._spec(None, table_id='traditional')
+        spec2 = self._spec(None, table_id='advanced')
+        self.cache.put(spec1, self.df)
+        self.cache.put(spec2, self.df)
+        self.cache.invalidate(table='project.dataset.traditional')
+        assert self.cache.get(spec1) is None
+        assert self.cache.get(spec2) is not None
@@ -0,0 +1,47 @@
+import json
+import os
+from unittest import mock
+import pandas as pd
+from stats.gbq_data import GBQData
+from stats.report import ReportRunner, ReportSpecException, main
+from tests.helpers import GBQDataTestCase
+
+
+class ReportRunnerTests(GBQDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gbq.get_data.return_value = pd.DataFrame({'team_abbreviation': ['DEN', 'LAL'], 'sum_pts': [10, 20]})
+        self.report = {'table': 'p.d.t',
+                       'sa_path': self.sa_path,
+                       'charts': [{'set': {'dimensions': ['team_abbreviation'], 'metrics': ['pts'],
+                                           'aggregations': ['sum']},
+                                   'plots': [{'type': 'bar', 'path': os.path.join(self.tmp_dir.name, 'out', 'bar.png')},
+                                             {'type': 'barh', 'path': os.path.join(self.tmp_dir.name, 'barh.svg'),
+                                              'dpi': 50}]}]}
+
+    def test_run_writes_and_skips_unchanged(self):
+        summary = ReportRunner(self.report, max_renders=2, log_level='error').run()
+        assert (summary['written'], summary['unchanged'], summary['failed']) == (2, 0, 0)
+        assert os.path.isfile(os.path.join(self.tmp_dir.name, 'out', 'bar.png'))
+        assert summary['timings']['query']['tasks'] == 1
+        assert summary['timings']['render']['tasks'] == 2
+
+        summary = ReportRunner(self.report, max_renders=2, log_level='error').run()
+        assert (summary['written'], summary['unchanged'], summary['failed']) == (0, 2, 0)
+
+    def test_specs_validated_once(self):
+        with mock.patch.object(GBQData, '_make_query_builder', autospec=True,
+                               side_effect=GBQData._make_query_builder) as make_query_builder:
+            ReportRunner(self.report, max_renders=1, log_level='error').run()
+        assert make_query_builder.call_count == 1
+
+    def test_main_reads_json_spec(self):
+        spec_path = os.path.join(self.tmp_dir.name, 'report.json')
+        with open(spec_path, 'w') as f:
+            json.dump(self.report, f)
+        assert main([spec_path, '--max-renders', '1', '--log-level', 'error']) == 0
+
+    def test_invalid_spec(self):
+        with self.assertRaises(ReportSpecException):
+            ReportRunner({'table': 'p.d.t', 'sa_path': self.sa_path,
+                          'charts': [{'set': {}, 'plots': [{'type': 'bar', 'path': 'bar.jpg'}]}]})
@@ -0,0 +1,48 @@
+import unittest
+import logging
+import os
+import tempfile
+from unittest import mock
+import pandas as pd
+from stats import GBQData
+from stats.utils import TableMetadataCache
+
+TABLE_INFO = {'modified': '2022-01-01T00:00:00+00:00',
+              'partitioning': {'type': 'DAY', 'field': 'game_date'},
+              'clustering': ['team_abbreviation']}
+SCHEMA_DF = pd.DataFrame({'column_name': ['team_abbreviation', 'pts', 'game_date'],
+                          'data_type': ['STRING', 'INT64', 'DATE']})
+
+
+class TableMetadataCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('stats')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        TableMetadataCache._memory.clear()
+
+    def tearDown(self):
+        TableMetadataCache._memory.clear()
+        self.tmp_dir.cleanup()
+
+    def test_disk_cache_survives_process_memory(self):
+        cache = TableMetadataCache(logger=self.logger, metadata_dir=self.tmp_dir.name)
+        cache.put('p.d.t', dict(TABLE_INFO, cols={'pts': 'INT64'}))
+        TableMetadataCache._memory.clear()
+        assert cache.get('p.d.t', modified=TABLE_INFO['modified'])['cols'] == {'pts': 'INT64'}
+
+    def test_outdated_metadata(self):
+        cache = TableMetadataCache(logger=self.logger)
+        cache.put('p.d.t', dict(TABLE_INFO, cols={'pts': 'INT64'}))
+        assert cache.get('p.d.t', modified='2022-02-01T00:00:00+00:00') is None
+
+    def test_warm_start_runs_no_query(self):
+        sa_path = os.path.join(self.tmp_dir.name, 'sa.json')
+        open(sa_path, 'w').close()
+        with mock.patch('stats.gbq_data.GBQ') as gbq_mock:
+            gbq_mock.return_value.get_table_info.side_effect = lambda **kwargs: dict(TABLE_INFO)
+            gbq_mock.return_value.get_table_schema.return_value = SCHEMA_DF
+            for _ in range(3):
+                g = GBQData(gbq_path='p.d.t', sa_path=sa_path, log_level='error', metadata_dir=self.tmp_dir.name)
+            assert gbq_mock.return_value.get_table_schema.call_count == 1
+            assert g.cols == {'team_abbreviation': 'STRING', 'pts': 'INT64', 'game_date': 'DATE'}
+            assert g.table_meta['partitioning']['field'] == 'game_date'